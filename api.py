@@ -0,0 +1,278 @@
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+import datetime
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import data_functions
+import geography
+
+# -----------------------------------------------
+# Read-only JSON API for the dashboard aggregates
+#
+# A small asyncio HTTP server for other tools (the volunteer scheduler, grant reports) that need the numbers behind
+# the pages without rendering them. Endpoints answer from the same data_functions preps and persisted aggregates the
+# pages use, run on a thread pool so one slow request doesn't hold up the others.
+#
+# Every response carries an ETag made from the dataset version and the (normalized) request, and Cache-Control:
+# no-cache, so a client polling with If-None-Match gets an empty 304 without anything being computed until a new batch
+# is ingested or the source file changes. Computed bodies are kept in an LRU shared by every client.
+#
+# Endpoints (GET; start/end dates as YYYY-MM-DD, defaulting to the full history; kind is intake or out):
+#   /api/version
+#   /api/monthly_totals?start=&end=
+#   /api/types?kind=&start=&end=
+#   /api/breeds?kind=&start=&end=&species=
+#   /api/ages?kind=&start=&end=&species=
+#   /api/save_rate?start=&end=
+#   /api/regions?start=&end=&species=
+#
+# Usage: `python api.py [--host 127.0.0.1] [--port 8510] [--source fake_data.xlsx]`
+
+API_HOST = os.environ.get('SHELTER_DASH_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('SHELTER_DASH_API_PORT', 8510))
+
+MAX_RESPONSES = int(os.environ.get('SHELTER_DASH_API_CACHE', 256))
+
+API_WORKERS = int(os.environ.get('SHELTER_DASH_API_WORKERS', os.cpu_count() or 4))
+
+MAPPINGS = {'intake':data_functions.INTAKE_MAPPING, 'out':data_functions.OUTCOME_MAPPING}
+
+STATUS_TEXT = {200:'OK', 304:'Not Modified', 400:'Bad Request', 404:'Not Found', 405:'Method Not Allowed',
+               500:'Internal Server Error'}
+
+_RESPONSES = OrderedDict()
+_RESPONSES_LOCK = threading.Lock()
+
+_POOL = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix='api')
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def records(d):
+    return json.loads(d.to_json(orient='records', date_format='iso'))
+
+
+# -----------------------------------------------
+# Request parameters
+def parse_date(params, name, default):
+    if name not in params:
+        return default
+    try:
+        return datetime.datetime.strptime(params[name], '%Y-%m-%d')
+    except ValueError:
+        raise BadRequest(f"{name} must be a date as YYYY-MM-DD, got {params[name]!r}")
+
+
+def window_args(iodf, params, kind='intake'):
+    first, last = data_functions.date_bounds(iodf, kind)
+    start_date = parse_date(params, 'start', first.to_pydatetime().replace(hour=0, minute=0, second=0))
+    end_date = parse_date(params, 'end', last.to_pydatetime().replace(hour=0, minute=0, second=0))
+    if end_date < start_date:
+        raise BadRequest('end is before start')
+    return {'start_date':start_date, 'end_date':end_date}
+
+
+def kind_args(iodf, params):
+    kind = params.get('kind', 'intake')
+    if kind not in MAPPINGS:
+        raise BadRequest(f"kind must be one of {', '.join(MAPPINGS)}, got {kind!r}")
+    return {'kind':kind, **window_args(iodf, params, kind)}
+
+
+def species_args(iodf, params):
+    return {'species':params.get('species')}
+
+
+def month_firsts(start_date, end_date):
+    return (datetime.datetime(start_date.year, start_date.month, 1),
+            datetime.datetime(end_date.year, end_date.month, 1))
+
+
+# -----------------------------------------------
+# Endpoints - each returns the response's JSON data, from the preps the pages use
+def version_data(iodf):
+    first, last = data_functions.date_bounds(iodf, 'intake')
+    return {'first_date':first.strftime('%Y-%m-%d'), 'last_date':last.strftime('%Y-%m-%d'), 'animals':len(iodf)}
+
+
+def monthly_totals_data(iodf, start_date, end_date):
+    start_month, end_month = month_firsts(start_date, end_date)
+    occupancy = data_functions.occupancy_counts(iodf)
+    monthtot, bymonth_types = data_functions.monthly_in_out_data_prep(occupancy, start_month, end_month)
+    return {'monthly_totals':records(monthtot), 'monthly_types':records(bymonth_types)}
+
+
+def types_data(iodf, kind, start_date, end_date):
+    cube = data_functions.inout_cube_window(iodf, MAPPINGS[kind], start_date, end_date, date_for_comp=kind)
+    type_month, type_qtr = data_functions.inout_types_month_data_prep(cube, MAPPINGS[kind], date_for_comp=kind)
+    return {'types_month':records(type_month), 'types_quarter':records(type_qtr)}
+
+
+def breeds_data(iodf, kind, start_date, end_date, species=None):
+    start_month, end_month = month_firsts(start_date, end_date)
+    cube = data_functions.inout_cube_window(iodf, MAPPINGS[kind], start_date, end_date, date_for_comp=kind)
+    breeddf = data_functions.inout_breed_data_prep(cube, start_month, end_month, date_for_comp=kind)
+    if species is not None:
+        breeddf = breeddf[(breeddf.type == species).to_numpy()]
+    return {'breeds':records(breeddf)}
+
+
+def ages_data(iodf, kind, start_date, end_date, species=None):
+    start_month, end_month = month_firsts(start_date, end_date)
+    cube = data_functions.inout_cube_window(iodf, MAPPINGS[kind], start_date, end_date, date_for_comp=kind)
+    agedf = data_functions.inout_age_data_prep(cube, start_month, end_month, data_functions.AGE_GROUPS,
+                                               date_for_comp=kind)
+    if species is not None:
+        agedf = agedf[(agedf.type == species).to_numpy()]
+    return {'ages':records(agedf)}
+
+
+def save_rate_data(iodf, start_date, end_date):
+    outcome_animals, adopted_animals = data_functions.save_rate_counts(iodf, start_date, end_date)
+    total_outcome_animals, total_adopted_animals = data_functions.save_rate_counts(iodf)
+    return {'outcome_animals':int(outcome_animals), 'adopted_animals':int(adopted_animals),
+            'save_rate':adopted_animals / outcome_animals if outcome_animals > 0 else None,
+            'total_outcome_animals':int(total_outcome_animals), 'total_adopted_animals':int(total_adopted_animals),
+            'total_save_rate':total_adopted_animals / total_outcome_animals if total_outcome_animals > 0 else None}
+
+
+def regions_data(iodf, start_date, end_date, species=None):
+    start_month, end_month = month_firsts(start_date, end_date)
+    counts = geography.region_counts(iodf, 'intake')
+    by_region, unmatched = geography.region_window_counts(counts, start_month, end_month, species)
+    return {'regions':records(by_region), 'unmatched':unmatched}
+
+
+# path: (data function, argument parsers)
+ENDPOINTS = {'/api/version':(version_data, []),
+             '/api/monthly_totals':(monthly_totals_data, [window_args]),
+             '/api/types':(types_data, [kind_args]),
+             '/api/breeds':(breeds_data, [kind_args, species_args]),
+             '/api/ages':(ages_data, [kind_args, species_args]),
+             '/api/save_rate':(save_rate_data, [window_args]),
+             '/api/regions':(regions_data, [window_args, species_args])}
+
+
+# -----------------------------------------------
+# Responses
+def etag(version, path, args):
+    text = json.dumps([version, path, sorted((k, str(v)) for k, v in args.items())])
+    return f'"{hashlib.sha1(text.encode()).hexdigest()[:20]}"'
+
+
+def cached_body(key, build):
+    with _RESPONSES_LOCK:
+        if key in _RESPONSES:
+            _RESPONSES.move_to_end(key)
+            return _RESPONSES[key]
+
+    body = build()
+    with _RESPONSES_LOCK:
+        _RESPONSES[key] = body
+        if len(_RESPONSES) > MAX_RESPONSES:
+            _RESPONSES.popitem(last=False)
+    return body
+
+
+def json_body(data):
+    return json.dumps(data, default=str).encode()
+
+
+def request_args(source, path, params):
+    # the dataset, its version and the endpoint's arguments (raises BadRequest for invalid ones)
+    iodf = data_functions.shared_ins_outs(source)
+    func, parsers = ENDPOINTS[path]
+    args = {}
+    for parser in parsers:
+        args.update(parser(iodf, params))
+    return iodf, data_functions.dataset_version(iodf), func, args
+
+
+def endpoint_body(iodf, version, func, args):
+    data = func(iodf, **args)
+    response = {'version':version, 'args':{k:v.strftime('%Y-%m-%d') if isinstance(v, datetime.datetime) else v
+                                           for k, v in args.items()}, **data}
+    return json_body(response)
+
+
+async def respond(source, method, target, headers):
+    # (status, extra headers, body)
+    if method not in ('GET','HEAD'):
+        return 405, {'Allow':'GET, HEAD'}, json_body({'error':f'{method} is not supported'})
+
+    url = urlsplit(target)
+    if url.path not in ENDPOINTS:
+        return 404, {}, json_body({'error':f'no endpoint {url.path}', 'endpoints':sorted(ENDPOINTS)})
+    params = {k:v[-1] for k, v in parse_qs(url.query).items()}
+
+    loop = asyncio.get_running_loop()
+    try:
+        iodf, version, func, args = await loop.run_in_executor(_POOL, request_args, source, url.path, params)
+    except BadRequest as e:
+        return 400, {}, json_body({'error':str(e)})
+
+    tag = etag(version, url.path, args)
+    cache_headers = {'ETag':tag, 'Cache-Control':'no-cache'}
+    if tag in [t.strip() for t in headers.get('if-none-match', '').split(',')]:
+        return 304, cache_headers, b''
+
+    body = await loop.run_in_executor(_POOL, cached_body, (version, tag),
+                                      functools.partial(endpoint_body, iodf, version, func, args))
+    return 200, cache_headers, body
+
+
+async def handle(source, reader, writer):
+    try:
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            status, extra, body = await respond(source, method, target, headers)
+        except Exception as e:
+            status, extra, body = 500, {}, json_body({'error':f'{type(e).__name__}: {e}'})
+    except ValueError:
+        status, extra, body, method = 400, {}, json_body({'error':'malformed request'}), 'GET'
+
+    head = {'Content-Type':'application/json', 'Content-Length':str(len(body)), 'Connection':'close', **extra}
+    writer.write((f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n" +
+                  ''.join(f"{k}: {v}\r\n" for k, v in head.items()) + "\r\n").encode('latin-1'))
+    if method != 'HEAD':
+        writer.write(body)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host=API_HOST, port=API_PORT, source=data_functions.INS_OUTS_PATH):
+    # the dataset is loaded before the first request is accepted
+    await asyncio.get_running_loop().run_in_executor(_POOL, data_functions.shared_ins_outs, source)
+
+    server = await asyncio.start_server(functools.partial(handle, source), host, port)
+    print(f"serving the dashboard aggregates on http://{host}:{port}/api/", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the dashboard aggregates as a read-only JSON API')
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--source', default=data_functions.INS_OUTS_PATH)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.source))
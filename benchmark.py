@@ -0,0 +1,455 @@
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import data_functions
+import geography
+
+# -----------------------------------------------
+# Headless benchmarks for the dashboard data pipeline
+#
+# Runs every data_functions step, and each page's full pipeline, on synthetic shelter data (no Streamlit), and reports
+# wall time and peak memory (tracemalloc, in a second run) per step. Results can be saved as a baseline and later
+# runs compared against it, e.g.
+#
+#   python benchmark.py --sizes 10k 100k --save
+#   python benchmark.py --sizes 10k 100k --compare
+#
+# Timings only compare on the machine they were taken on, so the baseline (bench_baseline.json) isn't kept in git:
+# save one on the machine you compare on, before the change being measured.
+#
+# Files a run needs (the boundaries for the region steps, the DuckDB backend's Parquet copy) go in a temporary
+# directory that is removed once the size's steps have run.
+#
+# --sketch-accuracy instead reports how far the length of stay quantiles read from the monthly sketches are from the
+# exact per-animal ones, for a few bin resolutions (SHELTER_DASH_STAY_BINS sets the one the dashboard uses).
+#
+# The synthetic frames carry no dataset version, so memoization and the persisted aggregates are bypassed and every
+# step really runs - except the date and stay indexes, which are kept per frame (see data_functions) and so measured
+# separately by the build_* steps.
+
+BASELINE_PATH = 'bench_baseline.json'
+
+# a step is flagged when it gets this much slower (or bigger) than its baseline
+REGRESSION_TOLERANCE = 0.25
+
+SIZES = {'10k':10_000, '100k':100_000, '1M':1_000_000, '10M':10_000_000}
+
+# steps that only run when this tree has them
+OPTIONAL_STEPS = ['sql: write_table',
+                  'sql: build_occupancy_counts', 'sql: build_inout_cube (out)', 'sql: inout_cube_window',
+                  'sql: save_rate_counts',
+                  'inout_breed_line_plot (traces)', 'inout_age_line_plot (traces)',
+                  'inout_breed_line_plot (gl)', 'inout_age_line_plot (gl)', 'length_stay_sketch_plot',
+                  'length_stay_violin_plot (per animal)', 'region_map_plot (full resolution)',
+                  'region_map_plot (coarse)', 'region_map_plot (medium)', 'region_map_plot (fine)']
+
+# bins per doubling compared by --sketch-accuracy, and the smallest group (stays) whose quantiles are compared
+SKETCH_ACCURACY_BINS = [4, 8, 16, 32]
+SKETCH_ACCURACY_MIN_STAYS = 50
+
+INTAKE_MAPPING = data_functions.INTAKE_MAPPING
+
+OUTCOME_MAPPING = data_functions.OUTCOME_MAPPING
+
+
+# -----------------------------------------------
+# Synthetic data
+def zipf_choice(rng, names, n, a=1.3):
+    # a few very common values and a long tail, like breeds and agencies
+    weights = 1 / np.arange(1, len(names) + 1) ** a
+    return np.asarray(names, dtype=object)[rng.choice(len(names), size=n, p=weights / weights.sum())]
+
+
+def synthetic_ins_outs(n, years=10, seed=0):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2012-01-01')
+    end = start + np.timedelta64(int(years * 365.25), 'D')
+    span = (end - start).astype(int)
+
+    # intakes spread over the history with a summer peak
+    day = rng.integers(0, span, n)
+    day = np.where(rng.random(n) < 0.2, (day // 365) * 365 + rng.normal(180, 40, n).clip(0, 364).astype(int), day)
+    intake_date = start + np.clip(day, 0, span - 1).astype('timedelta64[D]')
+
+    animal_type = rng.choice(['Canine','Feline','Other'], size=n, p=[0.55, 0.40, 0.05])
+    breed = np.where(animal_type == 'Canine', zipf_choice(rng, [f'Dog Breed {i}' for i in range(300)], n),
+                     np.where(animal_type == 'Feline', zipf_choice(rng, [f'Cat Breed {i}' for i in range(60)], n),
+                              zipf_choice(rng, [f'Other Breed {i}' for i in range(20)], n)))
+
+    # age at intake: lots of litters, then adults with a long tail
+    age_days = np.where(rng.random(n) < 0.3, rng.integers(0, 180, n), rng.gamma(2.0, 900, n).astype(int))
+    birthday = intake_date - age_days.astype('timedelta64[D]')
+
+    # length of stay is log-normal (median around 3 weeks), and recent intakes are more likely to still be here
+    stay = np.ceil(rng.lognormal(3.0, 1.1, n)).astype(int)
+    out_date = intake_date + stay.astype('timedelta64[D]')
+    still_here = (out_date > end) | (rng.random(n) < 0.01)
+    out_date = np.where(still_here, np.datetime64('NaT'), out_date).astype('datetime64[ns]')
+
+    d = pd.DataFrame({'id':np.arange(n),
+                      'name':zipf_choice(rng, [f'Name {i}' for i in range(5000)], n, a=0.8),
+                      'type':animal_type,
+                      'breed':breed,
+                      'birthday':pd.to_datetime(birthday),
+                      'location':zipf_choice(rng, [f'Town {i}' for i in range(80)], n),
+                      'intake_date':pd.to_datetime(intake_date),
+                      'out_date':pd.to_datetime(out_date)})
+
+    intake_flags = ['intake_stray','intake_owner_giveup','intake_state_agency','intake_domestic_agency',
+                    'intake_intl_agency','intake_oie','intake_impound_seizure','intake_other']
+    intake_type = rng.choice(len(intake_flags), size=n, p=[0.45, 0.25, 0.06, 0.07, 0.02, 0.03, 0.07, 0.05])
+    outcome_type = rng.choice(len(data_functions.OUTCOME_FLAGS), size=n,
+                              p=[0.55, 0.15, 0.03, 0.04, 0.01, 0.06, 0.04, 0.03, 0.01, 0.06, 0.02])
+
+    for c in data_functions.FLAG_COLUMNS:
+        d[c] = np.int8(0)
+    for i, c in enumerate(intake_flags):
+        d[c] = (intake_type == i).astype('int8')
+    for i, c in enumerate(data_functions.OUTCOME_FLAGS):
+        d[c] = ((outcome_type == i) & ~still_here).astype('int8')
+
+    agencies = [f'Agency {i}' for i in range(40)]
+    intake_agency = d[['intake_state_agency','intake_domestic_agency','intake_intl_agency']].sum(axis=1) > 0
+    out_agency = d[['out_state_agency','out_domestic_agency','out_intl_agency']].sum(axis=1) > 0
+    d['intake_agency_name'] = np.where(intake_agency, zipf_choice(rng, agencies, n), None)
+    d['out_agency_name'] = np.where(out_agency, zipf_choice(rng, agencies, n), None)
+
+    return data_functions.compact_ins_outs(d)
+
+
+def synthetic_regions(names, path, vertices=2000, seed=0):
+    # a GeoJSON file with a wobbly outline for each town, laid out on a grid
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(len(names))))
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    features = []
+    for i, name in enumerate(names):
+        radius = 0.045 * (1 + 0.1 * np.sin(7 * angles) + 0.01 * rng.standard_normal(vertices))
+        ring = np.column_stack([-123 + 0.1 * (i % side) + radius * np.cos(angles),
+                                38 + 0.1 * (i // side) + radius * np.sin(angles)])
+        features.append({'type':'Feature', 'properties':{geography.REGION_KEY:name},
+                         'geometry':{'type':'Polygon', 'coordinates':[np.vstack([ring, ring[:1]]).tolist()]}})
+
+    with open(path, 'w') as f:
+        json.dump({'type':'FeatureCollection', 'features':features}, f)
+
+
+# -----------------------------------------------
+# Pipelines
+# the pages start from the enriched table (see data_functions.enrich_ins_outs)
+def general_pipeline(iodf, start_month, end_month, end_date):
+    stays = data_functions.date_filter_month_firsts(iodf, start_month, end_month)
+    occupancy = data_functions.occupancy_counts(iodf)
+    data_functions.monthly_in_out_data_prep(occupancy, start_month, end_month)
+    lastmonth = data_functions.month_snapshot_rows(stays, end_month)
+    data_functions.age_breakdown_asof_today_data_prep(iodf, end_date, rows=lastmonth)
+    data_functions.age_breakdown_asof_today_data_prep(iodf, end_date, rows=data_functions.stay_rows(stays))
+    data_functions.breed_breakdown_data_prep(iodf, rows=lastmonth)
+    data_functions.breed_breakdown_data_prep(iodf, rows=data_functions.stay_rows(stays))
+    sketches = data_functions.stay_sketches(iodf)
+    data_functions.length_stay_sketch_data_prep(data_functions.stay_distribution(sketches, end_month, end_month))
+    data_functions.length_stay_sketch_data_prep(data_functions.stay_distribution(sketches, start_month, end_month))
+
+
+def inout_pipeline(iodf, mapping, start_date, end_date, start_month, end_month, date_for_comp):
+    cube = data_functions.inout_cube_window(iodf, mapping, start_date, end_date, date_for_comp=date_for_comp)
+    data_functions.inout_heatmap_data_prep(cube, date_for_comp=date_for_comp)
+    data_functions.inout_types_month_data_prep(cube, mapping, date_for_comp=date_for_comp)
+    data_functions.inout_agencies_data_prep(cube, date_for_comp=date_for_comp)
+    breeddf = data_functions.inout_breed_data_prep(cube, start_month, end_month, date_for_comp=date_for_comp)
+    agedf = data_functions.inout_age_data_prep(cube, start_month, end_month, data_functions.AGE_GROUPS,
+                                               date_for_comp=date_for_comp)
+    for species in breeddf.type.unique():
+        data_functions.category_line_arrays(breeddf, species, 'breed', date_for_comp=date_for_comp)
+        data_functions.category_line_arrays(agedf, species, f'agecat_{date_for_comp}', date_for_comp=date_for_comp)
+
+
+def benchmark_steps(iodf, work_dir):
+    # (name, function) pairs, with the inputs each step needs prepared up front so only the step itself is measured.
+    # Any files they need are written under work_dir
+    end_date = iodf.intake_date.max().to_pydatetime()
+    start_date = end_date - datetime.timedelta(days=3 * 365)
+    start_month = datetime.datetime(start_date.year, start_date.month, 1)
+    end_month = datetime.datetime(end_date.year, end_date.month, 1)
+
+    compact = iodf
+    iodf = data_functions.enrich_ins_outs(compact)
+    stays = data_functions.date_filter_month_firsts(iodf, start_month, end_month)
+    occupancy = data_functions.occupancy_counts(iodf)
+    stay_index = data_functions.stay_index(iodf)
+    start_idx, end_idx = data_functions.month_index([start_month, end_month])
+    lastmonth = data_functions.month_snapshot_rows(stays, end_month)
+    outs = data_functions.date_rows(iodf, 'out', start_date, end_date)
+    cube = data_functions.inout_cube_window(iodf, INTAKE_MAPPING, start_date, end_date, date_for_comp='intake')
+    breeddf = data_functions.inout_breed_data_prep(cube, start_month, end_month, date_for_comp='intake')
+    species = breeddf.type.value_counts().index[0]
+    sketches = data_functions.build_stay_sketches(iodf)
+    stay_dist = data_functions.stay_distribution(sketches, start_month, end_month)
+    regions_path = os.path.join(work_dir, 'regions.geojson')
+    synthetic_regions(iodf['location'].cat.categories.tolist(), regions_path)
+    regions = geography.boundaries(regions_path)
+    region_counts = geography.build_region_counts(iodf, 'intake', path=regions_path)
+    by_region, _ = geography.region_window_counts(region_counts, start_month, end_month)
+
+    steps = [('enrich_ins_outs', lambda: data_functions.enrich_ins_outs(compact)),
+             ('build_date_index', lambda: data_functions.build_date_index(iodf, 'out')),
+             ('build_stay_index', lambda: data_functions.build_stay_index(iodf)),
+             ('stay_index_rows', lambda: data_functions.stay_index_rows(stay_index, start_idx, end_idx)),
+             ('date_filter_month_firsts', lambda: data_functions.date_filter_month_firsts(iodf, start_month,
+                                                                                          end_month)),
+             ('occupancy_counts', lambda: data_functions.occupancy_counts(iodf)),
+             ('monthly_in_out_data_prep', lambda: data_functions.monthly_in_out_data_prep(occupancy, start_month,
+                                                                                          end_month)),
+             ('month_snapshot_rows', lambda: data_functions.month_snapshot_rows(stays, end_month)),
+             ('date_rows', lambda: data_functions.date_rows(iodf, 'out', start_date, end_date)),
+             ('distinct_ids', lambda: data_functions.distinct_ids(iodf, rows=outs, flag='out_adopt')),
+             ('save_rate_counts', lambda: data_functions.save_rate_counts(iodf, start_date, end_date)),
+             ('age_breakdown_asof_today_data_prep', lambda: data_functions.age_breakdown_asof_today_data_prep(
+                 iodf, end_date, rows=lastmonth)),
+             ('build_stay_sketches', lambda: data_functions.build_stay_sketches(iodf)),
+             ('stay_distribution', lambda: data_functions.stay_distribution(sketches, start_month, end_month)),
+             ('length_stay_sketch_data_prep', lambda: data_functions.length_stay_sketch_data_prep(stay_dist)),
+             ('build_region_counts', lambda: geography.build_region_counts(iodf, 'intake', path=regions_path)),
+             ('region_window_counts', lambda: geography.region_window_counts(region_counts, start_month, end_month)),
+             ('build_inout_cube (intake)', lambda: data_functions.build_inout_cube(iodf, list(INTAKE_MAPPING),
+                                                                                   'intake')),
+             ('build_inout_cube (out)', lambda: data_functions.build_inout_cube(iodf, list(OUTCOME_MAPPING), 'out')),
+             ('inout_cube_window', lambda: data_functions.inout_cube_window(iodf, INTAKE_MAPPING, start_date,
+                                                                            end_date, date_for_comp='intake')),
+             ('inout_heatmap_data_prep', lambda: data_functions.inout_heatmap_data_prep(cube)),
+             ('inout_types_month_data_prep', lambda: data_functions.inout_types_month_data_prep(cube,
+                                                                                                INTAKE_MAPPING)),
+             ('inout_agencies_data_prep', lambda: data_functions.inout_agencies_data_prep(cube)),
+             ('inout_breed_data_prep', lambda: data_functions.inout_breed_data_prep(cube, start_month, end_month)),
+             ('inout_age_data_prep', lambda: data_functions.inout_age_data_prep(cube, start_month, end_month,
+                                                                                data_functions.AGE_GROUPS)),
+             ('category_line_arrays', lambda: data_functions.category_line_arrays(breeddf, species, 'breed')),
+             ('page: general', lambda: general_pipeline(iodf, start_month, end_month, end_date)),
+             ('page: intakes', lambda: inout_pipeline(iodf, INTAKE_MAPPING, start_date, end_date, start_month,
+                                                      end_month, 'intake')),
+             ('page: outcomes', lambda: inout_pipeline(iodf, OUTCOME_MAPPING, start_date, end_date, start_month,
+                                                       end_month, 'out'))]
+
+    steps.append(('breed_breakdown_data_prep',
+                  lambda: data_functions.breed_breakdown_data_prep(iodf, rows=lastmonth)))
+
+    # the same queries on the DuckDB backend, where duckdb is installed - on a versioned view of the frame, as the
+    # backend keeps a Parquet copy per dataset version (its own memory isn't seen by tracemalloc)
+    try:
+        import duckdb
+        import sql_backend
+    except ImportError:
+        pass
+    else:
+        versioned = iodf.copy(deep=False)
+        versioned.attrs = {'version':f'benchmark-{len(iodf)}'}
+        parquet_dir = os.path.join(work_dir, 'sql')
+        path = os.path.dirname(sql_backend.table_path(versioned, parquet_dir))
+        steps += [('sql: write_table', lambda: sql_backend.write_table(versioned, path)),
+                  ('sql: build_occupancy_counts', lambda: sql_backend.build_occupancy_counts(versioned,
+                                                                                           parquet_dir=parquet_dir)),
+                  ('sql: build_inout_cube (out)', lambda: sql_backend.build_inout_cube(
+                      versioned, list(OUTCOME_MAPPING), 'out', parquet_dir=parquet_dir)),
+                  ('sql: inout_cube_window', lambda: sql_backend.build_inout_cube(
+                      versioned, list(INTAKE_MAPPING), 'intake', start_date, end_date, parquet_dir=parquet_dir)),
+                  ('sql: save_rate_counts', lambda: sql_backend.save_rate_counts(versioned, start_date, end_date,
+                                                                                 parquet_dir=parquet_dir))]
+
+    # figure builders, serialized the way the dashboard ships them, when plotting is available in this environment
+    try:
+        import plotly.io as pio
+        import plotly.graph_objects as go
+        import line_plots
+        import stay_plots
+    except ImportError:
+        return steps
+
+    agedf = data_functions.inout_age_data_prep(cube, start_month, end_month, data_functions.AGE_GROUPS,
+                                               date_for_comp='intake')
+    breed_lines = data_functions.category_line_arrays(breeddf, species, 'breed')
+    age_lines = data_functions.category_line_arrays(agedf, species, 'agecat_intake')
+    for mode in ['traces','gl']:
+        steps += [(f'inout_breed_line_plot ({mode})', lambda mode=mode: pio.to_json(line_plots.inout_breed_line_plot(
+                      breed_lines, species, mode=mode), validate=False)),
+                  (f'inout_age_line_plot ({mode})', lambda mode=mode: pio.to_json(line_plots.inout_age_line_plot(
+                      age_lines, species, data_functions.AGE_GROUPS, mode=mode), validate=False))]
+
+    # length of stay from the merged sketches, against violins over every animal's stay in the same window (what the
+    # notebook drew)
+    summary, density = data_functions.length_stay_sketch_data_prep(stay_dist)
+    steps.append(('length_stay_sketch_plot', lambda: pio.to_json(stay_plots.length_stay_sketch_plot(
+        summary, density), validate=False)))
+    stays_window = window_stay_lengths(iodf, start_month, end_month)
+    steps.append(('length_stay_violin_plot (per animal)', lambda: pio.to_json(go.Figure(
+        [go.Violin(x=stays_window.agegroup[stays_window.type == s].astype(str),
+                   y=stays_window.days[stays_window.type == s] / data_functions.DAYS_PER_YEAR, side=side)
+         for s, side in [('Canine','negative'), ('Feline','positive')]]), validate=False)))
+
+    # region maps from the boundaries as read, and simplified for each detail level
+    try:
+        import geo_plots
+    except ImportError:
+        return steps
+
+    full = {'type':'FeatureCollection', 'features':[{'type':'Feature', 'properties':{geography.REGION_KEY:name},
+            'geometry':{'type':'MultiPolygon', 'coordinates':[[r.tolist() for r in p] for p in polygons]}}
+            for name, polygons in zip(regions['names'], regions['polygons'])]}
+    steps.append(('region_map_plot (full resolution)', lambda: pio.to_json(geo_plots.region_map_plot(
+        by_region, full), validate=False)))
+    for detail, tolerance in geography.TOLERANCES.items():
+        steps.append((f'region_map_plot ({detail})', lambda tolerance=tolerance: pio.to_json(geo_plots.region_map_plot(
+            by_region, geography.simplify_features(regions['names'], regions['polygons'], tolerance)),
+            validate=False)))
+
+    return steps
+
+
+def window_stay_lengths(iodf, start_month, end_month):
+    # every animal's stay ending in [start_month, end_month] (the exact values the sketches approximate)
+    lengths = data_functions.stay_lengths(iodf)
+    start_idx, end_idx = data_functions.month_index([start_month, end_month])
+    months = lengths.month_idx.to_numpy()
+    return lengths[(months >= start_idx) & (months <= end_idx)]
+
+
+# -----------------------------------------------
+# Length of stay sketch accuracy
+def sketch_accuracy(iodf, bins_list=SKETCH_ACCURACY_BINS, qs=(.25, .5, .75, .9)):
+    # relative error of the quartiles (and p90) read from the merged sketches, against the exact per-animal
+    # quantiles, over every type x age group with at least SKETCH_ACCURACY_MIN_STAYS stays in a 3 year window
+    iodf = data_functions.enrich_ins_outs(iodf)
+    end_date = iodf.intake_date.max().to_pydatetime()
+    start_date = end_date - datetime.timedelta(days=3 * 365)
+    start_month = datetime.datetime(start_date.year, start_date.month, 1)
+    end_month = datetime.datetime(end_date.year, end_date.month, 1)
+
+    exact = {}
+    for (species, agegroup), g in window_stay_lengths(iodf, start_month, end_month).groupby(['type','agegroup'],
+                                                                                          observed=True):
+        if len(g) >= SKETCH_ACCURACY_MIN_STAYS:
+            exact[(species, agegroup)] = np.quantile(g.days.to_numpy(), qs)
+
+    report = []
+    for bins in bins_list:
+        sketches = data_functions.build_stay_sketches(iodf, bins)
+        dist = data_functions.stay_distribution(sketches, start_month, end_month, bins)
+        errors = []
+        for (species, agegroup), g in dist.groupby(['type','agegroup'], observed=True):
+            if (species, agegroup) in exact:
+                approx = data_functions.sketch_quantiles(g.lo.to_numpy(), g.hi.to_numpy(), g['count'].to_numpy(), qs)
+                errors.append(np.abs(approx - exact[(species, agegroup)]) / np.maximum(exact[(species, agegroup)], 1))
+        errors = np.concatenate(errors) if len(errors) > 0 else np.array([np.nan])
+        report.append({'bins_per_doubling':bins, 'sketch_rows':len(sketches), 'groups':len(exact),
+                       'median_error':np.median(errors), 'max_error':errors.max()})
+
+    return pd.DataFrame(report)
+
+
+# -----------------------------------------------
+# Measuring
+def measure(func, repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    value = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    res = {'seconds':min(times), 'peak_mb':peak / 1024**2}
+
+    # serialized figures also report what would be sent to the browser
+    if isinstance(value, str):
+        res['payload_kb'] = len(value.encode()) / 1024
+
+    return res
+
+
+def run(sizes, repeat=1):
+    results = {}
+    for label in sizes:
+        start = time.perf_counter()
+        iodf = synthetic_ins_outs(SIZES[label])
+        print(f"\n{label} animals (generated in {time.perf_counter() - start:.1f}s, "
+              f"{iodf.memory_usage(deep=True).sum() / 1024**2:,.0f} MB)")
+
+        results[label] = {}
+        with tempfile.TemporaryDirectory(prefix='shelter-bench-') as work_dir:
+            steps = benchmark_steps(iodf, work_dir)
+            for name, func in steps:
+                results[label][name] = measure(func, repeat)
+                res = results[label][name]
+                payload = f" {res['payload_kb']:>10,.0f} KB sent" if 'payload_kb' in res else ''
+                print(f"  {name:<40} {res['seconds']:>9.3f}s {res['peak_mb']:>10.1f} MB{payload}")
+
+        missing = [name for name in OPTIONAL_STEPS if name not in dict(steps)]
+        if missing:
+            print(f"  (not available here: {', '.join(missing)})")
+
+    return results
+
+
+def compare(results, baseline):
+    regressions = []
+    for label, steps in results.items():
+        for name, res in steps.items():
+            base = baseline.get(label, {}).get(name)
+            if base is None:
+                continue
+            for metric in ['seconds','peak_mb','payload_kb']:
+                if metric not in res or metric not in base:
+                    continue
+                if res[metric] > base[metric] * (1 + REGRESSION_TOLERANCE) and res[metric] - base[metric] > 0.01:
+                    regressions.append(f"{label} {name}: {metric} {base[metric]:.3f} -> {res[metric]:.3f}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard data pipeline on synthetic data')
+    parser.add_argument('--sizes', nargs='+', default=['10k','100k'], choices=list(SIZES.keys()))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per step (the fastest is kept)')
+    parser.add_argument('--save', action='store_true', help=f'save the results as the baseline ({BASELINE_PATH})')
+    parser.add_argument('--compare', action='store_true', help='compare against the saved baseline')
+    parser.add_argument('--sketch-accuracy', action='store_true',
+                        help='only report the length of stay sketch accuracy against the exact per-animal quantiles')
+    args = parser.parse_args()
+
+    if args.sketch_accuracy:
+        for label in args.sizes:
+            print(f"\n{label} animals")
+            print(sketch_accuracy(synthetic_ins_outs(SIZES[label])).to_string(index=False))
+        sys.exit(0)
+
+    results = run(args.sizes, args.repeat)
+
+    if args.compare:
+        if not os.path.exists(BASELINE_PATH):
+            sys.exit(f"no baseline at {BASELINE_PATH}, save one on this machine first with --save")
+        with open(BASELINE_PATH) as f:
+            regressions = compare(results, json.load(f))
+        print('\nregressions:' if regressions else '\nno regressions')
+        for r in regressions:
+            print(f"  {r}")
+        if regressions:
+            sys.exit(1)
+
+    if args.save:
+        baseline = {}
+        try:
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        except OSError:
+            pass
+        baseline.update(results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2)
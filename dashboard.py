@@ -1,59 +1,74 @@
+import profiling
+profiling.startup_begin()
+
 import streamlit as st
-import pandas as pd
 import datetime
-from datetime import timedelta
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.graph_objs import *
-from plotly.graph_objs.scatter.marker import Line
-from plotly.subplots import make_subplots
-import numpy as np
-import plot_settings
 from multiapp import MultiApp
-import plot_functions
 import data_functions
+import geography
+import partitions
+import sections
 import calendar
 
+profiling.startup_mark('imports')
+
 st.set_page_config(layout="wide")
 
+# time the data preps and aggregate builds, for the sidebar profile (only recorded when it's switched on)
+profiling.instrument(data_functions, geography)
+
+
 # -----------------------------------------------
-# Load the in/out data
-iodf = data_functions.data_ins_outs()
+# Plotting and the in/out data are only loaded by the pages that need them, so the Notes page comes up without either
+def plotting_modules():
+    import plot_functions
+    import line_plots
+    import stay_plots
+    profiling.instrument(plot_functions, line_plots, stay_plots)
+    return plot_functions, line_plots, stay_plots
+
+
+def geo_plotting_module():
+    import geo_plots
+    profiling.instrument(geo_plots)
+    return geo_plots
+
+
+ALL_SHELTERS = 'All shelters'
+
+
+def page_data():
+    # loaded once per process on first use, then shared by every session. With a shelters directory the sidebar picks
+    # one shelter's table, or every shelter at once - see partitions.py
+    shelters = partitions.shelter_sources()
+    if len(shelters) == 0:
+        iodf = data_functions.shared_ins_outs()
+    else:
+        shelter = st.sidebar.selectbox('Shelter', [ALL_SHELTERS] + list(shelters), index=0, key='shelter')
+        iodf = partitions.Coalition(shelters) if shelter == ALL_SHELTERS else \
+            data_functions.shared_ins_outs(shelters[shelter])
+    profiling.startup_mark('data')
+    return iodf
+
 
 # -----------------------------------------------
 # Common dictionaries/variables
-INTAKE_MAPPING = {'intake_domestic_agency':'Other Agency',
-                  'intake_impound_seizure':'Impound/Seizure',
-                  'intake_intl_agency':'Other Agency',
-                  'intake_oie':'Owner Intended Euth.',
-                  'intake_other':'Other',
-                  'intake_owner_giveup':'Owner Give-Up',
-                  'intake_state_agency':'Other Agency',
-                  'intake_stray':'Stray'}
-
-OUTCOME_MAPPING = {'out_adopt':'Adopted',
-                   'out_return_owner':'Return to Owner',
-                   'out_state_agency':'Other Agency',
-                   'out_domestic_agency':'Other Agency',
-                   'out_intl_agency':'Other Agency',
-                   'out_return_field':'Return to Field',
-                   'out_other':'Other',
-                   'died_in_care':'Died in Care',
-                   'lost_in_care':'Lost in Care',
-                   'euthanasia':'Euthanized',
-                   'oie':'Euthanized'}
-
-AGE_GROUPS = ['0-1 Wk','2-7 Wks','2-5 Mos','6-11 Mos','1 Yr','2 Yrs','3 Yrs','4 Yrs','5 Yrs','6 Yrs','7 Yrs',
-              '8 Yrs','9 Yrs','10 Yrs','11 Yrs','12 Yrs','13 Yrs','14 Yrs','15 Yrs','16 Yrs','17 Yrs','18 Yrs',
-              '19 Yrs','20 Yrs']
+INTAKE_MAPPING = data_functions.INTAKE_MAPPING
+
+OUTCOME_MAPPING = data_functions.OUTCOME_MAPPING
+
+AGE_GROUPS = data_functions.AGE_GROUPS
 
 # -----------------------------------------------
 # Sidebar inputs
 
 # -----------------------------------------------
 # 1st: General summary page
-def general_page(iodf):
+def general_page():
     st.title('General Summary')
+    iodf = page_data()
+    plot_functions, _, stay_plots = plotting_modules()
+    first_date, last_date = data_functions.date_bounds(iodf, 'intake')
 
     # -----------------------------------------------
     # SIDEBAR INPUTS
@@ -61,13 +76,13 @@ def general_page(iodf):
     with st.sidebar.form(key='date_form_general'):
         st.write('<b>Date Inputs</b>', unsafe_allow_html=True)
         start_date = st.date_input('Choose a start date',
-                                          value=iodf.intake_date.min(),
-                                          min_value=iodf.intake_date.min(),
+                                          value=first_date,
+                                          min_value=first_date,
                                           max_value=datetime.datetime.today(),
                                           key='start_general')
         end_date = st.date_input('Choose an end date',
-                                        value=iodf.intake_date.max(),
-                                        min_value=iodf.intake_date.min(),
+                                        value=last_date,
+                                        min_value=first_date,
                                         max_value=datetime.datetime.today(),
                                         key='end_general')
 
@@ -85,19 +100,20 @@ def general_page(iodf):
 
         submit_button_first = st.form_submit_button('Submit', help='Press to recalculate')
 
-    # add some columns to the in/out df
-    iodf = data_functions.add_columns_ins_outs(iodf)
-
-    # expand dataframe to have 1 row per month for every month each pet is in the shelter, and then filter to just the
-    # months that are chosen in the inputs
-    bymonth = data_functions.date_filter_month_firsts(iodf, start_month, end_month)
+    # get the start and end month of every stay that overlaps the months chosen in the inputs (1 row per pet, the
+    # months in between are counted from these intervals rather than expanded into rows) - all shelters at once only
+    # have their merged counts, no rows
+    coalition = data_functions.coalition(iodf)
+    if coalition is None:
+        stays = data_functions.date_filter_month_firsts(iodf, start_month, end_month)
     # -----------------------------------------------
 
     # TOTAL ANIMALS EXPANDER
-    total_animals_expander = st.beta_expander('How many animals are in the shelter?', expanded=True)
+    total_animals_expander = profiling.expander('How many animals are in the shelter?', expanded=True)
     with total_animals_expander:
         # do data manipulations for waterfall plot
-        monthtot, bymonth, bymonth_types = data_functions.monthly_in_out_data_prep(bymonth)
+        occupancy = data_functions.occupancy_counts(iodf)
+        monthtot, bymonth_types = data_functions.monthly_in_out_data_prep(occupancy, start_month, end_month)
 
         # create waterfall plot
         plot_functions.monthly_in_out_waterfall_plot(monthtot)
@@ -105,55 +121,85 @@ def general_page(iodf):
         # create in/out bar plot
         plot_functions.monthly_in_out_bar_plot(bymonth_types)
 
-    # create a df with just the animals from the last month chosen - to be used in all below analysis on this page
-    lastmonth = bymonth[bymonth.months == end_month]
+    # the animals from the last month chosen, and the pets in the shelter during the chosen timeframe (1 row per pet),
+    # as row positions into the shared iodf - used in all below analysis on this page
+    if coalition is None:
+        lastmonth = data_functions.month_snapshot_rows(stays, end_month)
+        history = data_functions.stay_rows(stays)
+
+    # collapsed sections below only run once opened, and keep their results for these inputs
+    params = (data_functions.dataset_version(iodf), start_date, end_date)
 
-    # filter the main iodf to just the months chosen in the inputs - do this by using the already date filtered bymonth
-    # dataframe, and then selecting only the pets in bymonth from iodf using their id number... that way, iodf will now
-    # be 1 row per pet only for those pets in the shelter during the chosen timeframe
-    iodf = iodf[iodf['id'].isin(bymonth['id'])]
+    # start the preps on the worker pool for the sections that are open (module level functions, so a process pool
+    # can run them too)
+    sections.prefetch_section('general_age', 'general_age_prep', params, data_functions.general_age_data_prep,
+                              iodf, start_month, end_month, end_date)
+    sections.prefetch_section('general_length', 'general_length_prep', params,
+                              data_functions.general_length_data_prep, iodf, start_month, end_month)
 
     # AGE EXPANDER
-    age_expander = st.beta_expander('How old are animals in the shelter?', expanded=False)
+    age_expander = profiling.expander('How old are animals in the shelter?', expanded=False)
     with age_expander:
-        lastmonth, lastmo_age = data_functions.age_breakdown_asof_today_data_prep(lastmonth, end_date)
-        iodf, hist_age = data_functions.age_breakdown_asof_today_data_prep(iodf, end_date)
+        if sections.section_is_open('general_age'):
+            (lastmonth_age, lastmo_age), (iodf_age, hist_age) = \
+                sections.section_result('general_age_prep', params, data_functions.general_age_data_prep, iodf,
+                                        start_month, end_month, end_date)
 
-        age_lastmo = plot_functions.age_breakdown_bar_plot(lastmo_age, period='lastmonth')
-        st.plotly_chart(age_lastmo, use_container_width=True)
+            age_lastmo = sections.section_result('general_age_lastmo', params, plot_functions.age_breakdown_bar_plot,
+                                                 lastmo_age, period='lastmonth')
+            st.plotly_chart(age_lastmo, use_container_width=True)
 
-        age_hist = plot_functions.age_breakdown_bar_plot(hist_age, period='history')
-        st.plotly_chart(age_hist, use_container_width=True)
+            age_hist = sections.section_result('general_age_hist', params, plot_functions.age_breakdown_bar_plot,
+                                               hist_age, period='history')
+            st.plotly_chart(age_hist, use_container_width=True)
 
     # LENGTH OF STAY EXPANDER
-    length_stay_expander = st.beta_expander('How long do animals stay in the shelter?', expanded=False)
+    length_stay_expander = profiling.expander('How long do animals stay in the shelter?', expanded=False)
     with length_stay_expander:
-        lastmonth = data_functions.length_stay_violin_data_prep(lastmonth)
-        iodf = data_functions.length_stay_violin_data_prep(iodf)
+        if sections.section_is_open('general_length'):
+            (lastmo_summary, lastmo_density), (hist_summary, hist_density) = \
+                sections.section_result('general_length_prep', params, data_functions.general_length_data_prep, iodf,
+                                        start_month, end_month)
 
-        length_lastmo = plot_functions.length_stay_violin_plot(lastmonth, period='lastmonth')
-        st.plotly_chart(length_lastmo, use_container_width=True)
+            length_lastmo = sections.section_result('general_length_lastmo', params,
+                                                    stay_plots.length_stay_sketch_plot, lastmo_summary,
+                                                    lastmo_density, period='lastmonth')
+            st.plotly_chart(length_lastmo, use_container_width=True)
 
-        length_hist = plot_functions.length_stay_violin_plot(iodf, period='history')
-        st.plotly_chart(length_hist, use_container_width=True)
+            length_hist = sections.section_result('general_length_hist', params,
+                                                  stay_plots.length_stay_sketch_plot, hist_summary, hist_density,
+                                                  period='history')
+            st.plotly_chart(length_hist, use_container_width=True)
 
     # BREED EXPANDER
-    breed_expander = st.beta_expander('What breeds of animals are in the shelter?', expanded=False)
+    breed_expander = profiling.expander('What breeds of animals are in the shelter?', expanded=False)
     with breed_expander:
-        lastmo_breed = data_functions.breed_breakdown_data_prep(lastmonth)
-        hist_breed = data_functions.breed_breakdown_data_prep(iodf)
-
-        breed1, breed2 = st.beta_columns((.5, .5))
-        breed_lastmo = plot_functions.breed_breakdown_bar_plot(lastmo_breed, period='lastmonth')
-        breed1.plotly_chart(breed_lastmo, use_container_width=True)
-
-        breed_hist = plot_functions.breed_breakdown_bar_plot(hist_breed, period='history')
-        breed2.plotly_chart(breed_hist, use_container_width=True)
+        if sections.section_is_open('general_breed') and coalition is not None:
+            st.write('Breeds are shown for one shelter at a time, choose a shelter in the sidebar.')
+        elif sections.section_is_open('general_breed'):
+            lastmo_breed = sections.section_result('general_breed_lastmo_prep', params,
+                                                   data_functions.breed_breakdown_data_prep, iodf, rows=lastmonth)
+            hist_breed = sections.section_result('general_breed_hist_prep', params,
+                                                 data_functions.breed_breakdown_data_prep, iodf, rows=history)
+
+            breed1, breed2 = st.beta_columns((.5, .5))
+            breed_lastmo = sections.section_result('general_breed_lastmo', params,
+                                                   plot_functions.breed_breakdown_bar_plot, lastmo_breed,
+                                                   period='lastmonth')
+            breed1.plotly_chart(breed_lastmo, use_container_width=True)
+
+            breed_hist = sections.section_result('general_breed_hist', params,
+                                                 plot_functions.breed_breakdown_bar_plot, hist_breed,
+                                                 period='history')
+            breed2.plotly_chart(breed_hist, use_container_width=True)
 
 # -----------------------------------------------
 # 2nd page: intakes page
-def intake_page(iodf, INTAKE_MAPPING):
+def intake_page(INTAKE_MAPPING):
     st.title('Intakes')
+    iodf = page_data()
+    plot_functions, line_plots, _ = plotting_modules()
+    first_date, last_date = data_functions.date_bounds(iodf, 'intake')
 
     # -----------------------------------------------
     # SIDEBAR INPUTS
@@ -161,13 +207,13 @@ def intake_page(iodf, INTAKE_MAPPING):
     with st.sidebar.form(key='date_form_ins'):
         st.write('<b>Date Inputs</b>', unsafe_allow_html=True)
         start_date = st.date_input('Choose a start date',
-                                          value=iodf.intake_date.min(),
-                                          min_value=iodf.intake_date.min(),
+                                          value=first_date,
+                                          min_value=first_date,
                                           max_value=datetime.datetime.today(),
                                           key='start_ins')
         end_date = st.date_input('Choose an end date',
-                                        value=iodf.intake_date.max(),
-                                        min_value=iodf.intake_date.min(),
+                                        value=last_date,
+                                        min_value=first_date,
                                         max_value=datetime.datetime.today(),
                                         key='end_ins')
 
@@ -199,106 +245,145 @@ def intake_page(iodf, INTAKE_MAPPING):
 
         submit_button_first = st.form_submit_button('Submit', help='Press to recalculate')
 
-    # add some columns to the in/out df & calculate age at intake
-    iodf = data_functions.add_columns_ins_outs(iodf)
-    iodf = data_functions.age_calc_at_in_out(iodf, date_for_comp='intake')
-    iodf = iodf[(iodf.intake_date >= start_date) & (iodf.intake_date <= end_date)]
+    # monthly intake counts by type/breed/age/intake type/agency for the chosen dates, sliced from the aggregate cube
+    # that is only built once per dataset version
+    cube = data_functions.inout_cube_window(iodf, INTAKE_MAPPING, start_date, end_date, date_for_comp='intake')
+
+    # collapsed sections below only run once opened, and keep their results for these inputs
+    params = (data_functions.dataset_version(iodf), start_date, end_date)
+
+    # start the data prep of every open section on the worker pool, so they run side by side - each expander below
+    # then only waits for its own result
+    sections.prefetch_section('ins_types', 'ins_types_prep', params, data_functions.inout_types_month_data_prep,
+                              cube, INTAKE_MAPPING, date_for_comp='intake')
+    sections.prefetch_section('ins_agency', 'ins_agency_prep', params, data_functions.inout_agencies_data_prep,
+                              cube, date_for_comp='intake')
+    sections.prefetch_section('ins_breed', 'ins_breed_prep', params, data_functions.inout_breed_data_prep,
+                              cube, start_month, end_month, date_for_comp='intake')
+    sections.prefetch_section('ins_age', 'ins_age_prep', params, data_functions.inout_age_data_prep,
+                              cube, start_month, end_month, AGE_GROUPS, date_for_comp='intake')
     # -----------------------------------------------
 
     # MONTHLY TOTALS EXPANDER
-    totals_expander = st.beta_expander('Intake total calendar trends', expanded=True)
+    totals_expander = profiling.expander('Intake total calendar trends', expanded=True)
     with totals_expander:
-        ins_month = data_functions.inout_heatmap_data_prep(iodf, date_for_comp='intake')
+        ins_month = data_functions.inout_heatmap_data_prep(cube, date_for_comp='intake')
         plot_functions.inout_monthly_heatmap_plot(ins_month, date_for_comp='intake')
 
     # INTAKE TYPES EXPANDER
-    types_expander = st.beta_expander('Intake types', expanded=False)
+    types_expander = profiling.expander('Intake types', expanded=False)
     with types_expander:
-        intype_month, intype_qtr = data_functions.inout_types_month_data_prep(iodf, INTAKE_MAPPING,
-                                                                              date_for_comp='intake')
-
-        plot_functions.inout_types_stacked_bar_plot(intype_month, date_for_comp='intake')
-        type1, space, type2 = st.beta_columns((.25,.02,1))
-        # with type1:
-        chosen_comps = type1.multiselect(label='Choose up to 3 input types for monthly comparison',
-                       options=sorted(intype_month.type.unique().tolist()),
-                       default=['Other Agency','Stray'])
-        # with type2:
-        comparison_plot = plot_functions.inout_types_bar_comparison_plot(intype_month, chosen_comps,
-                                                                         date_for_comp='intake')
-        type2.plotly_chart(comparison_plot, use_container_width=True)
-
-        plot_functions.inout_types_quarter_line_plot(intype_qtr, date_for_comp='intake')
+        if sections.section_is_open('ins_types'):
+            intype_month, intype_qtr = sections.section_result('ins_types_prep', params,
+                                                               data_functions.inout_types_month_data_prep,
+                                                               cube, INTAKE_MAPPING, date_for_comp='intake')
+
+            plot_functions.inout_types_stacked_bar_plot(intype_month, date_for_comp='intake')
+            type1, space, type2 = st.beta_columns((.25,.02,1))
+            # with type1:
+            chosen_comps = type1.multiselect(label='Choose up to 3 input types for monthly comparison',
+                           options=sorted(intype_month.type.unique().tolist()),
+                           default=['Other Agency','Stray'])
+            # with type2:
+            comparison_plot = sections.section_result('ins_types_comparison', params + (tuple(chosen_comps),),
+                                                      plot_functions.inout_types_bar_comparison_plot,
+                                                      intype_month, chosen_comps, date_for_comp='intake')
+            type2.plotly_chart(comparison_plot, use_container_width=True)
+
+            plot_functions.inout_types_quarter_line_plot(intype_qtr, date_for_comp='intake')
 
     # AGENCY EXPANDER
-    agency_expander = st.beta_expander('Intake agencies', expanded=False)
+    agency_expander = profiling.expander('Intake agencies', expanded=False)
     with agency_expander:
-        agencydf = data_functions.inout_agencies_data_prep(iodf, date_for_comp='intake')
-        plot_functions.inout_agency_bar_plot(agencydf, date_for_comp='intake')
+        if sections.section_is_open('ins_agency'):
+            agencydf = sections.section_result('ins_agency_prep', params, data_functions.inout_agencies_data_prep,
+                                               cube, date_for_comp='intake')
+            plot_functions.inout_agency_bar_plot(agencydf, date_for_comp='intake')
+
+    max_base_dict = {'Full History':'history', 'Latest Month':'latest'}
 
     # BREED EXPANDER
-    breed_expander = st.beta_expander('Intake breeds', expanded=False)
+    breed_expander = profiling.expander('Intake breeds', expanded=False)
     with breed_expander:
-        breeddf = data_functions.inout_breed_data_prep(iodf, start_month, end_month, date_for_comp='intake')
+        if sections.section_is_open('ins_breed'):
+            breeddf = sections.section_result('ins_breed_prep', params, data_functions.inout_breed_data_prep,
+                                              cube, start_month, end_month, date_for_comp='intake')
 
-        breed1, sp, breed2 = st.beta_columns((.25,.02,1))
-        species = breed1.selectbox(label='Choose an animal type',
-                                   options=sorted(breeddf.type.unique().tolist()),
-                                   index=0,
-                                   key='breeds')
+            breed1, sp, breed2 = st.beta_columns((.25,.02,1))
+            species = breed1.selectbox(label='Choose an animal type',
+                                       options=sorted(breeddf.type.unique().tolist()),
+                                       index=0,
+                                       key='breeds')
+
+            breed1.write("<br>", unsafe_allow_html=True)
 
-        breed1.write("<br>", unsafe_allow_html=True)
+            max_base = breed1.radio(label='Popular breeds based on:',
+                                    options=['Full History','Latest Month'],
+                                    index=0,
+                                    key='breeds')
 
-        max_base = breed1.radio(label='Popular breeds based on:',
-                                options=['Full History','Latest Month'],
-                                index=0,
-                                key='breeds')
-        max_base_dict = {'Full History':'history', 'Latest Month':'latest'}
+            breed1.write("<br>", unsafe_allow_html=True)
 
-        breed1.write("<br>", unsafe_allow_html=True)
+            perc = breed1.checkbox(label='Show values as % of total animals',
+                                   value=False,
+                                   key='breeds')
 
-        perc = breed1.checkbox(label='Show values as % of total animals',
-                               value=False,
-                               key='breeds')
+            breed_lines = sections.section_result('ins_breed_lines', params + (species, max_base),
+                                                  data_functions.category_line_arrays, breeddf, species, 'breed',
+                                                  max_base=max_base_dict[max_base], date_for_comp='intake')
 
-        breed_fig = plot_functions.inout_breed_line_plot(breeddf, species, perc=perc, max_base=max_base_dict[max_base],
-                                                         date_for_comp='intake')
+            # the serialized figure is shared by every session looking at the same data and choices
+            breed_fig = line_plots.figure_json(('ins_breed_fig',) + params + (species, perc, max_base),
+                                               line_plots.inout_breed_line_plot, breed_lines, species, perc=perc,
+                                               max_base=max_base_dict[max_base], date_for_comp='intake')
 
-        breed2.plotly_chart(breed_fig, use_container_width=True)
+            breed2.plotly_chart(line_plots.figure_from_json(breed_fig), use_container_width=True)
 
     # AGE EXPANDER
-    age_expander = st.beta_expander('Intake ages', expanded=False)
+    age_expander = profiling.expander('Intake ages', expanded=False)
     with age_expander:
-        agedf = data_functions.inout_age_data_prep(iodf, start_month, end_month, AGE_GROUPS, date_for_comp='intake')
+        if sections.section_is_open('ins_age'):
+            agedf = sections.section_result('ins_age_prep', params, data_functions.inout_age_data_prep,
+                                            cube, start_month, end_month, AGE_GROUPS, date_for_comp='intake')
 
-        age1, sp, age2 = st.beta_columns((.25, .02, 1))
-        species_age = age1.selectbox(label='Choose an animal type',
-                                 options=sorted(breeddf.type.unique().tolist()),
-                                 index=0,
-                                 key='age')
+            age1, sp, age2 = st.beta_columns((.25, .02, 1))
+            species_age = age1.selectbox(label='Choose an animal type',
+                                     options=sorted(agedf.type.unique().tolist()),
+                                     index=0,
+                                     key='age')
+
+            age1.write("<br>", unsafe_allow_html=True)
 
-        age1.write("<br>", unsafe_allow_html=True)
+            max_base_age = age1.radio(label='Popular ages based on:',
+                                  options=['Full History', 'Latest Month'],
+                                  index=0,
+                                  key='age')
 
-        max_base_age = age1.radio(label='Popular ages based on:',
-                              options=['Full History', 'Latest Month'],
-                              index=0,
-                              key='age')
+            age1.write("<br>", unsafe_allow_html=True)
 
-        age1.write("<br>", unsafe_allow_html=True)
+            perc_age = age1.checkbox(label='Show values as % of total animals',
+                                 value=False,
+                                 key='age')
 
-        perc_age = age1.checkbox(label='Show values as % of total animals',
-                             value=False,
-                             key='age')
+            age_lines = sections.section_result('ins_age_lines', params + (species_age, max_base_age),
+                                                data_functions.category_line_arrays, agedf, species_age,
+                                                'agecat_intake', max_base=max_base_dict[max_base_age],
+                                                date_for_comp='intake')
 
-        age_fig = plot_functions.inout_age_line_plot(agedf, species_age, AGE_GROUPS, perc=perc_age,
-                                                      max_base=max_base_dict[max_base_age], date_for_comp='intake')
+            age_fig = line_plots.figure_json(('ins_age_fig',) + params + (species_age, perc_age, max_base_age),
+                                             line_plots.inout_age_line_plot, age_lines, species_age, AGE_GROUPS,
+                                             perc=perc_age, max_base=max_base_dict[max_base_age],
+                                             date_for_comp='intake')
 
-        age2.plotly_chart(age_fig, use_container_width=True)
+            age2.plotly_chart(line_plots.figure_from_json(age_fig), use_container_width=True)
 
 # -----------------------------------------------
 # 3rd: Outcomes page
-def outcome_page(iodf):
+def outcome_page():
     st.title('Outcomes')
+    iodf = page_data()
+    plot_functions, line_plots, _ = plotting_modules()
+    first_date, last_date = data_functions.date_bounds(iodf, 'out')
 
     # -----------------------------------------------
     # SIDEBAR INPUTS
@@ -306,13 +391,13 @@ def outcome_page(iodf):
     with st.sidebar.form(key='date_form_outs'):
         st.write('<b>Date Inputs</b>', unsafe_allow_html=True)
         start_date = st.date_input('Choose a start date',
-                                   value=iodf.out_date.min(),
-                                   min_value=iodf.out_date.min(),
+                                   value=first_date,
+                                   min_value=first_date,
                                    max_value=datetime.datetime.today(),
                                    key='start_outs')
         end_date = st.date_input('Choose an end date',
-                                 value=iodf.out_date.max(),
-                                 min_value=iodf.out_date.min(),
+                                 value=last_date,
+                                 min_value=first_date,
                                  max_value=datetime.datetime.today(),
                                  key='end_outs')
 
@@ -344,27 +429,39 @@ def outcome_page(iodf):
 
         submit_button_first = st.form_submit_button('Submit', help='Press to recalculate')
 
-    # add some columns to the in/out df & calculate age at intake
-    iodf = data_functions.add_columns_ins_outs(iodf)
+    coalition = data_functions.coalition(iodf)
 
     # number used for save rates calc
-    total_animals = iodf.id.nunique()
-    total_outcome_animals = iodf[iodf.out_date.notnull()].id.nunique()
-    total_adopted_animals = iodf[iodf.out_adopt==1].id.nunique()
-
-    # filter to just animals with an out date in the chosen timeframe, and then calculate age at out date
-    iodf = iodf[(iodf.out_date >= start_date) & (iodf.out_date <= end_date)]
-    iodf = data_functions.age_calc_at_in_out(iodf, date_for_comp='out')
-    iodf = data_functions.length_stay_calc(iodf)
-    # -----------------------------------------------
+    total_animals = data_functions.distinct_ids(iodf)
+    total_outcome_animals, total_adopted_animals = data_functions.save_rate_counts(iodf)
+
+    # monthly outcome counts by type/breed/age/outcome type/agency for the chosen dates, sliced from the aggregate
+    # cube that is only built once per dataset version
+    cube = data_functions.inout_cube_window(iodf, OUTCOME_MAPPING, start_date, end_date, date_for_comp='out')
+
+    # collapsed sections below only run once opened, and keep their results for these inputs
+    params = (data_functions.dataset_version(iodf), start_date, end_date)
+
+    # start the data prep of every open section on the worker pool, so they run side by side - each expander below
+    # then only waits for its own result
+    sections.prefetch_section('outs_totals', 'outs_totals_prep', params, data_functions.inout_heatmap_data_prep,
+                              cube, date_for_comp='out')
+    sections.prefetch_section('outs_types', 'outs_types_prep', params, data_functions.inout_types_month_data_prep,
+                              cube, OUTCOME_MAPPING, date_for_comp='out')
+    sections.prefetch_section('outs_agency', 'outs_agency_prep', params, data_functions.inout_agencies_data_prep,
+                              cube, date_for_comp='out')
+    sections.prefetch_section('outs_breed', 'outs_breed_prep', params, data_functions.inout_breed_data_prep,
+                              cube, start_month, end_month, date_for_comp='out')
+    sections.prefetch_section('outs_age', 'outs_age_prep', params, data_functions.inout_age_data_prep,
+                              cube, start_month, end_month, AGE_GROUPS, date_for_comp='out')
 
-    # st.write(iodf)
+    # -----------------------------------------------
 
     # SAVE RATES
-    saverate_expander = st.beta_expander('Save rates', expanded=True)
+    saverate_expander = profiling.expander('Save rates', expanded=True)
     with saverate_expander:
-        outcome_animals = iodf.id.nunique()
-        adopted_animals = iodf[iodf.out_adopt==1].id.nunique()
+        # just the animals with an out date in the chosen timeframe
+        outcome_animals, adopted_animals = data_functions.save_rate_counts(iodf, start_date, end_date)
 
         save1, sp, save2 = st.beta_columns((1,.02,1))
         st.markdown(""" <style> .labels {
@@ -390,97 +487,132 @@ def outcome_page(iodf):
                     unsafe_allow_html=True)
 
     # MONTHLY TOTALS EXPANDER
-    totals_expander = st.beta_expander('Outcome total calendar trends', expanded=False)
+    totals_expander = profiling.expander('Outcome total calendar trends', expanded=False)
     with totals_expander:
-        outs_month = data_functions.inout_heatmap_data_prep(iodf, date_for_comp='out')
-        plot_functions.inout_monthly_heatmap_plot(outs_month, date_for_comp='out')
+        if sections.section_is_open('outs_totals'):
+            outs_month = sections.section_result('outs_totals_prep', params, data_functions.inout_heatmap_data_prep,
+                                                 cube, date_for_comp='out')
+            plot_functions.inout_monthly_heatmap_plot(outs_month, date_for_comp='out')
 
     # OUTCOME LENGTH OF STAY EXPANDER
-    lengthstay_expander = st.beta_expander('Outcome length of stays', expanded=False)
+    lengthstay_expander = profiling.expander('Outcome length of stays', expanded=False)
+    with lengthstay_expander:
+        if sections.section_is_open('outs_length') and coalition is not None:
+            st.write('Lengths of stay are shown for one shelter at a time, choose a shelter in the sidebar.')
+        elif sections.section_is_open('outs_length'):
+            # the animals with an out date in the chosen timeframe, as row positions into the shared iodf
+            outs = data_functions.date_rows(iodf, 'out', start_date, end_date)
+            staydf = sections.section_result('outs_length_prep', params, data_functions.length_stay_calc, iodf,
+                                             rows=outs)
+            lengthdf = data_functions.length_stay_outcome_data_prep(staydf)
+            st.bar_chart(lengthdf.pivot(index='cat_stay', columns='type', values='id'))
 
     # INTAKE TYPES EXPANDER
-    types_expander = st.beta_expander('Outcome types', expanded=False)
+    types_expander = profiling.expander('Outcome types', expanded=False)
     with types_expander:
-        outtype_month, outtype_qtr = data_functions.inout_types_month_data_prep(iodf, OUTCOME_MAPPING,
-                                                                                date_for_comp='out')
-
-        plot_functions.inout_types_stacked_bar_plot(outtype_month, date_for_comp='out')
-        type1, space, type2 = st.beta_columns((.25,.02,1))
-        # with type1:
-        chosen_comps = type1.multiselect(label='Choose up to 3 outcome types for monthly comparison',
-                       options=sorted(outtype_month.type.unique().tolist()),
-                       default=['Adopted','Other Agency'])
-        # with type2:
-        comparison_plot = plot_functions.inout_types_bar_comparison_plot(outtype_month, chosen_comps,
-                                                                         date_for_comp='out')
-        type2.plotly_chart(comparison_plot, use_container_width=True)
-
-        plot_functions.inout_types_quarter_line_plot(outtype_qtr, date_for_comp='out')
+        if sections.section_is_open('outs_types'):
+            outtype_month, outtype_qtr = sections.section_result('outs_types_prep', params,
+                                                                 data_functions.inout_types_month_data_prep,
+                                                                 cube, OUTCOME_MAPPING, date_for_comp='out')
+
+            plot_functions.inout_types_stacked_bar_plot(outtype_month, date_for_comp='out')
+            type1, space, type2 = st.beta_columns((.25,.02,1))
+            # with type1:
+            chosen_comps = type1.multiselect(label='Choose up to 3 outcome types for monthly comparison',
+                           options=sorted(outtype_month.type.unique().tolist()),
+                           default=['Adopted','Other Agency'])
+            # with type2:
+            comparison_plot = sections.section_result('outs_types_comparison', params + (tuple(chosen_comps),),
+                                                      plot_functions.inout_types_bar_comparison_plot,
+                                                      outtype_month, chosen_comps, date_for_comp='out')
+            type2.plotly_chart(comparison_plot, use_container_width=True)
+
+            plot_functions.inout_types_quarter_line_plot(outtype_qtr, date_for_comp='out')
 
     # AGENCY EXPANDER
-    agency_expander = st.beta_expander('Outcome agencies', expanded=False)
+    agency_expander = profiling.expander('Outcome agencies', expanded=False)
     with agency_expander:
-        agencydf = data_functions.inout_agencies_data_prep(iodf, date_for_comp='out')
-        plot_functions.inout_agency_bar_plot(agencydf, date_for_comp='out')
+        if sections.section_is_open('outs_agency'):
+            agencydf = sections.section_result('outs_agency_prep', params, data_functions.inout_agencies_data_prep,
+                                               cube, date_for_comp='out')
+            plot_functions.inout_agency_bar_plot(agencydf, date_for_comp='out')
+
+    max_base_dict = {'Full History':'history', 'Latest Month':'latest'}
 
     # BREED EXPANDER
-    breed_expander = st.beta_expander('Outcome breeds', expanded=False)
+    breed_expander = profiling.expander('Outcome breeds', expanded=False)
     with breed_expander:
-        breeddf = data_functions.inout_breed_data_prep(iodf, start_month, end_month, date_for_comp='out')
+        if sections.section_is_open('outs_breed'):
+            breeddf = sections.section_result('outs_breed_prep', params, data_functions.inout_breed_data_prep,
+                                              cube, start_month, end_month, date_for_comp='out')
 
-        breed1, sp, breed2 = st.beta_columns((.25,.02,1))
-        species = breed1.selectbox(label='Choose an animal type',
-                                   options=sorted(breeddf.type.unique().tolist()),
-                                   index=0,
-                                   key='breeds')
+            breed1, sp, breed2 = st.beta_columns((.25,.02,1))
+            species = breed1.selectbox(label='Choose an animal type',
+                                       options=sorted(breeddf.type.unique().tolist()),
+                                       index=0,
+                                       key='breeds')
+
+            breed1.write("<br>", unsafe_allow_html=True)
 
-        breed1.write("<br>", unsafe_allow_html=True)
+            max_base = breed1.radio(label='Popular breeds based on:',
+                                    options=['Full History','Latest Month'],
+                                    index=0,
+                                    key='breeds')
 
-        max_base = breed1.radio(label='Popular breeds based on:',
-                                options=['Full History','Latest Month'],
-                                index=0,
-                                key='breeds')
-        max_base_dict = {'Full History':'history', 'Latest Month':'latest'}
+            breed1.write("<br>", unsafe_allow_html=True)
 
-        breed1.write("<br>", unsafe_allow_html=True)
+            perc = breed1.checkbox(label='Show values as % of total animals',
+                                   value=False,
+                                   key='breeds')
 
-        perc = breed1.checkbox(label='Show values as % of total animals',
-                               value=False,
-                               key='breeds')
+            breed_lines = sections.section_result('outs_breed_lines', params + (species, max_base),
+                                                  data_functions.category_line_arrays, breeddf, species, 'breed',
+                                                  max_base=max_base_dict[max_base], date_for_comp='out')
 
-        breed_fig = plot_functions.inout_breed_line_plot(breeddf, species, perc=perc, max_base=max_base_dict[max_base],
-                                                         date_for_comp='out')
+            # the serialized figure is shared by every session looking at the same data and choices
+            breed_fig = line_plots.figure_json(('outs_breed_fig',) + params + (species, perc, max_base),
+                                               line_plots.inout_breed_line_plot, breed_lines, species, perc=perc,
+                                               max_base=max_base_dict[max_base], date_for_comp='out')
 
-        breed2.plotly_chart(breed_fig, use_container_width=True)
+            breed2.plotly_chart(line_plots.figure_from_json(breed_fig), use_container_width=True)
 
     # AGE EXPANDER
-    age_expander = st.beta_expander('Outcome ages', expanded=False)
+    age_expander = profiling.expander('Outcome ages', expanded=False)
     with age_expander:
-        agedf = data_functions.inout_age_data_prep(iodf, start_month, end_month, AGE_GROUPS, date_for_comp='out')
+        if sections.section_is_open('outs_age'):
+            agedf = sections.section_result('outs_age_prep', params, data_functions.inout_age_data_prep,
+                                            cube, start_month, end_month, AGE_GROUPS, date_for_comp='out')
 
-        age1, sp, age2 = st.beta_columns((.25, .02, 1))
-        species_age = age1.selectbox(label='Choose an animal type',
-                                 options=sorted(breeddf.type.unique().tolist()),
-                                 index=0,
-                                 key='age')
+            age1, sp, age2 = st.beta_columns((.25, .02, 1))
+            species_age = age1.selectbox(label='Choose an animal type',
+                                     options=sorted(agedf.type.unique().tolist()),
+                                     index=0,
+                                     key='age')
+
+            age1.write("<br>", unsafe_allow_html=True)
 
-        age1.write("<br>", unsafe_allow_html=True)
+            max_base_age = age1.radio(label='Popular ages based on:',
+                                  options=['Full History', 'Latest Month'],
+                                  index=0,
+                                  key='age')
 
-        max_base_age = age1.radio(label='Popular ages based on:',
-                              options=['Full History', 'Latest Month'],
-                              index=0,
-                              key='age')
+            age1.write("<br>", unsafe_allow_html=True)
 
-        age1.write("<br>", unsafe_allow_html=True)
+            perc_age = age1.checkbox(label='Show values as % of total animals',
+                                 value=False,
+                                 key='age')
 
-        perc_age = age1.checkbox(label='Show values as % of total animals',
-                             value=False,
-                             key='age')
+            age_lines = sections.section_result('outs_age_lines', params + (species_age, max_base_age),
+                                                data_functions.category_line_arrays, agedf, species_age,
+                                                'agecat_out', max_base=max_base_dict[max_base_age],
+                                                date_for_comp='out')
 
-        age_fig = plot_functions.inout_age_line_plot(agedf, species_age, AGE_GROUPS, perc=perc_age,
-                                                      max_base=max_base_dict[max_base_age], date_for_comp='out')
+            age_fig = line_plots.figure_json(('outs_age_fig',) + params + (species_age, perc_age, max_base_age),
+                                             line_plots.inout_age_line_plot, age_lines, species_age, AGE_GROUPS,
+                                             perc=perc_age, max_base=max_base_dict[max_base_age],
+                                             date_for_comp='out')
 
-        age2.plotly_chart(age_fig, use_container_width=True)
+            age2.plotly_chart(line_plots.figure_from_json(age_fig), use_container_width=True)
 
 # -----------------------------------------------
 # 4th: Fostering page
@@ -491,6 +623,65 @@ def fostering_page():
 # 5th: General summary page
 def geography_page():
     st.title('Geography of rescues')
+    iodf = page_data()
+    geo_plots = geo_plotting_module()
+    first_date, last_date = data_functions.date_bounds(iodf, 'intake')
+
+    # -----------------------------------------------
+    # SIDEBAR INPUTS
+    st.sidebar.write("<br>", unsafe_allow_html=True)
+    with st.sidebar.form(key='date_form_geo'):
+        st.write('<b>Date Inputs</b>', unsafe_allow_html=True)
+        start_date = st.date_input('Choose a start date',
+                                   value=first_date,
+                                   min_value=first_date,
+                                   max_value=datetime.datetime.today(),
+                                   key='start_geo')
+        end_date = st.date_input('Choose an end date',
+                                 value=last_date,
+                                 min_value=first_date,
+                                 max_value=datetime.datetime.today(),
+                                 key='end_geo')
+
+        # the region counts are kept by month, so the map covers the full months chosen
+        start_month = datetime.datetime(start_date.year, start_date.month, 1)
+        end_month = datetime.datetime(end_date.year, end_date.month, 1)
+
+        st.write(f'NOTE: The map covers all rescues from <b>{start_month.strftime("%b-%-Y")}</b> '
+                 f'through <b>{end_month.strftime("%b-%-Y")}</b>, even if those months do not have data for the full '
+                 f'month.', unsafe_allow_html=True)
+
+        submit_button_geo = st.form_submit_button('Submit', help='Press to recalculate')
+
+    # animals by month x region x type, matched to regions once per dataset version
+    counts = geography.region_counts(iodf, 'intake')
+
+    map1, sp, map2 = st.beta_columns((.25,.02,1))
+    species = map1.selectbox(label='Choose an animal type',
+                             options=['All'] + sorted(counts.type.dropna().unique().tolist()),
+                             index=0,
+                             key='geo_species')
+    species = None if species == 'All' else species
+
+    by_region, unmatched = geography.region_window_counts(counts, start_month, end_month, species)
+
+    if geography.region_source() is not None:
+        map1.write("<br>", unsafe_allow_html=True)
+        detail = map1.radio(label='Map detail:',
+                            options=list(geography.TOLERANCES.keys()),
+                            index=1,
+                            key='geo_detail')
+        geojson = geography.simplified_geojson(detail)
+        map2.plotly_chart(geo_plots.region_map_plot(by_region, geojson, species), use_container_width=True)
+    else:
+        map2.write(f'No region boundaries found at <b>{geography.REGIONS_PATH}</b> (set SHELTER_DASH_REGIONS to a '
+                   f'GeoJSON file or shapefile), so animals are only counted by {geography.GEO_COLUMN} below.',
+                   unsafe_allow_html=True)
+
+    map2.plotly_chart(geo_plots.region_bar_plot(by_region, species), use_container_width=True)
+    if unmatched > 0:
+        map2.write(f'<p class="note">{unmatched:,} animals in these months could not be matched to a region.</p>',
+                   unsafe_allow_html=True)
 
 # -----------------------------------------------
 # 6th: General summary page
@@ -535,15 +726,16 @@ def notes_page():
 def create_app_with_pages():
     app = MultiApp()
     app.add_app('Notes', notes_page, [])
-    app.add_app("General Summary", general_page, [iodf])
-    app.add_app("Intakes", intake_page, [iodf, INTAKE_MAPPING])
-    app.add_app("Outcomes", outcome_page, [iodf])
+    app.add_app("General Summary", profiling.profiled_page(general_page, "General Summary"), [])
+    app.add_app("Intakes", profiling.profiled_page(intake_page, "Intakes"), [INTAKE_MAPPING])
+    app.add_app("Outcomes", profiling.profiled_page(outcome_page, "Outcomes"), [])
     app.add_app("Fostering", fostering_page, [])
-    app.add_app("Geography of Rescues", geography_page, [])
+    app.add_app("Geography of Rescues", profiling.profiled_page(geography_page, "Geography of Rescues"), [])
     app.add_app("Marketing & Events", events_page, [])
     app.add_app("Staffing", staffing_page, [])
     app.add_app("Resources", resources_page, [])
     app.run(logo_path="fake_logo.png")
+    profiling.startup_report()
 
 if __name__ == '__main__':
     create_app_with_pages()
\ No newline at end of file
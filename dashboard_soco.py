@@ -1,17 +1,19 @@
 import streamlit as st
-import pandas as pd
-import datetime
-from datetime import timedelta
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.graph_objs import *
-from plotly.graph_objs.scatter.marker import Line
-from plotly.subplots import make_subplots
-import numpy as np
-import plot_settings
-from multiapp import MultiApp
-import plot_functions
-import data_functions
-import calendar
+import data_functions_soco
 
-st.set_page_config(layout="wide")
\ No newline at end of file
+st.set_page_config(layout="wide")
+
+
+# -----------------------------------------------
+# Sonoma County page
+def sonoma_page():
+    st.title('Sonoma County')
+
+    # the in/out data is only loaded once the page runs (streamed into the columnar cache the first time, memory
+    # mapped after that), then shared by every session
+    socodf = data_functions_soco.shared_soco_data()
+    st.write(f'{len(socodf):,} intake/outcome records')
+
+
+if __name__ == '__main__':
+    sonoma_page()
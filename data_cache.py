@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import errno
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------
+# Columnar on-disk cache
+#
+# A cached frame is a directory with one .npy file per column plus a meta.json. Dates and numbers are saved as-is so
+# they can be memory mapped on load, categoricals as their codes plus categories, and other text columns as int32
+# codes plus a list of their unique values. The cache is keyed on the source file's path, size and mtime, and is
+# rebuilt whenever any of those change.
+
+CACHE_DIR = os.environ.get('SHELTER_DASH_CACHE', '.data_cache')
+
+
+def source_key(path):
+    stat = os.stat(path)
+    return {'path':os.path.abspath(path), 'size':stat.st_size, 'mtime':stat.st_mtime_ns}
+
+
+def cache_path(name, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, name)
+
+
+def temp_path(final):
+    # unique per writer - threads of one server process can be writing the same cache at once
+    return f"{final}.tmp-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+
+
+def replace_dir(tmp, final):
+    # the old directory is renamed aside before the new one is renamed in, rather than deleted first, so there is only
+    # the moment between two renames without a copy in place. Another writer swapping in its own copy at the same
+    # time just means trying again.
+    asides = []
+    while True:
+        aside = temp_path(final).replace('.tmp-', '.old-')
+        try:
+            os.rename(final, aside)
+            asides.append(aside)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(tmp, final)
+            break
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+
+    for aside in asides:
+        shutil.rmtree(aside, ignore_errors=True)
+
+
+def write_cache(d, name, key, cache_dir=CACHE_DIR, version=None):
+    final = cache_path(name, cache_dir)
+    tmp = temp_path(final)
+    os.makedirs(tmp)
+
+    columns = []
+    for i, c in enumerate(d.columns):
+        col = d[c]
+        fname = f"{i}.npy"
+
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp, fname), col.cat.codes.to_numpy())
+            columns.append({'name':c, 'file':fname, 'kind':'category', 'values':col.cat.categories.tolist(),
+                            'ordered':bool(col.cat.ordered)})
+        elif pd.api.types.is_datetime64_any_dtype(col) or pd.api.types.is_numeric_dtype(col):
+            np.save(os.path.join(tmp, fname), col.to_numpy())
+            columns.append({'name':c, 'file':fname, 'kind':'array'})
+        else:
+            codes, uniques = pd.factorize(col)
+            np.save(os.path.join(tmp, fname), codes.astype('int32'))
+            columns.append({'name':c, 'file':fname, 'kind':'codes', 'values':uniques.tolist()})
+
+    # meta.json is written last, so a half-written cache never looks valid
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'key':key, 'version':version, 'rows':len(d), 'columns':columns}, f)
+
+    replace_dir(tmp, final)
+
+
+def read_meta(name, cache_dir=CACHE_DIR):
+    try:
+        with open(os.path.join(cache_path(name, cache_dir), 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_cache(name, key=None, cache_dir=CACHE_DIR, columns=None):
+    # returns None if there is no cache, or if it was built from a different version of the source file. columns
+    # limits the frame to those columns (the others aren't opened)
+    path = cache_path(name, cache_dir)
+    meta = read_meta(name, cache_dir)
+    if meta is None:
+        return None
+
+    if key is not None and meta['key'] != key:
+        return None
+
+    data = {}
+    for col in meta['columns']:
+        if columns is not None and col['name'] not in columns:
+            continue
+        if col['kind'] == 'raw':
+            arr = raw_column(os.path.join(path, col['file']), col['dtype'], meta['rows'])
+            if 'values' in col:
+                arr = pd.Categorical.from_codes(arr, categories=col['values'])
+        else:
+            arr = np.load(os.path.join(path, col['file']), mmap_mode='r')
+
+        if col['kind'] == 'category':
+            arr = pd.Categorical.from_codes(arr, categories=col['values'], ordered=col['ordered'])
+        elif col['kind'] == 'codes':
+            values = np.asarray(col['values'] + [np.nan], dtype=object)
+            arr = values[arr]
+        data[col['name']] = arr
+
+    d = pd.DataFrame(data, copy=False)
+    if meta.get('version') is not None:
+        d.attrs['version'] = meta['version']
+
+    return d
+
+
+def raw_column(fname, dtype, rows):
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(fname, dtype=dtype, mode='r', shape=(rows,))
+
+
+class CacheWriter:
+    # builds a cached frame one chunk at a time, so the whole frame never has to be in memory: numbers and dates are
+    # appended to raw column files, and text is appended as int32 codes into a dictionary of unique values that grows
+    # with each chunk. text_transform (if given) is applied once per unique raw value, not once per row.
+    def __init__(self, name, key, cache_dir=CACHE_DIR, version=None, text_transform=None):
+        self.final = cache_path(name, cache_dir)
+        self.tmp = temp_path(self.final)
+        self.key = key
+        self.version = version
+        self.text_transform = text_transform
+        self.rows = 0
+        self.columns = None
+        self.codes = {}
+        self.values = {}
+
+        os.makedirs(self.tmp)
+
+    def start(self, chunk):
+        self.columns = []
+        for i, c in enumerate(chunk.columns):
+            col = chunk[c]
+            if pd.api.types.is_datetime64_any_dtype(col) or pd.api.types.is_numeric_dtype(col):
+                self.columns.append({'name':c, 'file':f"{i}.bin", 'kind':'raw', 'dtype':col.to_numpy().dtype.str})
+            else:
+                self.columns.append({'name':c, 'file':f"{i}.bin", 'kind':'raw', 'dtype':'<i4'})
+                self.codes[c] = {}
+                self.values[c] = {}
+
+    def text_codes(self, c, col):
+        # codes for one chunk of a text column, looking up (and transforming) each unique raw value only once
+        uniques_codes, uniques = pd.factorize(col)
+        raw_codes = self.codes[c]
+        values = self.values[c]
+
+        lookup = np.empty(len(uniques) + 1, dtype='int32')
+        lookup[-1] = -1
+        for j, u in enumerate(uniques):
+            if u not in raw_codes:
+                v = self.text_transform(u) if self.text_transform is not None else u
+                raw_codes[u] = values.setdefault(v, len(values))
+            lookup[j] = raw_codes[u]
+
+        return lookup[uniques_codes]
+
+    def append(self, chunk):
+        if self.columns is None:
+            self.start(chunk)
+
+        for col in self.columns:
+            c = col['name']
+            if c in self.codes:
+                arr = self.text_codes(c, chunk[c])
+            else:
+                arr = chunk[c].to_numpy().astype(col['dtype'])
+            with open(os.path.join(self.tmp, col['file']), 'ab') as f:
+                f.write(np.ascontiguousarray(arr).tobytes())
+
+        self.rows += len(chunk)
+
+    def close(self):
+        for col in self.columns or []:
+            if col['name'] in self.values:
+                col['values'] = list(self.values[col['name']].keys())
+
+        with open(os.path.join(self.tmp, 'meta.json'), 'w') as f:
+            json.dump({'key':self.key, 'version':self.version, 'rows':self.rows, 'columns':self.columns or []}, f)
+
+        replace_dir(self.tmp, self.final)
+
+
+def cached_frame(path, loader, name, cache_dir=CACHE_DIR):
+    # load the frame from the cache if it matches the source file, otherwise rebuild it with loader(path)
+    key = source_key(path)
+    d = read_cache(name, key, cache_dir)
+    if d is None:
+        d = loader(path)
+        write_cache(d, name, key, cache_dir, version=d.attrs.get('version'))
+        d = read_cache(name, key, cache_dir)
+    return d
+
+
+# -----------------------------------------------
+# One-shot conversion ahead of deploys, e.g. `python data_cache.py fake_data.xlsx`
+if __name__ == '__main__':
+    import data_functions
+
+    source = sys.argv[1] if len(sys.argv) > 1 else data_functions.INS_OUTS_PATH
+    iodf = data_functions.data_ins_outs(source)
+    print(f"cached {len(iodf):,} rows from {source} in {cache_path('ins_outs')}")
+    print(data_functions.memory_report(iodf).to_string(index=False))
@@ -0,0 +1,1028 @@
+import os
+import threading
+import pandas as pd
+import numpy as np
+import data_cache
+from memo import memoize, frame_cached
+
+# -----------------------------------------------
+# Loading the in/out data
+INS_OUTS_PATH = 'fake_data.xlsx'
+
+FLAG_COLUMNS = ['intake_stray','intake_owner_giveup','intake_state_agency','intake_domestic_agency',
+                'intake_intl_agency','intake_oie','intake_impound_seizure','intake_other','out_adopt',
+                'out_return_owner','out_state_agency','out_domestic_agency','out_intl_agency',
+                'out_return_field','out_other','died_in_care','lost_in_care','euthanasia','oie','service_tnr',
+                'service_rto','service_chip','service_spayneuter','service_wellness','service_basicvet',
+                'service_advancedvet','service_oie','service_behavior','service_grptrain','service_privatetrain',
+                'support_petfood','support_supplies','support_grooming','support_foster','support_rehoming']
+
+
+INTAKE_FLAGS = [c for c in FLAG_COLUMNS if c.startswith('intake_')]
+OUTCOME_FLAGS = ['out_adopt','out_return_owner','out_state_agency','out_domestic_agency','out_intl_agency',
+                 'out_return_field','out_other','died_in_care','lost_in_care','euthanasia','oie']
+
+# intake/outcome flags and the type names shown for them on the dashboard
+INTAKE_MAPPING = {'intake_domestic_agency':'Other Agency',
+                  'intake_impound_seizure':'Impound/Seizure',
+                  'intake_intl_agency':'Other Agency',
+                  'intake_oie':'Owner Intended Euth.',
+                  'intake_other':'Other',
+                  'intake_owner_giveup':'Owner Give-Up',
+                  'intake_state_agency':'Other Agency',
+                  'intake_stray':'Stray'}
+
+OUTCOME_MAPPING = {'out_adopt':'Adopted',
+                   'out_return_owner':'Return to Owner',
+                   'out_state_agency':'Other Agency',
+                   'out_domestic_agency':'Other Agency',
+                   'out_intl_agency':'Other Agency',
+                   'out_return_field':'Return to Field',
+                   'out_other':'Other',
+                   'died_in_care':'Died in Care',
+                   'lost_in_care':'Lost in Care',
+                   'euthanasia':'Euthanized',
+                   'oie':'Euthanized'}
+
+# 'pandas', or 'duckdb' to run the aggregate queries (monthly totals, the in/out cube, save rates) in DuckDB over a
+# Parquet copy of the table instead (see sql_backend.py)
+BACKEND = os.environ.get('SHELTER_DASH_BACKEND', 'pandas')
+
+# text columns with at most this share of unique values are stored as categoricals
+CATEGORY_MAX_UNIQUE_SHARE = 0.5
+
+# one workbook per shelter for a coalition of shelters - each is its own partition of the data, with its own cache
+# directory and dataset version (see partitions.py for the coalition-wide views)
+SHELTERS_DIR = os.environ.get('SHELTER_DASH_SHELTERS', 'shelters')
+
+_SHARED = {}
+_SHARED_LOCKS = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def read_ins_outs_excel(path):
+    iodf = pd.read_excel(path,
+                         sheet_name='ins_outs',
+                         parse_dates=['birthday','intake_date','out_date'])
+
+    for c in FLAG_COLUMNS:
+        iodf[c] = iodf[c].fillna(0).astype('int8')
+
+    return compact_ins_outs(iodf)
+
+
+def read_ins_outs_source(path):
+    # the workbook, with the batches ingested since it was first cached applied again on top (see ingest.py)
+    import ingest
+    return ingest.replay_batches(read_ins_outs_excel(path), partition_cache_dir(source_partition(path)),
+                                 base_version(path))
+
+
+def flag_column(d, flags):
+    # name of the flag column set for each animal, as a single categorical column (empty if none of them are)
+    flagvals = d[flags].to_numpy()
+    codes = np.where(flagvals.max(axis=1) > 0, flagvals.argmax(axis=1), -1)
+    return pd.Categorical.from_codes(codes.astype('int8'), categories=flags)
+
+
+def compact_ins_outs(iodf):
+    # compact schema: low-cardinality text as categoricals, int8 flags plus one intake and one outcome flag column,
+    # and int32 month numbers (see month_index, -1 when there is no date) instead of formatted month strings
+    data = {}
+    for c in iodf.columns:
+        col = iodf[c]
+        if c in FLAG_COLUMNS:
+            col = col.astype('int8')
+        elif pd.api.types.is_string_dtype(col.dtype) and col.nunique() <= CATEGORY_MAX_UNIQUE_SHARE * len(col):
+            col = col.astype('category')
+        data[c] = col
+
+    data['intake_flag'] = flag_column(iodf, INTAKE_FLAGS)
+    data['out_flag'] = flag_column(iodf, OUTCOME_FLAGS)
+    data['intake_month_idx'] = month_index(iodf.intake_date).astype('int32')
+    data['out_month_idx'] = month_index(iodf.out_date).astype('int32')
+
+    return pd.DataFrame(data, index=iodf.index)
+
+
+def memory_report(d):
+    # bytes used by each column (largest first), with a total row
+    usage = d.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({'column':usage.index,
+                           'dtype':[str(d[c].dtype) for c in usage.index],
+                           'bytes':usage.values}).sort_values(by='bytes', ascending=False)
+    report = pd.concat([report, pd.DataFrame({'column':['TOTAL'], 'dtype':[''], 'bytes':[usage.sum()]})])
+    report['mb'] = (report['bytes'] / 1024**2).round(2)
+
+    return report.reset_index(drop=True)
+
+
+def data_ins_outs(path=INS_OUTS_PATH):
+    # the workbook is only parsed when the columnar cache is missing or older than the file
+    partition = source_partition(path)
+    iodf = data_cache.cached_frame(path, read_ins_outs_source, 'ins_outs', partition_cache_dir(partition))
+
+    # version of the data, used to know when anything built from it (e.g. the monthly cube) needs rebuilding - the
+    # source file's size and mtime, plus the number of batches ingested since (see ingest.py)
+    if dataset_version(iodf) is None:
+        iodf.attrs['version'] = base_version(path)
+    if partition is not None:
+        iodf.attrs['partition'] = partition
+
+    return iodf
+
+
+def shared_ins_outs(path=INS_OUTS_PATH):
+    # one copy of the enriched table (see enrich_ins_outs) per process, loaded the first time a page needs it and
+    # shared read-only by every session - it is only loaded again once the source file or the ingested version changes.
+    # Each shelter's table is loaded under its own lock, so reloading one doesn't hold up pages on the others.
+    partition = source_partition(path)
+    meta = data_cache.read_meta('ins_outs', partition_cache_dir(partition)) or {}
+    key = (tuple(data_cache.source_key(path).values()), meta.get('version'))
+    with _SHARED_LOCK:
+        lock = _SHARED_LOCKS.setdefault(partition, threading.Lock())
+    with lock:
+        if _SHARED.get(partition, (None,))[0] != key:
+            _SHARED[partition] = (key, enrich_ins_outs(data_ins_outs(path)))
+        return _SHARED[partition][1]
+
+
+def base_version(path=INS_OUTS_PATH):
+    # shelters' versions start with the shelter's name, so they never match another shelter's
+    key = data_cache.source_key(path)
+    partition = source_partition(path)
+    return f"{key['size']}-{key['mtime']}" if partition is None else f"{partition}:{key['size']}-{key['mtime']}"
+
+
+def source_partition(path):
+    # the shelter a workbook in SHELTERS_DIR holds (its file name), None for any other source
+    if os.path.dirname(os.path.abspath(path)) != os.path.abspath(SHELTERS_DIR):
+        return None
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def partition_cache_dir(partition=None):
+    return data_cache.CACHE_DIR if partition is None else os.path.join(data_cache.CACHE_DIR, 'shelters', partition)
+
+
+def dataset_partition(d):
+    return d.attrs.get('partition')
+
+
+def coalition(d):
+    # the data functions below that have a coalition-wide version answer for a partitions.Coalition (every shelter
+    # at once) by running on each shelter's table and merging the results
+    return None if isinstance(d, pd.DataFrame) else d
+
+
+@memoize
+def add_columns_ins_outs(d):
+    return _add_columns(d)
+
+
+def _add_columns(d):
+    # month numbers are part of the compact table, they're only added here for frames built some other way
+    if 'intake_month_idx' in d and 'out_month_idx' in d:
+        return d
+
+    months = pd.DataFrame({'intake_month_idx':month_index(d.intake_date).astype('int32'),
+                           'out_month_idx':month_index(d.out_date).astype('int32')}, index=d.index)
+    return pd.concat([d, months], axis=1)
+
+
+def month_idx_column(d, date_for_comp, rows=None):
+    if f'{date_for_comp}_month_idx' in d:
+        return column_values(d, f'{date_for_comp}_month_idx', rows)
+    return month_index(column_values(d, f'{date_for_comp}_date', rows))
+
+
+# -----------------------------------------------
+# Ages
+#
+# Age groups are computed as integer bins in one vectorized pass and returned as a Categorical ordered by AGE_GROUPS,
+# so groupbys run on the category codes. Under 6 months is split into weeks/months, then whole years up to 20 (older
+# ages and missing birthdays are left empty).
+AGE_GROUPS = ['0-1 Wk','2-7 Wks','2-5 Mos','6-11 Mos','1 Yr','2 Yrs','3 Yrs','4 Yrs','5 Yrs','6 Yrs','7 Yrs',
+              '8 Yrs','9 Yrs','10 Yrs','11 Yrs','12 Yrs','13 Yrs','14 Yrs','15 Yrs','16 Yrs','17 Yrs','18 Yrs',
+              '19 Yrs','20 Yrs']
+
+DAYS_PER_MONTH = 30.436875
+DAYS_PER_YEAR = 365.2425
+
+
+def age_years_and_bins(birthday, ref_date):
+    # ref_date can be a single date or a column of dates (e.g. intake/out dates)
+    if not isinstance(ref_date, pd.Series):
+        ref_date = pd.Timestamp(ref_date)
+    days = ((ref_date - birthday) / np.timedelta64(1, 'D')).to_numpy(dtype='float64', na_value=np.nan)
+
+    months = days / DAYS_PER_MONTH
+    years = np.floor(days / DAYS_PER_YEAR)
+
+    codes = np.select([months < 0.5, months < 2.0, months < 6.0, years < 1.0, years <= 20],
+                      [0, 1, 2, 3, np.clip(years, 1, 20) + 3], default=-1)
+    codes[np.isnan(days)] = -1
+
+    agecat = pd.Categorical.from_codes(codes.astype('int8'), categories=AGE_GROUPS, ordered=True)
+
+    return np.where(np.isnan(years), -1, years).astype('int16'), agecat
+
+
+def add_age_columns(d, ref_date, suffix=''):
+    # adds age (whole years) and agecat columns without copying the rest of the frame
+    age, agecat = age_years_and_bins(d.birthday, ref_date)
+    ages = pd.DataFrame({f'age{suffix}':age, f'agecat{suffix}':agecat}, index=d.index)
+
+    return pd.concat([d.drop(columns=ages.columns, errors='ignore'), ages], axis=1)
+
+
+@memoize
+def age_calc_at_in_out(d, date_for_comp='intake'):
+    # ages at intake/out are part of the enriched table, they're only added here for frames built some other way
+    if f'age_{date_for_comp}' in d and f'agecat_{date_for_comp}' in d:
+        return d
+    return add_age_columns(d, d[f'{date_for_comp}_date'], suffix=f'_{date_for_comp}')
+
+
+def enrich_ins_outs(d):
+    # the base table every page reads: the compact table plus the derived columns the pages used to add on every
+    # rerun (month numbers, age and age group at intake and at out). Built once per dataset version, and never
+    # changed afterwards - pages select rows from it with row positions (see below) rather than copying it.
+    attrs = {k:d.attrs[k] for k in ['version','partition'] if k in d.attrs}
+    d = _add_columns(d)
+    for date_for_comp in ['intake','out']:
+        d = add_age_columns(d, d[f'{date_for_comp}_date'], suffix=f'_{date_for_comp}')
+
+    d.attrs = attrs
+    return d
+
+
+# -----------------------------------------------
+# Row selections
+#
+# Page filters (the stays in a date window, the animals present in the last month, outcomes in the chosen dates)
+# are read-only arrays of row positions into the shared table rather than filtered copies of it. Data functions take
+# them as rows= and only gather the columns they need for those rows, so a session holds roughly the selected rows
+# of the few columns in use instead of copies of the whole table.
+
+def frozen(a):
+    # positions are cached and shared between sessions, so they can't be changed in place
+    a = np.asarray(a, dtype='int64')
+    a.flags.writeable = False
+    return a
+
+
+def column_values(d, column, rows=None):
+    values = d[column].to_numpy()
+    return values if rows is None else values[rows]
+
+
+def select_columns(d, columns, rows=None):
+    # a narrow frame of just these columns for the selected rows (keeping the table's index)
+    index = d.index if rows is None else d.index[rows]
+    return pd.DataFrame({c:d[c].array if rows is None else d[c].array.take(rows) for c in columns}, index=index)
+
+
+def date_rows(d, date_for_comp, start_date=None, end_date=None):
+    # positions of the rows with an intake/out date in [start_date, end_date] (any date when they're left out), in
+    # date order
+    return frozen(date_index_rows(date_index(d, date_for_comp), start_date, end_date))
+
+
+@memoize
+def distinct_ids(d, rows=None, flag=None):
+    # number of distinct animals in the selected rows, optionally only those with a flag column set
+    if coalition(d) is not None:
+        return d.merged('distinct_ids', rows, flag)
+
+    ids = column_values(d, 'id', rows)
+    if flag is not None:
+        ids = ids[column_values(d, flag, rows) == 1]
+    return pd.Series(ids).nunique()
+
+
+@memoize
+def save_rate_counts(d, start_date=None, end_date=None):
+    # distinct animals with an outcome in [start_date, end_date] (any date when they're left out), and how many of
+    # them were adopted
+    if coalition(d) is not None:
+        return d.merged('save_rate_counts', start_date, end_date)
+
+    sql = sql_backend(d)
+    if sql is not None:
+        return sql.save_rate_counts(d, start_date, end_date)
+
+    rows = date_rows(d, 'out', start_date, end_date)
+    return distinct_ids(d, rows=rows), distinct_ids(d, rows=rows, flag='out_adopt')
+
+
+# -----------------------------------------------
+# Date indexes
+#
+# Kept for the base table once per dataset version (with the other aggregates, so they're memory-mapped from the
+# columnar cache after a restart), or once per frame object for frames without a version.
+#
+# date_index: every row with an intake/out date, sorted by it, so a date range is two searchsorted calls and a slice
+# of row positions - O(log n + k) rather than comparing every row.
+#
+# stay_index: an interval tree over the stays' month intervals [in_month, out_month] (open stays run through the
+# month of the latest intake, as in stay_intervals). The tree is implicit: its nodes are the months 0..STAY_INDEX_MAX
+# (from Jan-1970) with the middle month as the root, like a binary search, and each stay is kept at the first node on
+# the way down whose month it contains. Stays are stored sorted by node, and within a node by start month and by end
+# month (descending). For a window [s, e] of months:
+#   - every stay at a node inside [s, e] overlaps it, and those nodes are one contiguous block
+#   - a node below s can only hold overlapping stays if it's on the path from the root to s, and those are the
+#     stays at it that end at or after s (a prefix of its end-sorted stays), likewise above e with the start months
+# so a query is one block plus at most two root-to-leaf paths of prefixes.
+
+STAY_INDEX_MAX = 2**15 - 1
+
+
+def table_index(name, d, build):
+    if dataset_version(d) is None:
+        return frame_cached(d, name, build)
+    return persisted_aggregate(name, d, {}, build)
+
+
+def as_datetime64(date, dtype):
+    return np.datetime64(pd.Timestamp(date).to_datetime64()).astype(dtype)
+
+
+def build_date_index(d, date_for_comp):
+    values = d[f'{date_for_comp}_date'].to_numpy()
+    rows = np.flatnonzero(~np.isnat(values))
+    order = rows[np.argsort(values[rows], kind='stable')]
+    return pd.DataFrame({'value':values[order], 'row':order})
+
+
+def date_index(d, date_for_comp):
+    return table_index(f'date_index_{date_for_comp}', d, lambda t: build_date_index(t, date_for_comp))
+
+
+def date_index_rows(index, start_date=None, end_date=None, stop_date=None):
+    # rows dated from start_date through end_date, or up to (not including) stop_date
+    values = index['value'].to_numpy()
+    lo = 0 if start_date is None else np.searchsorted(values, as_datetime64(start_date, values.dtype), 'left')
+    if stop_date is not None:
+        hi = np.searchsorted(values, as_datetime64(stop_date, values.dtype), 'left')
+    elif end_date is not None:
+        hi = np.searchsorted(values, as_datetime64(end_date, values.dtype), 'right')
+    else:
+        hi = len(values)
+    return index['row'].to_numpy()[lo:hi]
+
+
+def date_bounds(d, date_for_comp):
+    # earliest and latest intake/out date, read from the ends of the date index
+    if coalition(d) is not None:
+        return d.merged('date_bounds', date_for_comp)
+
+    values = date_index(d, date_for_comp)['value']
+    return (values.iloc[0], values.iloc[-1]) if len(values) > 0 else (pd.NaT, pd.NaT)
+
+
+def build_stay_index(d):
+    in_month, out_month, _ = stay_intervals(d)
+    rows = np.flatnonzero((in_month >= 0) & (in_month <= out_month))
+    start, end = in_month[rows], out_month[rows]
+
+    # walk every stay down the tree at once until it contains its node's month
+    node = np.zeros(len(rows), dtype='int32')
+    pending = np.arange(len(rows))
+    lo = np.zeros(len(rows), dtype='int32')
+    hi = np.full(len(rows), STAY_INDEX_MAX, dtype='int32')
+    while len(pending) > 0:
+        mid = (lo + hi) // 2
+        here = (start[pending] <= mid) & (end[pending] >= mid)
+        node[pending[here]] = mid[here]
+        left = end[pending] < mid
+        lo, hi = np.where(left, lo, mid + 1), np.where(left, mid - 1, hi)
+        pending, lo, hi = pending[~here], lo[~here], hi[~here]
+
+    by_start = np.lexsort((start, node))
+    by_end = np.lexsort((-end, node))
+    return pd.DataFrame({'node':node[by_start],
+                         'start':start[by_start],
+                         'start_row':rows[by_start],
+                         'minus_end':-end[by_end],
+                         'end_row':rows[by_end]})
+
+
+def stay_index(d):
+    return table_index('stay_index', d, build_stay_index)
+
+
+def stay_index_rows(index, start_idx, end_idx):
+    # row positions of the stays overlapping months [start_idx, end_idx]
+    node = index['node'].to_numpy()
+    start = index['start'].to_numpy()
+    minus_end = index['minus_end'].to_numpy()
+    start_row = index['start_row'].to_numpy()
+    end_row = index['end_row'].to_numpy()
+
+    # keys are int32 like the columns, any other integer type makes searchsorted cast the whole column first
+    month32 = np.int32
+    parts = [start_row[np.searchsorted(node, month32(start_idx), 'left'):np.searchsorted(node, month32(end_idx),
+                                                                                          'right')]]
+    for month, below in [(start_idx, True), (end_idx, False)]:
+        lo, hi = 0, STAY_INDEX_MAX
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if mid == month:
+                break
+            a, b = np.searchsorted(node, month32(mid), 'left'), np.searchsorted(node, month32(mid), 'right')
+            if mid < month:
+                if below and a < b:
+                    parts.append(end_row[a:a + np.searchsorted(minus_end[a:b], month32(-month), 'right')])
+                lo = mid + 1
+            else:
+                if not below and a < b:
+                    parts.append(start_row[a:a + np.searchsorted(start[a:b], month32(month), 'right')])
+                hi = mid - 1
+
+    return np.concatenate(parts)
+
+
+AGE_BREAKDOWN_COLUMNS = ['id','type','breed','intake_date','out_date']
+
+
+@memoize
+def age_breakdown_asof_today_data_prep(d, end_date, rows=None):
+    # ages as of end_date for the selected rows, returned with the few columns the length of stay and breed sections
+    # read (the table itself is left as it is)
+    tmp = select_columns(d, [c for c in AGE_BREAKDOWN_COLUMNS if c in d] + ['birthday'], rows)
+    tmp = add_age_columns(tmp, end_date)
+    agedf = tmp.groupby(['type','agecat'], observed=True)['id'].nunique().reset_index()
+
+    return tmp, agedf
+
+
+def general_age_data_prep(d, start_month, end_month, end_date):
+    # the General page's age sections: ages as of end_date for the animals present in end_month and over the chosen
+    # months. All shelters at once only have their merged counts, so their per-animal frames are None
+    if coalition(d) is not None:
+        lastmo_age, hist_age = d.merged('general_age_counts', start_month, end_month, end_date)
+        return (None, lastmo_age), (None, hist_age)
+
+    stays = date_filter_month_firsts(d, start_month, end_month)
+    return (age_breakdown_asof_today_data_prep(d, end_date, rows=month_snapshot_rows(stays, end_month)),
+            age_breakdown_asof_today_data_prep(d, end_date, rows=stay_rows(stays)))
+
+
+@memoize
+def breed_breakdown_data_prep(d, rows=None):
+    # distinct animals per type x breed for the selected rows (e.g. month_snapshot_rows or stay_rows), most common
+    # breeds last within each type as the bar plots list them
+    tmp = select_columns(d, ['id','type','breed'], rows)
+    breeddf = tmp.groupby(['type','breed'], observed=True)['id'].nunique().reset_index()
+
+    return breeddf.sort_values(by=['type','id'], ascending=[False,True]).reset_index(drop=True)
+
+
+@memoize
+def length_stay_calc(d, rows=None):
+    # length of stay of the selected rows (e.g. the outcomes in the chosen dates): months and whole years from intake
+    # to out, and the stay bucketed like the age groups (cat_stay), as the notebook's length_stay_calc had them
+    tmp = select_columns(d, ['id','type','intake_date','out_date'], rows)
+    days = ((tmp.out_date - tmp.intake_date) / np.timedelta64(1, 'D')).to_numpy(dtype='float64', na_value=np.nan)
+    years, catstay = age_years_and_bins(tmp.intake_date, tmp.out_date)
+
+    return tmp.assign(months_stay=days / DAYS_PER_MONTH, years_stay=years, cat_stay=catstay)
+
+
+@memoize
+def length_stay_outcome_data_prep(staydf):
+    # distinct animals per type x length of stay group
+    return staydf.groupby(['type','cat_stay'], observed=True)['id'].nunique().reset_index()
+
+
+# -----------------------------------------------
+# Monthly occupancy
+#
+# Every stay is treated as an integer month interval [in_month, out_month], where months are counted from Jan-1970
+# (the same numbering numpy uses for datetime64[M]). Open stays run through the month of the latest intake date.
+# Monthly totals and in/out categories are then counted with difference arrays instead of building one row per
+# animal per month. The counts are kept for the full history (once per dataset version) and sliced for each window.
+
+CATEGORY_ORDER = {'Continued Stay':1, 'Intake':2, 'In/Out Same Month':3, 'Outcome':4}
+
+
+def month_index(dates):
+    # integer month number of each date (NaT comes back as -1, callers mask those out)
+    dates = pd.to_datetime(pd.Series(dates))
+    idx = dates.values.astype('datetime64[M]').astype('int64')
+    return np.where(dates.notnull().values, idx, -1)
+
+
+def month_first(idx):
+    # inverse of month_index for an array of month numbers
+    return pd.to_datetime(np.asarray(idx, dtype='int64').astype('datetime64[M]'))
+
+
+def stay_intervals(d, max_month=None, rows=None):
+    # intake month, out month and whether the stay has really ended, for every stay (or just the rows given)
+    if max_month is None:
+        max_month = month_index([date_bounds(d, 'intake')[1]])[0]
+
+    # int32 like the table's month columns, so the full table's months aren't widened on every call
+    in_month = np.asarray(month_idx_column(d, 'intake', rows), dtype='int32')
+    real_out = ~np.isnat(column_values(d, 'out_date', rows))
+    out_month = np.where(real_out, month_idx_column(d, 'out', rows), np.int32(max_month))
+    out_month = out_month.astype('int32', copy=False)
+
+    return in_month, out_month, real_out
+
+
+def occupancy_arrays(in_month, out_month, real_out, first_month, nmonths):
+    # animals present, intakes, outcomes and in/out same month for each of nmonths months from first_month
+    valid = (in_month >= 0) & (in_month <= out_month)
+    in_pos = in_month[valid] - first_month
+    out_pos = out_month[valid] - first_month
+    real_out = real_out[valid]
+
+    # animals present: +1 where a stay starts, -1 the month after it ends (clipped to the months counted)
+    diff = np.zeros(nmonths + 1, dtype='int64')
+    np.add.at(diff, np.clip(in_pos, 0, nmonths), 1)
+    np.add.at(diff, np.clip(out_pos, -1, nmonths - 1) + 1, -1)
+    present = np.cumsum(diff)[:nmonths]
+
+    in_range = (in_pos >= 0) & (in_pos < nmonths)
+    out_range = real_out & (out_pos >= 0) & (out_pos < nmonths)
+    same_range = in_range & out_range & (in_pos == out_pos)
+
+    return {'present':present,
+            'ins':np.bincount(in_pos[in_range], minlength=nmonths),
+            'outs':np.bincount(out_pos[out_range], minlength=nmonths),
+            'same':np.bincount(in_pos[same_range], minlength=nmonths)}
+
+
+def build_occupancy_counts(d):
+    in_month, out_month, real_out = stay_intervals(d)
+    valid = (in_month >= 0) & (in_month <= out_month)
+    if not valid.any():
+        return pd.DataFrame({'month_idx':[], 'present':[], 'ins':[], 'outs':[], 'same':[]}, dtype='int64')
+
+    first_month = in_month[valid].min()
+    nmonths = out_month[valid].max() - first_month + 1
+
+    counts = occupancy_arrays(in_month, out_month, real_out, first_month, nmonths)
+    return pd.DataFrame({'month_idx':np.arange(first_month, first_month + nmonths), **counts})
+
+
+def occupancy_counts(d):
+    if coalition(d) is not None:
+        return d.merged('occupancy_counts')
+
+    sql = sql_backend(d)
+    return persisted_aggregate('occupancy', d, {}, sql.build_occupancy_counts if sql else build_occupancy_counts)
+
+
+@memoize
+def date_filter_month_firsts(iodf, start_month, end_month):
+    # returns one row per stay (same index as iodf) for every animal in the shelter for at least part of the chosen
+    # months, with its row position in iodf, the integer month the stay starts and ends and whether the end is a real
+    # outcome
+    start_idx = month_index([start_month])[0]
+    end_idx = month_index([end_month])[0]
+
+    # stays are found with the interval index, and only their rows are read (kept in table order)
+    rows = np.sort(stay_index_rows(stay_index(iodf), start_idx, end_idx))
+    in_month, out_month, real_out = stay_intervals(iodf, rows=rows)
+
+    return pd.DataFrame({'id':column_values(iodf, 'id', rows),
+                         'row':rows,
+                         'in_month':in_month,
+                         'out_month':out_month,
+                         'real_out':real_out.astype(int)},
+                        index=iodf.index[rows])
+
+
+@memoize
+def monthly_in_out_data_prep(occupancy, start_month, end_month):
+    start_idx = month_index([start_month])[0]
+    end_idx = month_index([end_month])[0]
+    nmonths = end_idx - start_idx + 1
+
+    counts = occupancy.set_index('month_idx').reindex(np.arange(start_idx, end_idx + 1), fill_value=0)
+    present, ins, outs, same = [counts[c].to_numpy() for c in ['present','ins','outs','same']]
+
+    months = month_first(np.arange(start_idx, end_idx + 1))
+
+    # data for the waterfall plot
+    monthtot = pd.DataFrame({'months':months, 'id':present})
+    monthtot = monthtot[monthtot.id > 0].reset_index(drop=True)
+    monthtot = monthtot.assign(month=lambda t: t.months.dt.strftime("%y-%m"),
+                               change=lambda t: t.id - t.id.shift(1),
+                               label=lambda t: np.where(t.change.isnull(), t.id, t.change))
+    monthtot = monthtot.assign(label=lambda t: t.label.astype(int))
+
+    # data for the in/out bar plot
+    bymonth_types = pd.DataFrame({'months':np.tile(months, 4),
+                                  'category':np.repeat(['Intake','Outcome','In/Out Same Month','Continued Stay'],
+                                                       nmonths),
+                                  'id':np.concatenate([ins - same, outs - same, same,
+                                                       present - ins - outs + same])})
+    bymonth_types = bymonth_types[bymonth_types.id > 0].assign(order=lambda t: t.category.map(CATEGORY_ORDER))
+    bymonth_types = bymonth_types.sort_values(by=['months','order']).reset_index(drop=True)
+
+    return monthtot, bymonth_types
+
+
+def stay_rows(stays):
+    # row positions (in the table stays was built from) of the stays in a date window
+    return frozen(stays['row'].to_numpy())
+
+
+@memoize
+def month_snapshot_rows(stays, month):
+    # row positions of the animals present in a single month (e.g. the last month chosen)
+    idx = month_index([month])[0]
+    present = (stays.in_month <= idx) & (stays.out_month >= idx)
+
+    return frozen(stays['row'].to_numpy()[present.to_numpy()])
+
+
+# -----------------------------------------------
+# Monthly aggregate cube for the Intakes/Outcomes pages
+#
+# One row per month x type x breed x age group x intake/outcome flag x agency, with the number of distinct animals in
+# each cell. The cube is built once per dataset version and date_for_comp ('intake' or 'out'); every date window is
+# then answered by slicing the cube for the full months in it, plus the raw rows of any partially chosen month.
+
+CUBE_DIMS = ['months','type','breed','agecat','flag','agency']
+
+_AGGREGATES = {}
+_AGGREGATE_LOCKS = {}
+_AGGREGATE_LOCKS_LOCK = threading.Lock()
+
+
+def sql_backend(d):
+    # the SQL backend when it's selected, for versioned tables (its Parquet copy is kept per dataset version)
+    if BACKEND != 'duckdb' or dataset_version(d) is None:
+        return None
+    import sql_backend
+    return sql_backend
+
+
+def dataset_version(d):
+    # set by data_ins_outs from the source file (plus any ingested batches), frames built some other way share a
+    # single version
+    return d.attrs.get('version')
+
+
+def persisted_aggregate(name, d, params, build):
+    # aggregates (monthly counts, cubes) are built once per dataset version and kept in memory and in the columnar
+    # cache, so a restarted server or a new ingested batch (see ingest.py) doesn't need to rebuild them from scratch
+    version = dataset_version(d)
+    if version is None:
+        return build(d)
+
+    partition = dataset_partition(d)
+    mem_key = (partition, name, repr(params))
+    if mem_key in _AGGREGATES and _AGGREGATES[mem_key][0] == version:
+        return _AGGREGATES[mem_key][1]
+
+    # one build per aggregate at a time - sessions asking for it meanwhile wait, and then find it built
+    with _AGGREGATE_LOCKS_LOCK:
+        lock = _AGGREGATE_LOCKS.setdefault(mem_key, threading.RLock())
+    with lock:
+        if mem_key in _AGGREGATES and _AGGREGATES[mem_key][0] == version:
+            return _AGGREGATES[mem_key][1]
+
+        key = {'version':version, 'params':params}
+        agg = data_cache.read_cache(name, key, partition_cache_dir(partition))
+        if agg is None:
+            agg = build(d)
+            data_cache.write_cache(agg, name, key, partition_cache_dir(partition))
+
+        agg.attrs['version'] = version
+        _AGGREGATES[mem_key] = (version, agg)
+        return agg
+
+
+def build_inout_cube(d, flags, date_for_comp='intake'):
+    dates = d[f'{date_for_comp}_date']
+    d = d[dates.notnull()]
+
+    # name of the flag column set for each animal (empty if none of them are), using the compact table's single
+    # intake/outcome flag column when it has one
+    if f'{date_for_comp}_flag' in d:
+        flag = d[f'{date_for_comp}_flag'].astype(object).where(d[f'{date_for_comp}_flag'].isin(flags)).values
+    else:
+        flag = np.asarray(flag_column(d, flags)).astype(object)
+
+    cube = pd.DataFrame({'months':month_first(month_idx_column(d, date_for_comp)),
+                         'type':d['type'].values,
+                         'breed':d['breed'].values,
+                         'agecat':d[f'agecat_{date_for_comp}'].values,
+                         'flag':flag,
+                         'agency':d[f'{date_for_comp}_agency_name'].values,
+                         'id':d['id'].values})
+
+    return cube.groupby(CUBE_DIMS, dropna=False, observed=True)['id'].nunique().reset_index()
+
+
+def inout_cube(d, mapping, date_for_comp='intake'):
+    flags = list(mapping.keys())
+    sql = sql_backend(d)
+    build = sql.build_inout_cube if sql else build_inout_cube
+    return persisted_aggregate(f'cube_{date_for_comp}', d, {'flags':flags}, lambda t: build(t, flags, date_for_comp))
+
+
+@memoize
+def inout_cube_window(d, mapping, start_date, end_date, date_for_comp='intake'):
+    if coalition(d) is not None:
+        return d.merged('inout_cube_window', mapping, start_date, end_date, date_for_comp)
+
+    # with the SQL backend the window is one query, the date range being pushed down to the Parquet scan
+    sql = sql_backend(d)
+    if sql is not None:
+        return sql.build_inout_cube(d, list(mapping.keys()), date_for_comp, start_date, end_date)
+
+    cube = inout_cube(d, mapping, date_for_comp)
+
+    # months fully inside the chosen dates come straight from the cube
+    start_idx = month_index([start_date])[0]
+    end_idx = month_index([end_date])[0]
+    first_full = start_idx if start_date.day == 1 else start_idx + 1
+    last_full = end_idx if (pd.Timestamp(end_date) + pd.Timedelta(days=1)).day == 1 else end_idx - 1
+
+    cube_idx = month_index(cube.months)
+    window = cube[(cube_idx >= first_full) & (cube_idx <= last_full)]
+
+    # partially chosen months at either end are counted from the raw rows for just those days
+    index = date_index(d, date_for_comp)
+    if first_full <= last_full:
+        edge_rows = np.concatenate([date_index_rows(index, start_date, stop_date=month_first([first_full])[0]),
+                                    date_index_rows(index, month_first([last_full + 1])[0], end_date)])
+    else:
+        edge_rows = date_index_rows(index, start_date, end_date)
+    edges = d.take(np.sort(edge_rows))
+    if len(edges) > 0:
+        window = pd.concat([window, build_inout_cube(edges, list(mapping.keys()), date_for_comp)])
+
+    # stable, so each month keeps the cube's order (the order of CUBE_DIMS)
+    return window.sort_values(by='months', kind='stable').reset_index(drop=True)
+
+
+@memoize
+def inout_heatmap_data_prep(cube, date_for_comp='intake'):
+    bymonth = cube.groupby('months')['id'].sum().reset_index()
+    bymonth = bymonth.assign(**{f'{date_for_comp}_moname':bymonth.months.dt.strftime('%b'),
+                                f'{date_for_comp}_year':bymonth.months.dt.strftime('%Y'),
+                                f'{date_for_comp}_month':bymonth.months.dt.strftime('%Y-%m')})
+
+    return bymonth.filter([f'{date_for_comp}_moname',f'{date_for_comp}_year',f'{date_for_comp}_month','id'])
+
+
+@memoize
+def inout_types_month_data_prep(cube, mapping, date_for_comp='intake'):
+    # every flag for every month in the window, including months where a flag has no animals
+    bytype = cube.pivot_table(index='months', columns='flag', values='id', aggfunc='sum')
+    bytype = bytype.reindex(columns=list(mapping.keys())).fillna(0).astype(int)
+    bytype.columns.name = None
+
+    bytype = bytype.reset_index().melt(id_vars=['months'], var_name='type', value_name='count')
+    bytype = bytype.assign(month=lambda t: t.months,
+                           qtrnum=lambda t: (t.month.dt.month-1)//3+1,
+                           type=lambda t: t.type.map(mapping),
+                           **{f'{date_for_comp}_month':lambda t: t.month.dt.strftime('%Y-%m')})
+    bytype['qtr'] = "Q" + bytype.qtrnum.astype(str) + "-'" + bytype.month.dt.strftime('%y')
+
+    type_month = bytype.groupby(['month',f'{date_for_comp}_month','qtrnum','qtr','type'])['count'].sum()\
+                    .reset_index()
+
+    type_qtr = type_month.groupby(['qtr','type']).agg({'count':'sum','month':'min'})\
+                    .sort_values(by=['month','type']).reset_index()
+
+    return type_month, type_qtr
+
+
+@memoize
+def inout_agencies_data_prep(cube, date_for_comp='intake'):
+    agency = cube[cube.agency.notnull()]
+    agency = agency.assign(agencytype=np.where(agency.flag == f'{date_for_comp}_state_agency', 'State',
+                                               np.where(agency.flag == f'{date_for_comp}_domestic_agency', 'Domestic',
+                                                        'International')))
+    agency = agency.assign(agencyorder=np.where(agency.agencytype == 'State', 1,
+                                                np.where(agency.agencytype == 'Domestic', 2, 3)))
+
+    agencygrp = agency.groupby(['agencytype','agency','agencyorder'], observed=True)['id'].sum().reset_index()\
+                    .rename(columns={'agency':f'{date_for_comp}_agency_name'})\
+                    .sort_values(by=['agencyorder','id'], ascending=[False,True])
+
+    return agencygrp
+
+
+def monthly_category_data_prep(cube, column, start_month, end_month, categories=None, date_for_comp='intake'):
+    # counts by month x type x category (breed or age group) with every month between start_month and end_month
+    # for every category seen for a type, plus each category's share of that type's animals in the month
+    counts = cube.groupby(['months','type',column], observed=True)['id'].sum()
+
+    # with a category list (age groups), every type gets every category seen in the data, in the list's order
+    pairs = counts.reset_index()[['type',column]].drop_duplicates()
+    if categories is not None:
+        seen = [c for c in categories if c in set(pairs[column])]
+        types = sorted(pairs['type'].unique())
+        pairs = pd.DataFrame({'type':np.repeat(types, len(seen)), column:np.tile(seen, len(types))})
+    else:
+        pairs = pairs.sort_values(by=['type',column])
+
+    months = pd.date_range(start_month, end_month, freq='MS')
+    grid = pd.MultiIndex.from_arrays([np.repeat(months, len(pairs)),
+                                      np.tile(pairs['type'].values, len(months)),
+                                      np.tile(pairs[column].values, len(months))],
+                                     names=['months','type',column])
+
+    monthly = counts.reindex(grid, fill_value=0).reset_index()
+    monthly['id'] = monthly['id'].astype(int)
+    monthly['monthly_perc'] = (monthly['id'] / monthly.groupby(['months','type'])['id'].transform('sum')).fillna(0)
+
+    return monthly.rename(columns={'months':f'{date_for_comp}_first'})
+
+
+@memoize
+def category_line_arrays(monthly, species, column, max_base='history', date_for_comp='intake'):
+    # one species' lines from a monthly_category_data_prep grid as 2-D arrays (category x month), ready to plot
+    # without filtering the frame again per category. highlight marks the categories with the species' highest count,
+    # over the full history or in the latest month, which are the ones the line plots color.
+    months = monthly[f'{date_for_comp}_first'].unique()
+    rows = monthly[(monthly.type == species).to_numpy()]
+    ncat = len(rows) // len(months) if len(months) > 0 else 0
+
+    # the grid is month-major with the same categories in the same order for every month
+    categories = rows[column].to_numpy()[:ncat]
+    counts = rows['id'].to_numpy().reshape(len(months), ncat).T
+    perc = rows['monthly_perc'].to_numpy().reshape(len(months), ncat).T
+
+    highlight = np.zeros(ncat, dtype=bool)
+    if ncat > 0 and len(months) > 0:
+        score = counts[:, -1] if max_base == 'latest' else counts.sum(axis=1)
+        highlight = score == score.max()
+
+    return {'months':np.asarray(months), 'categories':categories, 'counts':counts, 'monthly_perc':perc,
+            'highlight':highlight}
+
+
+@memoize
+def inout_breed_data_prep(cube, start_month, end_month, date_for_comp='intake'):
+    return monthly_category_data_prep(cube, 'breed', start_month, end_month, date_for_comp=date_for_comp)
+
+
+@memoize
+def inout_age_data_prep(cube, start_month, end_month, age_groups, date_for_comp='intake'):
+    agedf = monthly_category_data_prep(cube, 'agecat', start_month, end_month, categories=age_groups,
+                                       date_for_comp=date_for_comp)
+    return agedf.rename(columns={'agecat':f'agecat_{date_for_comp}'})
+
+
+# -----------------------------------------------
+# Length of stay sketches
+#
+# Lengths of stay are kept as fixed-bin histograms per month x type x age group instead of one value per animal.
+# Bins are log-spaced in days (STAY_BINS_PER_DOUBLING bins per doubling, so a quantile read from a bin is within
+# roughly 2**(1/bins) of the exact one, plus one bin for same-day stays), and a stay is counted in the month it ended.
+# Open stays run up to the latest intake date (like out_fill did) and are counted in that month, so they show up in
+# any window reaching the latest month. The histograms are built once per dataset version (and patched for the
+# months an ingested batch touches, see ingest.py); a date window just adds up its months, whatever the number of
+# animals in it.
+
+STAY_BINS_PER_DOUBLING = int(os.environ.get('SHELTER_DASH_STAY_BINS', 8))
+
+# stays up to 2**14 days (~45 years), anything longer goes in the last bin
+STAY_MAX_DOUBLINGS = 14
+
+LENGTH_AGE_GROUPS = ['0-1 Yr','1-5 Yrs','5-10 Yrs','10-15 Yrs','15+ Yrs']
+
+# points per half violin on the length of stay plots
+STAY_PLOT_POINTS = 60
+
+
+def stay_bin_edges(bins_per_doubling=STAY_BINS_PER_DOUBLING):
+    # edges in days of each bin: [0, 1) for same-day stays, then log-spaced from 1 day
+    steps = np.arange(STAY_MAX_DOUBLINGS * bins_per_doubling + 1)
+    return np.concatenate([[0.0], 2.0 ** (steps / bins_per_doubling)])
+
+
+def stay_bins(days, bins_per_doubling=STAY_BINS_PER_DOUBLING):
+    nbins = STAY_MAX_DOUBLINGS * bins_per_doubling + 1
+    with np.errstate(divide='ignore'):
+        bins = 1 + np.floor(np.log2(np.maximum(days, 1)) * bins_per_doubling)
+    return np.where(days < 1, 0, np.minimum(bins, nbins - 1)).astype('int16')
+
+
+def length_age_groups(years):
+    # coarse age groups for the length of stay plots (empty when the age is unknown)
+    codes = np.where(years < 0, -1, np.searchsorted([1, 5, 10, 15], years, 'right'))
+    return pd.Categorical.from_codes(codes.astype('int8'), categories=LENGTH_AGE_GROUPS, ordered=True)
+
+
+def stay_lengths(d, rows=None):
+    # length of every stay in days, the month it ended in, whether it's still open and the age group at its end
+    intake = column_values(d, 'intake_date', rows)
+    out = column_values(d, 'out_date', rows)
+    last_date = np.datetime64(date_bounds(d, 'intake')[1], 'ns')
+
+    is_open = np.isnat(out)
+    end = np.where(is_open, last_date, out)
+    days = (end - intake) / np.timedelta64(1, 'D')
+    valid = ~np.isnat(intake) & (days >= 0)
+
+    month = np.where(is_open, np.int32(month_index([last_date])[0]), month_idx_column(d, 'out', rows))
+    years, _ = age_years_and_bins(pd.Series(column_values(d, 'birthday', rows)), pd.Series(end))
+    species = d['type'].array if rows is None else d['type'].array.take(rows)
+
+    return pd.DataFrame({'month_idx':month[valid].astype('int32'),
+                         'open':is_open[valid].astype('int8'),
+                         'type':species[valid],
+                         'agegroup':length_age_groups(years[valid]),
+                         'days':days[valid]})
+
+
+def build_stay_sketches(d, bins_per_doubling=STAY_BINS_PER_DOUBLING, rows=None):
+    lengths = stay_lengths(d, rows)
+    lengths['bin'] = stay_bins(lengths.pop('days').to_numpy(), bins_per_doubling)
+
+    sketches = lengths.groupby(['month_idx','open','type','agegroup','bin'], dropna=False, observed=True).size()
+    return sketches.rename('count').reset_index()
+
+
+def stay_sketches(d):
+    if coalition(d) is not None:
+        return d.merged('stay_sketches')
+
+    return persisted_aggregate('stay_sketches', d, {'bins_per_doubling':STAY_BINS_PER_DOUBLING},
+                               lambda t: build_stay_sketches(t, STAY_BINS_PER_DOUBLING))
+
+
+@memoize
+def stay_distribution(sketches, start_month, end_month, bins_per_doubling=STAY_BINS_PER_DOUBLING):
+    # merged histogram of the stays ending in [start_month, end_month] by type x age group, plus 'All Ages' for each
+    # type, with every bin's edges in days
+    start_idx = month_index([start_month])[0]
+    end_idx = month_index([end_month])[0]
+    months = sketches['month_idx'].to_numpy()
+    window = sketches[(months >= start_idx) & (months <= end_idx)]
+
+    by_age = window.groupby(['type','agegroup','bin'], observed=True)['count'].sum().reset_index()
+    all_ages = window.groupby(['type','bin'], observed=True)['count'].sum().reset_index().assign(agegroup='All Ages')
+    dist = pd.concat([all_ages, by_age.assign(agegroup=by_age.agegroup.astype(object))], ignore_index=True)
+    dist['agegroup'] = pd.Categorical(dist.agegroup, categories=['All Ages'] + LENGTH_AGE_GROUPS, ordered=True)
+    dist = dist.sort_values(by=['type','agegroup','bin']).reset_index(drop=True)
+
+    edges = stay_bin_edges(bins_per_doubling)
+    bins = dist['bin'].to_numpy()
+    return dist.assign(lo=edges[bins], hi=edges[bins + 1])
+
+
+def sketch_cdf(lo, hi, counts, days):
+    # share of a histogram's stays shorter than each of days, spreading every bin's stays evenly over it
+    cum = np.concatenate([[0], np.cumsum(counts)])
+    pos = np.clip(np.searchsorted(lo, days, 'right') - 1, 0, len(lo) - 1)
+    inside = np.clip((days - lo[pos]) / (hi[pos] - lo[pos]), 0, 1)
+    return (cum[pos] + inside * counts[pos]) / max(cum[-1], 1)
+
+
+def sketch_quantiles(lo, hi, counts, qs):
+    # inverse of sketch_cdf, for one histogram with its bins in order
+    cum = np.cumsum(counts)
+    target = np.asarray(qs) * cum[-1]
+    pos = np.minimum(np.searchsorted(cum, target, 'left'), len(cum) - 1)
+    frac = (target - (cum[pos] - counts[pos])) / np.maximum(counts[pos], 1)
+    return lo[pos] + np.clip(frac, 0, 1) * (hi[pos] - lo[pos])
+
+
+@memoize
+def length_stay_sketch_data_prep(dist, max_points=STAY_PLOT_POINTS):
+    # per type x age group: number of stays, quartiles and mean (years), and a density over max_points steps from 0 to
+    # the highest 99th percentile of the groups, for the half violins - so the plot's size doesn't grow with the
+    # number of animals in it
+    groups = [(key, g) for key, g in dist.groupby(['type','agegroup'], observed=True, sort=True) if g['count'].sum() > 0]
+    top = max([sketch_quantiles(g.lo.to_numpy(), g.hi.to_numpy(), g['count'].to_numpy(), [.99])[0]
+               for _, g in groups], default=1.0)
+    steps = np.linspace(0, max(top, 1.0), max_points + 1)
+
+    summary = []
+    density = []
+    for (species, agegroup), g in groups:
+        lo, hi, counts = g.lo.to_numpy(), g.hi.to_numpy(), g['count'].to_numpy()
+        q25, q50, q75 = sketch_quantiles(lo, hi, counts, [.25, .5, .75]) / DAYS_PER_YEAR
+        summary.append({'type':species, 'agegroup':agegroup, 'n':int(counts.sum()), 'q25':q25, 'median':q50,
+                        'q75':q75, 'mean':(counts * (lo + hi) / 2).sum() / max(counts.sum(), 1) / DAYS_PER_YEAR})
+        density.append(pd.DataFrame({'type':species, 'agegroup':agegroup, 'years':steps[:-1] / DAYS_PER_YEAR,
+                                     'share':np.diff(sketch_cdf(lo, hi, counts, steps))}))
+
+    summary = pd.DataFrame(summary, columns=['type','agegroup','n','q25','median','q75','mean'])
+    density = pd.concat(density, ignore_index=True) if len(density) > 0 else \
+        pd.DataFrame(columns=['type','agegroup','years','share'])
+    for frame in (summary, density):
+        frame['agegroup'] = pd.Categorical(frame.agegroup, categories=dist.agegroup.cat.categories, ordered=True)
+    return summary, density
+
+
+def general_length_data_prep(d, start_month, end_month):
+    # the General page's length of stay sections: stays ending in end_month and in the chosen months, merged from the
+    # monthly sketches
+    sketches = stay_sketches(d)
+    return (length_stay_sketch_data_prep(stay_distribution(sketches, end_month, end_month)),
+            length_stay_sketch_data_prep(stay_distribution(sketches, start_month, end_month)))
@@ -1,20 +1,55 @@
-import streamlit as st
+import threading
 import pandas as pd
-import datetime
-from datetime import timedelta
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.graph_objs import *
-from plotly.graph_objs.scatter.marker import Line
-from plotly.subplots import make_subplots
-import numpy as np
-import plot_settings
-from multiapp import MultiApp
-import plot_functions
+import data_cache
+
+SOCO_PATH = 'sonoma_county_inout.csv'
+
+# rows read from the csv at a time - memory stays around one chunk no matter how big the county file gets
+SOCO_CHUNKSIZE = 100_000
+
+SOCO_DATE_COLUMNS = ['Date Of Birth','Intake Date','Outcome Date']
+SOCO_NUMBER_COLUMNS = {'Days in Shelter':'float32', 'Count':'float32'}
+
+_SHARED = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def clean_soco_text(value):
+    return str(value).replace('*', '').title()
+
+
+def soco_column_name(c):
+    return c.lower().replace(' ','_')
+
 
 # load soco data
-@st.cache
-def load_and_format_data(d):
-    d.columns = [x.lower().replace(' ','_') for x in d.columns]
+def load_and_format_data(path=SOCO_PATH, chunksize=SOCO_CHUNKSIZE):
+    # streams the csv into the columnar cache in chunks (only when the file has changed since the last load), with
+    # lower case column names and text columns stripped of '*' and title-cased once per unique value
+    key = data_cache.source_key(path)
+    d = data_cache.read_cache('soco', key)
+    if d is not None:
+        return d
+
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = {c:SOCO_NUMBER_COLUMNS.get(c, str) for c in header if c not in SOCO_DATE_COLUMNS}
+
+    writer = data_cache.CacheWriter('soco', key, text_transform=clean_soco_text)
+    for chunk in pd.read_csv(path, dtype=dtypes, parse_dates=[c for c in SOCO_DATE_COLUMNS if c in header],
+                             chunksize=chunksize):
+        chunk.columns = [soco_column_name(c) for c in chunk.columns]
+        writer.append(chunk)
+    writer.close()
+
+    return data_cache.read_cache('soco', key)
+
 
-    d.select_dtypes(include=['object']).apply(lambda x: x.str.replace('*', '', regex=True).str.title())
+def shared_soco_data(path=SOCO_PATH):
+    # one copy per process, loaded the first time the page needs it and shared read-only by every session - only
+    # loaded again once the csv changes
+    key = tuple(data_cache.source_key(path).values())
+    with _SHARED_LOCK:
+        if _SHARED.get('key') != key:
+            _SHARED['socodf'] = load_and_format_data(path)
+            _SHARED['key'] = key
+        return _SHARED['socodf']
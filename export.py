@@ -0,0 +1,307 @@
+import os
+import json
+import shutil
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from plotly.offline import get_plotlyjs_version
+import data_cache
+import data_functions
+import line_plots
+import plot_functions
+import stay_plots
+
+# -----------------------------------------------
+# Static snapshots of the dashboard pages
+#
+# Renders the General/Intakes/Outcomes pages for every month (or quarter/year, or given date windows) to static files
+# that can be served without a Streamlit session: <out>/<window>/<page>.json holds every section's prepared data, the
+# figures the pages build as figure objects are written as stand-alone HTML, and <out>/index.json + index.html list
+# the windows. The figures are the General page's age, length of stay and breed bars (last month and the whole
+# window), the Intakes/Outcomes breed and age lines and the types comparison bars (for the page's default types).
+#
+# Only exported as data in the page's JSON, not as HTML, since plot_functions draws them straight onto the Streamlit
+# page instead of returning a figure:
+#   - the General page's monthly waterfall and in/out bars
+#   - the Intakes/Outcomes monthly heatmaps, types stacked bars and quarter lines, and agency bars
+# and likewise the Outcomes length of stay bars, which are a Streamlit bar chart.
+#
+# Windows are rendered on a process pool. Each worker loads the (memory mapped) dataset once and keeps its memo cache
+# between windows, and the aggregates every window slices from (the occupancy counts, the length of stay sketches and
+# the intake/outcome cubes) are built once up front in the persisted aggregate cache, so workers only read them.
+#
+# Exports are incremental: each window is fingerprinted from the rows of every animal whose stay overlaps it, and only
+# windows whose fingerprint changed since the last export (or that are missing) are rendered again.
+#
+# Usage: `python export.py [--period month quarter year] [--window 2021-01-01:2021-06-30] [--out snapshots]`
+
+EXPORT_DIR = 'snapshots'
+
+# bump when the output format changes, so the next export re-renders everything
+EXPORT_FORMAT = 2
+
+# types compared month by month on the types comparison figures, as the pages default to
+TYPE_COMPARISONS = {'intake':['Other Agency','Stray'], 'out':['Adopted','Other Agency']}
+
+PERIOD_FREQ = {'month':'MS', 'quarter':'QS', 'year':'YS'}
+
+PLOTLYJS_CDN = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+
+# -----------------------------------------------
+# Windows
+def window_id(start, end, period):
+    if period == 'month':
+        return start.strftime('%Y-%m')
+    if period == 'quarter':
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    if period == 'year':
+        return str(start.year)
+    return f"{start.strftime('%Y-%m-%d')}_{end.strftime('%Y-%m-%d')}"
+
+
+def period_windows(iodf, period):
+    # every calendar period from the first intake to the latest intake/outcome
+    first = iodf.intake_date.min()
+    last = max(iodf.intake_date.max(), iodf.out_date.max())
+    starts = pd.date_range(first.to_period(period[0].upper()).start_time, last, freq=PERIOD_FREQ[period])
+    ends = [s + pd.tseries.frequencies.to_offset(PERIOD_FREQ[period]) - pd.Timedelta(days=1) for s in starts]
+
+    return [{'id':window_id(s, e, period), 'period':period, 'start':s.to_pydatetime(), 'end':e.to_pydatetime()}
+            for s, e in zip(starts, ends)]
+
+
+def parse_window(text):
+    start, end = [datetime.datetime.strptime(t, '%Y-%m-%d') for t in text.split(':')]
+    return {'id':window_id(start, end, None), 'period':'custom', 'start':start, 'end':end}
+
+
+def window_fingerprints(iodf, windows):
+    # order-independent hash of the rows of every animal whose stay overlaps each window - a window's pages only
+    # depend on those animals, so an unchanged fingerprint means nothing in it needs rendering again
+    # dates are hashed at one resolution, since an ingested batch can leave them at another than the workbook had
+    dates = {c:iodf[c].astype('datetime64[ns]') for c in iodf if pd.api.types.is_datetime64_dtype(iodf[c])}
+    row_hash = pd.util.hash_pandas_object(iodf.assign(**dates), index=False).to_numpy()
+    intake = iodf.intake_date.to_numpy()
+    out = iodf.out_date.to_numpy()
+
+    fingerprints = {}
+    for w in windows:
+        start, end = np.datetime64(w['start'], 'ns'), np.datetime64(w['end'] + datetime.timedelta(days=1), 'ns')
+        overlaps = (intake < end) & ~(out < start)
+        fingerprints[w['id']] = f"{EXPORT_FORMAT}-{overlaps.sum()}-{int(row_hash[overlaps].sum(dtype='uint64'))}"
+
+    return fingerprints
+
+
+# -----------------------------------------------
+# Rendering (runs in the pool's workers)
+_DATA = {}
+
+
+def init_worker(source):
+    iodf = data_functions.enrich_ins_outs(data_functions.data_ins_outs(source))
+    _DATA['iodf'] = iodf
+
+
+def figure_html(fig):
+    # a stand-alone page for one figure, loading plotly.js from the CDN
+    return (f'<html><head><meta charset="utf-8"><script src="{PLOTLYJS_CDN}"></script></head><body>'
+            f'<div id="figure"></div><script>var fig = {pio.to_json(fig, validate=False)};'
+            f'Plotly.newPlot("figure", fig.data, fig.layout, {{"responsive": true}});</script></body></html>')
+
+
+def records(d):
+    return json.loads(d.to_json(orient='records', date_format='iso'))
+
+
+def general_snapshot(iodf, start_date, end_date):
+    start_month = datetime.datetime(start_date.year, start_date.month, 1)
+    end_month = datetime.datetime(end_date.year, end_date.month, 1)
+
+    stays = data_functions.date_filter_month_firsts(iodf, start_month, end_month)
+    occupancy = data_functions.occupancy_counts(iodf)
+    monthtot, bymonth_types = data_functions.monthly_in_out_data_prep(occupancy, start_month, end_month)
+    (_, lastmo_age), (_, hist_age) = data_functions.general_age_data_prep(iodf, start_month, end_month, end_date)
+    (lastmo_summary, lastmo_density), (hist_summary, hist_density) = \
+        data_functions.general_length_data_prep(iodf, start_month, end_month)
+    lastmo_breed = data_functions.breed_breakdown_data_prep(iodf, rows=data_functions.month_snapshot_rows(stays,
+                                                                                                         end_month))
+    hist_breed = data_functions.breed_breakdown_data_prep(iodf, rows=data_functions.stay_rows(stays))
+
+    sections = {'monthly_totals':records(monthtot), 'monthly_types':records(bymonth_types),
+                'age_lastmonth':records(lastmo_age), 'age_history':records(hist_age),
+                'length_lastmonth':{'summary':records(lastmo_summary), 'density':records(lastmo_density)},
+                'length_history':{'summary':records(hist_summary), 'density':records(hist_density)},
+                'breed_lastmonth':records(lastmo_breed), 'breed_history':records(hist_breed)}
+
+    figures = {}
+    for period, agedf, summary, density, breeddf in [('lastmonth', lastmo_age, lastmo_summary, lastmo_density,
+                                                      lastmo_breed),
+                                                     ('history', hist_age, hist_summary, hist_density, hist_breed)]:
+        figures[f'age_{period}'] = plot_functions.age_breakdown_bar_plot(agedf, period=period)
+        figures[f'length_{period}'] = stay_plots.length_stay_sketch_plot(summary, density, period=period)
+        figures[f'breed_{period}'] = plot_functions.breed_breakdown_bar_plot(breeddf, period=period)
+
+    return sections, figures
+
+
+def inout_snapshot(d, mapping, start_date, end_date, date_for_comp):
+    start_month = datetime.datetime(start_date.year, start_date.month, 1)
+    end_month = datetime.datetime(end_date.year, end_date.month, 1)
+
+    cube = data_functions.inout_cube_window(d, mapping, start_date, end_date, date_for_comp=date_for_comp)
+    type_month, type_qtr = data_functions.inout_types_month_data_prep(cube, mapping, date_for_comp=date_for_comp)
+    breeddf = data_functions.inout_breed_data_prep(cube, start_month, end_month, date_for_comp=date_for_comp)
+    agedf = data_functions.inout_age_data_prep(cube, start_month, end_month, data_functions.AGE_GROUPS,
+                                               date_for_comp=date_for_comp)
+
+    sections = {'heatmap':records(data_functions.inout_heatmap_data_prep(cube, date_for_comp=date_for_comp)),
+                'types_month':records(type_month), 'types_quarter':records(type_qtr),
+                'agencies':records(data_functions.inout_agencies_data_prep(cube, date_for_comp=date_for_comp)),
+                'breeds':records(breeddf), 'ages':records(agedf)}
+
+    figures = {'types_comparison':plot_functions.inout_types_bar_comparison_plot(
+                   type_month, TYPE_COMPARISONS[date_for_comp], date_for_comp=date_for_comp)}
+    for species in sorted(breeddf.type.unique()):
+        for max_base in ['history','latest']:
+            lines = data_functions.category_line_arrays(breeddf, species, 'breed', max_base=max_base,
+                                                        date_for_comp=date_for_comp)
+            figures[f'breeds_{species}_{max_base}'] = line_plots.inout_breed_line_plot(
+                lines, species, max_base=max_base, date_for_comp=date_for_comp)
+    for species in sorted(agedf.type.unique()):
+        for max_base in ['history','latest']:
+            lines = data_functions.category_line_arrays(agedf, species, f'agecat_{date_for_comp}',
+                                                        max_base=max_base, date_for_comp=date_for_comp)
+            figures[f'ages_{species}_{max_base}'] = line_plots.inout_age_line_plot(
+                lines, species, data_functions.AGE_GROUPS, max_base=max_base, date_for_comp=date_for_comp)
+
+    return sections, figures
+
+
+def outcome_snapshot(d, start_date, end_date):
+    sections, figures = inout_snapshot(d, data_functions.OUTCOME_MAPPING, start_date, end_date, 'out')
+
+    outcome_animals, adopted_animals = data_functions.save_rate_counts(d, start_date, end_date)
+    sections['save_rate'] = adopted_animals / outcome_animals if outcome_animals > 0 else None
+
+    staydf = data_functions.length_stay_calc(d, rows=data_functions.date_rows(d, 'out', start_date, end_date))
+    sections['length_stay'] = records(data_functions.length_stay_outcome_data_prep(staydf))
+
+    return sections, figures
+
+
+def render_window(window, out_dir):
+    start_date, end_date = window['start'], window['end']
+    pages = {'general':general_snapshot(_DATA['iodf'], start_date, end_date),
+             'intakes':inout_snapshot(_DATA['iodf'], data_functions.INTAKE_MAPPING, start_date, end_date,
+                                      'intake'),
+             'outcomes':outcome_snapshot(_DATA['iodf'], start_date, end_date)}
+
+    # written to a temporary directory first, so an interrupted export never leaves a half-written window
+    final = os.path.join(out_dir, window['id'])
+    tmp = data_cache.temp_path(final)
+    os.makedirs(tmp)
+
+    files = []
+    for page, (sections, figures) in pages.items():
+        with open(os.path.join(tmp, f'{page}.json'), 'w') as f:
+            json.dump({'window':window['id'], 'start':start_date.strftime('%Y-%m-%d'),
+                       'end':end_date.strftime('%Y-%m-%d'), 'sections':sections}, f)
+        files.append(f'{page}.json')
+
+        for name, fig in figures.items():
+            fname = f'{page}_{name}.html'.replace(' ', '_')
+            with open(os.path.join(tmp, fname), 'w') as f:
+                f.write(figure_html(fig))
+            files.append(fname)
+
+    data_cache.replace_dir(tmp, final)
+
+    return window['id'], files
+
+
+# -----------------------------------------------
+# Export
+def read_index(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'index.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'windows':{}}
+
+
+def write_index(out_dir, index):
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=1)
+
+    rows = []
+    for wid, w in sorted(index['windows'].items()):
+        links = ' '.join(f'<a href="{wid}/{fname}">{fname}</a>' for fname in w['files'])
+        rows.append(f"<tr><td>{wid}</td><td>{w['start']} to {w['end']}</td><td>{links}</td></tr>")
+    with open(os.path.join(out_dir, 'index.html'), 'w') as f:
+        f.write(f"<html><body><h1>Shelter dashboard snapshots</h1><p>Data version {index['version']}</p>"
+                f"<table>{''.join(rows)}</table></body></html>")
+
+
+def export(source=data_functions.INS_OUTS_PATH, out_dir=EXPORT_DIR, periods=('month',), windows=(), workers=None,
+           force=False):
+    iodf = data_functions.enrich_ins_outs(data_functions.data_ins_outs(source))
+
+    all_windows = [w for p in periods for w in period_windows(iodf, p)] + [parse_window(w) for w in windows]
+    fingerprints = window_fingerprints(iodf, all_windows)
+
+    os.makedirs(out_dir, exist_ok=True)
+    index = read_index(out_dir)
+    stale = [w for w in all_windows
+             if force or index['windows'].get(w['id'], {}).get('fingerprint') != fingerprints[w['id']]
+             or not os.path.isdir(os.path.join(out_dir, w['id']))]
+
+    if len(stale) > 0:
+        # build the aggregates every window slices from once, so the workers only read them from the cache
+        data_functions.occupancy_counts(iodf)
+        data_functions.stay_sketches(iodf)
+        for date_for_comp, mapping in [('intake', data_functions.INTAKE_MAPPING),
+                                       ('out', data_functions.OUTCOME_MAPPING)]:
+            data_functions.inout_cube(iodf, mapping, date_for_comp=date_for_comp)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(source,)) as pool:
+            for wid, files in pool.map(render_window, stale, [out_dir] * len(stale), chunksize=4):
+                index['windows'][wid] = {'files':files}
+
+    # windows that are no longer part of the export are removed
+    keep = {w['id'] for w in all_windows}
+    for wid in list(index['windows']):
+        if wid not in keep:
+            shutil.rmtree(os.path.join(out_dir, wid), ignore_errors=True)
+            del index['windows'][wid]
+
+    for w in all_windows:
+        index['windows'][w['id']].update({'period':w['period'], 'start':w['start'].strftime('%Y-%m-%d'),
+                                          'end':w['end'].strftime('%Y-%m-%d'), 'fingerprint':fingerprints[w['id']]})
+
+    # the full history numbers don't depend on the window
+    index['version'] = data_functions.dataset_version(iodf)
+    index['full_history'] = {'animals':int(iodf.id.nunique()),
+                             'outcome_animals':int(iodf[iodf.out_date.notnull()].id.nunique()),
+                             'adopted_animals':int(iodf[iodf.out_adopt == 1].id.nunique())}
+    write_index(out_dir, index)
+
+    return len(stale), len(all_windows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export static snapshots of the dashboard pages')
+    parser.add_argument('--source', default=data_functions.INS_OUTS_PATH)
+    parser.add_argument('--out', default=EXPORT_DIR)
+    parser.add_argument('--period', nargs='*', default=['month'], choices=list(PERIOD_FREQ.keys()))
+    parser.add_argument('--window', nargs='*', default=[], help='extra date windows as start:end (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=None, help='processes to render with (default one per core)')
+    parser.add_argument('--force', action='store_true', help='render every window, even unchanged ones')
+    args = parser.parse_args()
+
+    rendered, total = export(args.source, args.out, args.period, args.window, args.workers, args.force)
+    print(f"rendered {rendered:,} of {total:,} windows into {args.out}")
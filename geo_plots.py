@@ -0,0 +1,72 @@
+import numpy as np
+import plotly.graph_objects as go
+import plot_settings
+import geography
+
+# -----------------------------------------------
+# Maps and region bars for the Geography page
+#
+# The map is drawn from the simplified boundaries for the chosen detail level (see geography.simplified_geojson) and
+# the region counts for the date window, so neither its size nor its render time depends on the number of animals.
+
+TOP_REGIONS = 20
+
+
+def map_view(geojson):
+    # center and zoom level that fit every region (web mercator zoom 0 shows 360 degrees of longitude)
+    lon_min, lat_min, lon_max, lat_max = geography.geojson_bounds(geojson)
+    span = max(lon_max - lon_min, (lat_max - lat_min) * 1.6, 1e-3)
+    return dict(lon=(lon_min + lon_max) / 2, lat=(lat_min + lat_max) / 2), float(np.clip(np.log2(360 / span) - .5, 0, 16))
+
+
+def region_map_plot(by_region, geojson, species=None):
+    center, zoom = map_view(geojson)
+    label = f"{species} rescues" if species is not None else 'Rescues'
+
+    fig = go.Figure(go.Choroplethmap(geojson=geojson,
+                                     locations=by_region['region'],
+                                     featureidkey=f'properties.{geography.REGION_KEY}',
+                                     z=by_region['id'],
+                                     customdata=np.round(by_region['perc'] * 100, 1),
+                                     colorscale=[[0, '#f7fbff'], [1, plot_settings.color_list[4]]],
+                                     marker_line_width=0.5,
+                                     marker_line_color='white',
+                                     colorbar=dict(title='Animals', thickness=12),
+                                     hovertemplate='<b>%{location}</b><br>%{z:,} animals (%{customdata}%)'
+                                                   '<extra></extra>'))
+
+    fig.update_layout(template=plot_settings.dash_template,
+                      map=dict(style='carto-positron', center=center, zoom=zoom),
+                      height=550,
+                      margin=dict(l=10, r=10, t=60, b=10),
+                      title=dict(font_size=22,
+                                 x=0.05,
+                                 y=.96,
+                                 yref='container',
+                                 text=f"<b>{label} by region of origin</b>"))
+
+    return fig
+
+
+def region_bar_plot(by_region, species=None, top=TOP_REGIONS):
+    shown = by_region.head(top).iloc[::-1]
+    label = f"{species} rescues" if species is not None else 'Rescues'
+
+    fig = go.Figure(go.Bar(x=shown['id'],
+                           y=shown['region'],
+                           orientation='h',
+                           marker_color=plot_settings.color_list[4],
+                           customdata=np.round(shown['perc'] * 100, 1),
+                           hovertemplate='<b>%{y}</b><br>%{x:,} animals (%{customdata}%)<extra></extra>'))
+
+    fig.update_xaxes(title='Animals')
+    fig.update_layout(template=plot_settings.dash_template,
+                      height=max(300, 22 * len(shown) + 120),
+                      margin=dict(l=150, r=40),
+                      title=dict(font_size=22,
+                                 x=0.05,
+                                 y=.96,
+                                 yref='container',
+                                 text=f"<b>{label} from the top {min(top, len(by_region))} regions</b>"))
+
+    return fig
@@ -0,0 +1,290 @@
+import os
+import re
+import json
+import threading
+import numpy as np
+import pandas as pd
+import data_cache
+import data_functions
+from memo import memoize
+
+# -----------------------------------------------
+# Geography of rescues
+#
+# Animals are matched to regions (towns, jurisdictions, ZIP codes - whatever the boundaries file holds) once per
+# dataset version, and kept as counts per month x region x type like the other persisted aggregates, so a date window
+# on the map is a sum over a small table instead of a spatial join of every animal on every render. The location
+# column is matched per distinct value: by region name first (town names, jurisdictions, ZIP codes), otherwise by the
+# coordinates in it, with a point in polygon test against the region outlines.
+#
+# The boundaries come from a local GeoJSON file, or a shapefile (read through geopandas, which is only needed for
+# those). Their outlines are simplified for each map detail level in TOLERANCES and cached next to the columnar cache,
+# so the map only ships the vertices that level can show. Without a boundaries file the counts are kept per location
+# value instead, and the page shows them without a map.
+
+REGIONS_PATH = os.environ.get('SHELTER_DASH_REGIONS', 'regions.geojson')
+
+# property of each boundary feature holding the region name
+REGION_KEY = os.environ.get('SHELTER_DASH_REGION_KEY', 'name')
+
+# column the animals are matched to regions on
+GEO_COLUMN = os.environ.get('SHELTER_DASH_GEO_COLUMN', 'location')
+
+# simplification tolerance (degrees) for each map detail level, roughly 1 km, 200 m and 50 m
+TOLERANCES = {'coarse':0.01, 'medium':0.002, 'fine':0.0005}
+
+GEO_CACHE_DIR = os.path.join(data_cache.CACHE_DIR, 'geo')
+
+# 'lat, lon' pairs in text location fields, e.g. '(38.44, -122.71)'
+COORDINATES = re.compile(r'(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)')
+
+_BOUNDARIES = {}
+_BOUNDARIES_LOCK = threading.Lock()
+_SIMPLIFIED_LOCK = threading.Lock()
+
+
+# -----------------------------------------------
+# Boundaries
+def region_source(path=REGIONS_PATH):
+    # version of the boundaries file (None when there isn't one), part of the key of everything built from it
+    if not os.path.exists(path):
+        return None
+    key = data_cache.source_key(path)
+    return f"{key['size']}-{key['mtime']}"
+
+
+def read_boundaries(path=REGIONS_PATH):
+    if path.lower().endswith(('.geojson', '.json')):
+        with open(path) as f:
+            return json.load(f)
+
+    import geopandas
+    return json.loads(geopandas.read_file(path).to_crs(epsg=4326).to_json())
+
+
+def feature_polygons(feature):
+    # a feature's polygons, each a list of (lon, lat) rings with the outline first and then any holes
+    geometry = feature['geometry']
+    polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+    return [[np.asarray(ring, dtype='float64')[:, :2] for ring in polygon] for polygon in polygons]
+
+
+def boundaries(path=REGIONS_PATH):
+    # region names and polygons, read once per process (and again when the file changes), or None without a file
+    source = region_source(path)
+    if source is None:
+        return None
+
+    with _BOUNDARIES_LOCK:
+        if _BOUNDARIES.get(path, (None,))[0] != source:
+            features = [f for f in read_boundaries(path)['features'] if f.get('geometry') is not None]
+            _BOUNDARIES[path] = (source, {'names':[str(f['properties'][REGION_KEY]) for f in features],
+                                          'polygons':[feature_polygons(f) for f in features]})
+        return _BOUNDARIES[path][1]
+
+
+def ring_area(ring):
+    return 0.5 * abs(np.dot(ring[:-1, 0], ring[1:, 1]) - np.dot(ring[1:, 0], ring[:-1, 1]))
+
+
+def simplify_ring(ring, tolerance):
+    # Douglas-Peucker: keeps the points further than tolerance from the line between the points kept either side
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b <= a + 1:
+            continue
+        seg = ring[b] - ring[a]
+        pts = ring[a + 1:b] - ring[a]
+        length = np.hypot(seg[0], seg[1])
+        if length > 0:
+            dist = np.abs(seg[0] * pts[:, 1] - seg[1] * pts[:, 0]) / length
+        else:
+            dist = np.hypot(pts[:, 0], pts[:, 1])
+        i = a + 1 + dist.argmax()
+        if dist.max() > tolerance:
+            keep[i] = True
+            stack += [(a, i), (i, b)]
+    return ring[keep]
+
+
+def simplify_polygons(polygons, tolerance):
+    # polygons and holes smaller than the tolerance are dropped, except that a region always keeps its largest
+    # outline so it still shows up on the map
+    simplified = []
+    for polygon in polygons:
+        rings = [simplify_ring(r, tolerance) for r in polygon]
+        if len(rings[0]) >= 4:
+            simplified.append([rings[0]] + [r for r in rings[1:] if len(r) >= 4])
+
+    if len(simplified) == 0 and len(polygons) > 0:
+        simplified = [[max([p[0] for p in polygons], key=ring_area)]]
+    return simplified
+
+
+def simplify_features(names, polygons, tolerance):
+    # GeoJSON of the simplified regions, with coordinates rounded to what the tolerance can show
+    decimals = max(int(np.ceil(-np.log10(tolerance))) + 1, 0)
+    features = []
+    for name, region in zip(names, polygons):
+        coords = [[np.round(r, decimals).tolist() for r in polygon] for polygon in simplify_polygons(region, tolerance)]
+        features.append({'type':'Feature', 'id':name, 'properties':{REGION_KEY:name},
+                         'geometry':{'type':'MultiPolygon', 'coordinates':coords}})
+    return {'type':'FeatureCollection', 'features':features}
+
+
+def simplified_geojson(detail='medium', path=REGIONS_PATH):
+    # simplified boundaries for a map detail level, built once per boundaries file and kept in the cache directory
+    source = region_source(path)
+    if source is None:
+        return None
+
+    cache_file = os.path.join(GEO_CACHE_DIR, f"{os.path.splitext(os.path.basename(path))[0]}-{detail}.json")
+    geojson = read_simplified(cache_file, source, detail)
+    if geojson is not None:
+        return geojson
+
+    # simplified once per process, sessions opening the map meanwhile wait for it
+    with _SIMPLIFIED_LOCK:
+        geojson = read_simplified(cache_file, source, detail)
+        if geojson is not None:
+            return geojson
+
+        regions = boundaries(path)
+        geojson = simplify_features(regions['names'], regions['polygons'], TOLERANCES[detail])
+
+        os.makedirs(GEO_CACHE_DIR, exist_ok=True)
+        tmp = data_cache.temp_path(cache_file)
+        with open(tmp, 'w') as f:
+            json.dump({'source':source, 'tolerance':TOLERANCES[detail], 'geojson':geojson}, f)
+        os.replace(tmp, cache_file)
+
+    return geojson
+
+
+def read_simplified(cache_file, source, detail):
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached['source'] == source and cached['tolerance'] == TOLERANCES[detail]:
+            return cached['geojson']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def geojson_bounds(geojson):
+    # (lon min, lat min, lon max, lat max) of every region
+    points = np.concatenate([np.asarray(r) for f in geojson['features'] for p in f['geometry']['coordinates']
+                             for r in p])
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+# -----------------------------------------------
+# Matching animals to regions
+def points_in_region(lon, lat, polygons):
+    # even-odd rule over all of a region's rings (so holes are left out), for the points inside its bounding box
+    inside = np.zeros(len(lon), dtype=bool)
+    rings = [r for polygon in polygons for r in polygon]
+    if len(rings) == 0:
+        return inside
+
+    box = np.concatenate(rings)
+    candidates = np.flatnonzero((lon >= box[:, 0].min()) & (lon <= box[:, 0].max()) &
+                                (lat >= box[:, 1].min()) & (lat <= box[:, 1].max()))
+    x, y = lon[candidates, None], lat[candidates, None]
+    crossings = np.zeros(len(candidates), dtype='int64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ring in rings:
+            x0, y0, x1, y1 = ring[:-1, 0], ring[:-1, 1], ring[1:, 0], ring[1:, 1]
+            crosses = ((y0 > y) != (y1 > y)) & (x < (x1 - x0) * (y - y0) / (y1 - y0) + x0)
+            crossings += crosses.sum(axis=1)
+
+    inside[candidates] = crossings % 2 == 1
+    return inside
+
+
+def location_key(value):
+    # names compared case-insensitively, and ZIP codes read as numbers ('95401.0') matched as text
+    return re.sub(r'\.0$', '', str(value).strip().lower())
+
+
+def region_lookup(values, regions):
+    # position in regions['names'] of the region each distinct location value is in (-1 when none is found)
+    names = {location_key(n):i for i, n in enumerate(regions['names'])}
+    found = np.array([names.get(location_key(v), -1) for v in values], dtype='int64')
+
+    # the rest are located by their coordinates, if they have any
+    coords = [(i, COORDINATES.search(str(v))) for i, v in enumerate(values) if found[i] < 0]
+    coords = [(i, float(m.group(1)), float(m.group(2))) for i, m in coords if m is not None]
+    if len(coords) > 0:
+        pos, lat, lon = [np.array(c) for c in zip(*coords)]
+        pos = pos.astype('int64')
+        for region, polygons in enumerate(regions['polygons']):
+            inside = points_in_region(lon, lat, polygons) & (found[pos] < 0)
+            found[pos[inside]] = region
+
+    return found
+
+
+def region_categories(d, column=GEO_COLUMN, path=REGIONS_PATH):
+    # the regions animal_regions gives d's animals, in the same order (the boundary names, else the location values)
+    regions = boundaries(path)
+    if regions is None:
+        return pd.Index(pd.factorize(d[column])[1]).astype(str)
+    return pd.Index(regions['names'])
+
+
+def animal_regions(d, column=GEO_COLUMN, path=REGIONS_PATH):
+    # region of every animal as a categorical (the location values themselves when there are no boundaries)
+    codes, values = pd.factorize(d[column])
+    regions = boundaries(path)
+    if regions is None:
+        return pd.Categorical.from_codes(codes, categories=pd.Index(values).astype(str))
+
+    lookup = region_lookup(list(values), regions)
+    region_codes = np.where(codes >= 0, lookup[np.maximum(codes, 0)], -1) if len(lookup) > 0 else codes
+    return pd.Categorical.from_codes(region_codes, categories=regions['names'])
+
+
+# -----------------------------------------------
+# Region counts
+def build_region_counts(d, date_for_comp='intake', column=GEO_COLUMN, path=REGIONS_PATH):
+    # distinct animals per month x region x type, with animals that aren't in any region kept as an empty region
+    months = data_functions.month_idx_column(d, date_for_comp)
+    counts = pd.DataFrame({'month_idx':np.asarray(months, dtype='int32'),
+                           'region':animal_regions(d, column, path),
+                           'type':d['type'].array,
+                           'id':d['id'].to_numpy()})
+    counts = counts[months >= 0]
+
+    return counts.groupby(['month_idx','region','type'], dropna=False, observed=True)['id'].nunique().reset_index()
+
+
+def region_counts(d, date_for_comp='intake'):
+    if data_functions.coalition(d) is not None:
+        return d.merged('region_counts', date_for_comp)
+
+    params = {'column':GEO_COLUMN, 'regions':region_source(REGIONS_PATH)}
+    return data_functions.persisted_aggregate(f'regions_{date_for_comp}', d, params,
+                                              lambda t: build_region_counts(t, date_for_comp))
+
+
+@memoize
+def region_window_counts(counts, start_month, end_month, species=None):
+    # animals per region over [start_month, end_month] (optionally one species), largest first, and the number of
+    # them that couldn't be matched to a region
+    start_idx, end_idx = data_functions.month_index([start_month, end_month])
+    months = counts['month_idx'].to_numpy()
+    window = counts[(months >= start_idx) & (months <= end_idx)]
+    if species is not None:
+        window = window[(window.type == species).to_numpy()]
+
+    unmatched = int(window.loc[window.region.isnull().to_numpy(), 'id'].sum())
+    by_region = window.groupby('region', observed=True)['id'].sum().reset_index()
+    by_region['region'] = by_region.region.astype(str)
+    by_region['perc'] = by_region['id'] / max(by_region['id'].sum(), 1)
+
+    return by_region.sort_values(by='id', ascending=False).reset_index(drop=True), unmatched
@@ -0,0 +1,271 @@
+import os
+import re
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+import data_cache
+import data_functions
+import geography
+
+# -----------------------------------------------
+# Incremental daily ingestion
+#
+# A daily export holds new intakes plus outcomes for stays that were still open, with the same columns as the
+# ins_outs sheet. Rows are upserted on animal id: a new id is appended, an existing id (e.g. an open stay that now has
+# an outcome) is overwritten. The stored dataset is rewritten with a new version (the base version plus a batch
+# number), and the stored monthly occupancy counts, aggregate cubes, length of stay sketches and region counts are
+# patched for just the months the batch touches, so nothing downstream has to be rebuilt from scratch.
+#
+# Every batch is also kept next to the dataset's cache (batches/batch-NNNNN). The cached dataset is keyed on the
+# workbook, so when the workbook changes the table is read from it again - the kept batches are then replayed on top of
+# it in the order they were ingested (see data_functions.read_ins_outs_source), so none of them are lost, and the
+# version becomes the new workbook's plus the number of batches. A replayed batch still wins over the workbook for the
+# animals in it, so once a workbook export already holds the ingested batches they should be dropped with --clear.
+#
+# Usage: `python ingest.py delta.csv [workbook]`, where the workbook can be one shelter's in SHELTERS_DIR, and
+# `python ingest.py --clear [workbook]` to drop the kept batches
+
+
+def read_delta(path):
+    if path.endswith('.csv'):
+        delta = pd.read_csv(path, parse_dates=['birthday','intake_date','out_date'])
+    else:
+        delta = pd.read_excel(path, sheet_name='ins_outs', parse_dates=['birthday','intake_date','out_date'])
+
+    for c in data_functions.FLAG_COLUMNS:
+        delta[c] = delta[c].fillna(0).astype('int8') if c in delta else np.int8(0)
+
+    # a later row for the same animal wins
+    return delta.drop_duplicates(subset='id', keep='last').reset_index(drop=True)
+
+
+def conform_delta(delta, base):
+    # give the delta the base table's derived columns and dtypes - categoricals in the base just get any new values
+    # added as extra categories, so the existing codes don't change
+    delta = delta.assign(intake_flag=data_functions.flag_column(delta, data_functions.INTAKE_FLAGS),
+                         out_flag=data_functions.flag_column(delta, data_functions.OUTCOME_FLAGS),
+                         intake_month_idx=data_functions.month_index(delta.intake_date).astype('int32'),
+                         out_month_idx=data_functions.month_index(delta.out_date).astype('int32'))
+
+    base_cols = {}
+    delta_cols = {}
+    for c in base.columns:
+        col = base[c]
+        values = delta[c] if c in delta else pd.Series(np.nan, index=delta.index)
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            new = pd.Index(values.dropna().unique()).difference(col.cat.categories)
+            if len(new) > 0:
+                col = col.cat.add_categories(new)
+            values = pd.Categorical(values, categories=col.cat.categories, ordered=col.cat.ordered)
+        elif pd.api.types.is_numeric_dtype(col.dtype) and not pd.api.types.is_bool_dtype(col.dtype):
+            values = values.astype(col.dtype) if values.notnull().all() else values
+        base_cols[c] = col
+        delta_cols[c] = values
+
+    return pd.DataFrame(base_cols, copy=False), pd.DataFrame(delta_cols, index=delta.index)
+
+
+def upsert(base, delta):
+    base, delta = conform_delta(delta, base)
+
+    pos = pd.Index(base['id']).get_indexer(delta['id'])
+    updates = delta[pos >= 0]
+    upd_pos = pos[pos >= 0]
+    adds = delta[pos < 0]
+
+    old_rows = base.iloc[upd_pos]
+    table = pd.concat([base, adds], ignore_index=True)
+    for c in table.columns:
+        table.iloc[upd_pos, table.columns.get_loc(c)] = updates[c].values
+
+    return table, old_rows, pd.concat([updates, adds], ignore_index=True)
+
+
+def touched_months(old_rows, new_rows, date_for_comp):
+    months = np.concatenate([old_rows[f'{date_for_comp}_month_idx'].to_numpy(),
+                             new_rows[f'{date_for_comp}_month_idx'].to_numpy()])
+    return np.unique(months[months >= 0])
+
+
+def patch_cube(name, old_version, new_version, table, old_rows, new_rows, date_for_comp,
+               cache_dir=data_cache.CACHE_DIR):
+    meta = data_cache.read_meta(name, cache_dir)
+    if meta is None or meta['key']['version'] != old_version:
+        return
+
+    cube = data_cache.read_cache(name, cache_dir=cache_dir)
+    flags = meta['key']['params']['flags']
+    months = touched_months(old_rows, new_rows, date_for_comp)
+
+    # rebuild only the cells of the touched months, from the updated rows for those months
+    rows = table[np.isin(table[f'{date_for_comp}_month_idx'].to_numpy(), months)]
+    rows = data_functions.add_age_columns(rows, rows[f'{date_for_comp}_date'], suffix=f'_{date_for_comp}')
+    patch = data_functions.build_inout_cube(rows, flags, date_for_comp)
+
+    keep = ~np.isin(data_functions.month_index(cube.months), months)
+    # stable, so the rows of each month stay in the order a full rebuild gives them
+    cube = pd.concat([cube[keep], patch], ignore_index=True)
+    cube = cube.sort_values(by='months', kind='stable').reset_index(drop=True)
+
+    data_cache.write_cache(cube, name, {'version':new_version, 'params':meta['key']['params']}, cache_dir)
+
+
+def patch_occupancy(old_version, new_version, base, table, old_rows, new_rows, cache_dir=data_cache.CACHE_DIR):
+    meta = data_cache.read_meta('occupancy', cache_dir)
+    if meta is None or meta['key']['version'] != old_version:
+        return
+
+    counts = data_cache.read_cache('occupancy', cache_dir=cache_dir)
+    old_max = data_functions.month_index([base.intake_date.max()])[0]
+    new_max = data_functions.month_index([table.intake_date.max()])[0]
+
+    removed = data_functions.stay_intervals(old_rows, old_max)
+    added = data_functions.stay_intervals(new_rows, new_max)
+
+    # months covered after the batch
+    first_month = min([counts.month_idx.min()] + [m.min() for m in (removed[0], added[0]) if len(m) > 0])
+    last_month = max([counts.month_idx.max(), new_max] + [m.max() for m in (added[1],) if len(m) > 0])
+    nmonths = last_month - first_month + 1
+
+    months = np.arange(first_month, last_month + 1)
+    counts = counts.set_index('month_idx').reindex(months, fill_value=0)
+
+    minus = data_functions.occupancy_arrays(*removed, first_month, nmonths)
+    plus = data_functions.occupancy_arrays(*added, first_month, nmonths)
+    for c in ['present','ins','outs','same']:
+        counts[c] = counts[c].to_numpy() - minus[c] + plus[c]
+
+    # stays that are still open and weren't in the batch now run through the new latest month
+    if new_max > old_max:
+        still_open = base.out_date.isnull().sum() - old_rows.out_date.isnull().sum()
+        extend = (months > old_max) & (months <= new_max)
+        counts.loc[extend, 'present'] = counts.loc[extend, 'present'].to_numpy() + still_open
+
+    data_cache.write_cache(counts.reset_index().rename(columns={'index':'month_idx'}), 'occupancy',
+                           {'version':new_version, 'params':{}}, cache_dir)
+
+
+def patch_stay_sketches(old_version, new_version, table, old_rows, new_rows, cache_dir=data_cache.CACHE_DIR):
+    meta = data_cache.read_meta('stay_sketches', cache_dir)
+    if meta is None or meta['key']['version'] != old_version:
+        return
+
+    sketches = data_cache.read_cache('stay_sketches', cache_dir=cache_dir)
+    months = touched_months(old_rows, new_rows, 'out')
+
+    # completed stays are rebuilt for the touched out months, and open stays all of them, since they run up to the
+    # latest intake date and that may have moved on
+    rebuild = np.isin(table['out_month_idx'].to_numpy(), months) | table.out_date.isnull().to_numpy()
+    patch = data_functions.build_stay_sketches(table, meta['key']['params']['bins_per_doubling'],
+                                               rows=np.flatnonzero(rebuild))
+
+    keep = ~np.isin(sketches.month_idx.to_numpy(), months) & (sketches.open.to_numpy() == 0)
+    sketches = pd.concat([sketches[keep], patch], ignore_index=True)
+    sketches = sketches.sort_values(by='month_idx', kind='stable').reset_index(drop=True)
+
+    data_cache.write_cache(sketches, 'stay_sketches', {'version':new_version, 'params':meta['key']['params']},
+                           cache_dir)
+
+
+def patch_region_counts(name, old_version, new_version, table, old_rows, new_rows, date_for_comp,
+                        cache_dir=data_cache.CACHE_DIR):
+    meta = data_cache.read_meta(name, cache_dir)
+    if meta is None or meta['key']['version'] != old_version:
+        return
+
+    # counts matched against other boundaries are rebuilt from scratch next time they're used
+    params = meta['key']['params']
+    if params['regions'] != geography.region_source():
+        return
+
+    counts = data_cache.read_cache(name, cache_dir=cache_dir)
+    months = touched_months(old_rows, new_rows, date_for_comp)
+
+    rows = table[np.isin(table[f'{date_for_comp}_month_idx'].to_numpy(), months)]
+    patch = geography.build_region_counts(rows, date_for_comp, params['column'])
+
+    # the patch only has the regions of its own rows, so both are put back on the regions a full rebuild has before
+    # they're combined (concatenating different categories would turn region into plain strings)
+    categories = geography.region_categories(table, params['column'])
+    keep = ~np.isin(counts.month_idx.to_numpy(), months)
+    counts = pd.concat([counts[keep], patch], ignore_index=True)
+    counts['region'] = pd.Categorical(counts.region, categories=categories)
+    counts = counts.sort_values(by=['month_idx','region','type'], kind='stable').reset_index(drop=True)
+
+    data_cache.write_cache(counts, name, {'version':new_version, 'params':params}, cache_dir)
+
+
+def batch_dir(cache_dir=data_cache.CACHE_DIR):
+    return os.path.join(cache_dir, 'batches')
+
+
+def stored_batches(cache_dir=data_cache.CACHE_DIR):
+    # names of the kept batches, in the order they were ingested
+    path = batch_dir(cache_dir)
+    if not os.path.isdir(path):
+        return []
+    return sorted(f for f in os.listdir(path) if re.fullmatch(r'batch-\d{5}', f))
+
+
+def replay_batches(table, cache_dir, version):
+    # the table read from the workbook with every kept batch applied to it again, versioned like the table they were
+    # first ingested into
+    batches = stored_batches(cache_dir)
+    for name in batches:
+        table, _, _ = upsert(table, data_cache.read_cache(name, cache_dir=batch_dir(cache_dir)))
+
+    table.attrs['version'] = version if len(batches) == 0 else f"{version}+{len(batches)}"
+    return table
+
+
+def clear_batches(source=data_functions.INS_OUTS_PATH):
+    # for once the workbook holds the ingested batches itself - the cached table keeps them until the workbook changes
+    cache_dir = data_functions.partition_cache_dir(data_functions.source_partition(source))
+    shutil.rmtree(batch_dir(cache_dir), ignore_errors=True)
+
+
+def next_version(version):
+    base, _, batch = version.partition('+')
+    return f"{base}+{int(batch or 0) + 1}"
+
+
+def ingest_delta(delta_path, source=data_functions.INS_OUTS_PATH):
+    # a shelter's workbook (see data_functions.SHELTERS_DIR) only patches that shelter's caches
+    base = data_functions.data_ins_outs(source)
+    cache_dir = data_functions.partition_cache_dir(data_functions.dataset_partition(base))
+    old_version = data_functions.dataset_version(base)
+    new_version = next_version(old_version)
+
+    delta = read_delta(delta_path)
+    table, old_rows, new_rows = upsert(base, delta)
+
+    for date_for_comp in ['intake','out']:
+        patch_cube(f'cube_{date_for_comp}', old_version, new_version, table, old_rows, new_rows, date_for_comp,
+                   cache_dir)
+    patch_occupancy(old_version, new_version, base, table, old_rows, new_rows, cache_dir)
+    patch_stay_sketches(old_version, new_version, table, old_rows, new_rows, cache_dir)
+    for date_for_comp in ['intake','out']:
+        patch_region_counts(f'regions_{date_for_comp}', old_version, new_version, table, old_rows, new_rows,
+                            date_for_comp, cache_dir)
+
+    # kept so it can be replayed if the workbook is read again, then the dataset itself is written last, so the new
+    # version only shows up once its aggregates are in place
+    data_cache.write_cache(delta, f'batch-{len(stored_batches(cache_dir)) + 1:05d}', {'version':new_version},
+                           batch_dir(cache_dir))
+    data_cache.write_cache(table, 'ins_outs', data_cache.read_meta('ins_outs', cache_dir)['key'], cache_dir,
+                           version=new_version)
+    table.attrs['version'] = new_version
+
+    return table, len(new_rows) - len(old_rows), len(old_rows)
+
+
+if __name__ == '__main__':
+    source = sys.argv[2] if len(sys.argv) > 2 else data_functions.INS_OUTS_PATH
+    if sys.argv[1] == '--clear':
+        clear_batches(source)
+        print(f"dropped the batches kept for {source}")
+        sys.exit(0)
+
+    table, added, updated = ingest_delta(sys.argv[1], source)
+    print(f"added {added:,} and updated {updated:,} animals, dataset is now version {table.attrs['version']}")
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+import plot_settings
+import memo
+
+# -----------------------------------------------
+# Breed and age line plots for the Intakes/Outcomes pages
+#
+# A species can have hundreds of breeds, and one trace per breed made for hundreds of SVG traces and a figure JSON of
+# a MB or more on every rerun. In 'gl' mode (the default) only the highlighted categories get their own trace, and
+# all the grey ones are drawn as one Scattergl trace with gaps between the lines, on an axis of months from the first
+# month. Long histories are decimated to at most MAX_POINTS points per line, keeping each bucket's low and high so
+# peaks survive. 'traces' mode is the old one trace per category rendering on a date axis, kept for comparisons.
+#
+# The serialized figures are kept in the shared memo cache, keyed on the caller's parameters (dataset version, date
+# window, species, perc, max_base).
+
+MAX_POINTS = 120
+
+OTHER_COLOR = 'lightgrey'
+
+TITLE_LABELS = {'intake':'Intake', 'out':'Outcome'}
+
+
+def decimate(values, max_points=MAX_POINTS):
+    # column positions to keep for each row of a 2-D (series x month) array: each bucket's min and max in month order,
+    # plus the months left over after the last full bucket
+    nrows, n = values.shape
+    if n <= max_points:
+        return np.tile(np.arange(n), (nrows, 1))
+
+    bucket = int(np.ceil(n / (max_points // 2)))
+    nfull = n // bucket * bucket
+    buckets = values[:, :nfull].reshape(nrows, -1, bucket)
+    starts = np.arange(0, nfull, bucket)[None, :]
+    pos = np.sort(np.stack([buckets.argmin(axis=2) + starts, buckets.argmax(axis=2) + starts], axis=2), axis=2)
+
+    return np.concatenate([pos.reshape(nrows, -1), np.tile(np.arange(nfull, n), (nrows, 1))], axis=1)
+
+
+def month_labels(months, unit='M'):
+    return np.datetime_as_string(np.asarray(months, dtype='datetime64[M]'), unit=unit)
+
+
+def year_ticks(months, max_ticks=12):
+    # tick positions (months from the first month) and labels for the Januaries, thinned out for long histories
+    years = np.asarray(months, dtype='datetime64[M]').astype(int)
+    pos = np.flatnonzero(years % 12 == 0)
+    step = int(np.ceil(len(pos) / max_ticks)) if len(pos) > 0 else 1
+    return pos[::step], month_labels(np.asarray(months)[pos[::step]], unit='Y')
+
+
+def category_lines_figure(lines, species, label, perc=False, max_base='history', date_for_comp='intake',
+                          mode='gl'):
+    values = lines['monthly_perc'].round(4) if perc else lines['counts']
+    highlight = lines['highlight']
+    colors = plot_settings.color_list
+    title_label = TITLE_LABELS.get(date_for_comp, date_for_comp.title())
+
+    fig = go.Figure()
+
+    # grey lines first, so the colored ones are drawn on top
+    others = np.flatnonzero(~highlight)
+    if mode == 'traces':
+        x = month_labels(lines['months'])
+        for i in others:
+            fig.add_trace(go.Scatter(x=x, y=values[i], name=str(lines['categories'][i]), mode='lines',
+                                     line=dict(color=OTHER_COLOR, shape='spline')))
+        for n, i in enumerate(np.flatnonzero(highlight)):
+            fig.add_trace(go.Scatter(x=x, y=values[i], name=str(lines['categories'][i]), mode='lines',
+                                     line=dict(color=colors[n % len(colors)], shape='spline')))
+        fig.update_xaxes(type='date')
+        hovermode = 'x'
+    else:
+        # x is months from the first month (int16), y is float32 and the grey lines carry no per-point names, so
+        # the arrays go out as compact typed arrays rather than lists of dates and strings
+        pos = decimate(values).astype('int16')
+        labels = pd.DatetimeIndex(lines['months']).strftime('%b %Y').to_numpy()
+
+        if len(others) > 0:
+            # one trace for all of them, each line followed by a gap
+            width = pos.shape[1] + 1
+            xs = np.zeros((len(others), width), dtype='int16')
+            ys = np.full((len(others), width), np.nan, dtype='float32')
+            xs[:, :-1] = pos[others]
+            xs[:, -1] = pos[others, -1]
+            ys[:, :-1] = np.take_along_axis(values[others], pos[others], axis=1)
+            fig.add_trace(go.Scattergl(x=xs.ravel(), y=ys.ravel(), name=f'Other {label}s', mode='lines',
+                                       line=dict(color=OTHER_COLOR, width=1), connectgaps=False,
+                                       hovertemplate='%{y}'))
+
+        for n, i in enumerate(np.flatnonzero(highlight)):
+            fig.add_trace(go.Scatter(x=pos[i], y=values[i, pos[i]], text=labels[pos[i]],
+                                     name=str(lines['categories'][i]), mode='lines',
+                                     line=dict(color=colors[n % len(colors)], shape='spline'),
+                                     hovertemplate='%{text}: %{y}'))
+
+        tickvals, ticktext = year_ticks(lines['months'])
+        fig.update_xaxes(type='linear', tickmode='array', tickvals=tickvals, ticktext=ticktext)
+        hovermode = 'closest'
+
+    fig.update_layout(template=plot_settings.dash_template,
+                      hovermode=hovermode,
+                      title=dict(font_size=22,
+                                 x=0.03,
+                                 y=.93,
+                                 yref='container',
+                                 text=f"<b>{title_label} {label}s by month</b> "
+                                      f"(as {'%' if perc else '#'} of monthly {title_label.lower()}s)"),
+                      legend=dict(orientation='h',
+                                  y=1.07,
+                                  x=.0,
+                                  xanchor='left'),
+                      margin=dict(t=85, l=100) if perc else dict(t=85, l=80),
+                      height=400)
+
+    fig.update_xaxes(title=f'{title_label} Month')
+    fig.update_yaxes(range=[-.05,1.17] if perc else [-.25, (values.max() if values.size > 0 else 0) + .5],
+                     tickformat=",.0%" if perc else ",",
+                     ticksuffix=" ",
+                     title=f"% {species}" if perc else f"# {species}")
+
+    fig.add_annotation(x=-.02,
+                       y=-.3,
+                       xref='paper',
+                       yref='paper',
+                       xanchor='left',
+                       align='left',
+                       text=f"{label.title()}s with the highest count over the<br>"
+                            f"{'full history' if max_base=='history' else 'latest month'} are colored.",
+                       showarrow=False,
+                       font_size=12)
+
+    return fig
+
+
+def inout_breed_line_plot(lines, species, perc=False, max_base='history', date_for_comp='intake', mode='gl'):
+    return category_lines_figure(lines, species, 'breed', perc=perc, max_base=max_base, date_for_comp=date_for_comp,
+                                 mode=mode)
+
+
+def inout_age_line_plot(lines, species, age_groups, perc=False, max_base='history', date_for_comp='intake',
+                        mode='gl'):
+    # lines already come in age_groups order
+    return category_lines_figure(lines, species, 'age group', perc=perc, max_base=max_base,
+                                 date_for_comp=date_for_comp, mode=mode)
+
+
+def figure_json(key, func, *args, **kwargs):
+    # the serialized figure for key, built with func(*args, **kwargs) the first time
+    key = ('figure_json',) + memo.normalize_arg(tuple(key))
+    # sessions asking for the same figure together wait for one build rather than each serializing it
+    return memo.CACHE.get_or_compute(key, lambda: pio.to_json(func(*args, **kwargs), validate=False))
+
+
+def figure_from_json(fig_json):
+    return pio.from_json(fig_json, skip_invalid=True)
@@ -0,0 +1,199 @@
+import os
+import sys
+import datetime
+import functools
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------
+# Memoization shared by every session on the server
+#
+# Results of the decorated data functions are kept in one process-wide LRU cache with a byte budget (set with
+# SHELTER_DASH_CACHE_MB). Keys are built from the arguments rather than by hashing DataFrames: a frame is keyed on
+# its dataset version, where it came from (the memoized call that produced it, if any), its columns and a fingerprint
+# of its row index, so e.g. the full table and last month's animals never share a key. Arrays (row selections) are
+# keyed on a hash of their values, and everything else is normalized (dates to Timestamps, dicts/lists to tuples).
+#
+# Sessions missing on the same key at the same time share one computation of it.
+#
+# Cached results are shared between sessions, so callers must treat them as read-only.
+
+CACHE_BUDGET_BYTES = int(float(os.environ.get('SHELTER_DASH_CACHE_MB', 512)) * 1024 * 1024)
+
+
+class MemoCache:
+    def __init__(self, budget_bytes=CACHE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        size = result_nbytes(value)
+        with self.lock:
+            # results bigger than the whole budget are returned but never kept
+            if size > self.budget_bytes:
+                return
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.budget_bytes:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.nbytes -= old_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        # a miss that another thread is already computing waits for that result rather than computing it again, so
+        # sessions arriving together (e.g. right after a restart) run each prep once
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            future = self.pending.get(key)
+            computing = future is None
+            if computing:
+                self.misses += 1
+                future = self.pending[key] = Future()
+            else:
+                self.hits += 1
+        if not computing:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions,
+                    'entries':len(self.entries), 'bytes':self.nbytes, 'budget_bytes':self.budget_bytes}
+
+
+CACHE = MemoCache()
+
+
+def cache_stats():
+    return CACHE.stats()
+
+
+def result_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(result_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(result_nbytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+_FRAME_VALUES = {}
+
+
+def frame_cached(d, name, build):
+    # a value derived from one frame object (its index hash, a date index), built the first time it's asked for and
+    # kept for as long as the frame is alive - only for frames that aren't changed in place once built
+    entry = _FRAME_VALUES.get(id(d))
+    if entry is None or entry[0]() is not d:
+        entry = (weakref.ref(d, lambda _, k=id(d): _FRAME_VALUES.pop(k, None)), {})
+        _FRAME_VALUES[id(d)] = entry
+    if name not in entry[1]:
+        entry[1][name] = build(d)
+    return entry[1][name]
+
+
+def index_hash(d):
+    return int(pd.util.hash_pandas_object(d.index, index=False).sum()) if len(d) > 0 else 0
+
+
+def frame_key(d):
+    # hashing the row index is O(n), so it's only done once for each frame (e.g. the shared table)
+    index, value = frame_cached(d, 'index_hash', lambda t: (t.index, index_hash(t)))
+    if index is not d.index:
+        value = index_hash(d)
+    return ('frame', d.attrs.get('version'), d.attrs.get('lineage'), tuple(d.columns), len(d), value)
+
+
+def array_key(a):
+    # row selections (arrays of row positions) are keyed on their contents
+    values_hash = int(pd.util.hash_array(a.ravel()).sum()) if a.size > 0 else 0
+    return ('array', str(a.dtype), a.shape, values_hash)
+
+
+def normalize_arg(a):
+    if isinstance(a, (pd.DataFrame, pd.Series)):
+        return frame_key(a) if isinstance(a, pd.DataFrame) else ('series', a.name, frame_key(a.to_frame()))
+    if isinstance(a, np.ndarray):
+        return array_key(a)
+    if isinstance(a, (datetime.date, np.datetime64)):
+        return pd.Timestamp(a)
+    if isinstance(a, dict):
+        return tuple((k, normalize_arg(v)) for k, v in a.items())
+    if isinstance(a, (list, tuple)):
+        return tuple(normalize_arg(v) for v in a)
+    return a
+
+
+def mark_lineage(value, key, version, inputs):
+    # frames returned by a memoized call remember the call, so anything computed from them gets its own key (frames
+    # passed straight through from the inputs are left alone)
+    if isinstance(value, pd.DataFrame) and not any(value is i for i in inputs):
+        value.attrs['version'] = version
+        value.attrs['lineage'] = key
+    elif isinstance(value, tuple):
+        for v in value:
+            mark_lineage(v, key, version, inputs)
+    return value
+
+
+def memoize(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        frames = [a for a in list(args) + list(kwargs.values()) if isinstance(a, pd.DataFrame)]
+
+        # frames that don't come from a versioned dataset can't be keyed safely, so they are always recomputed
+        if len(frames) == 0 or any(f.attrs.get('version') is None for f in frames):
+            return func(*args, **kwargs)
+
+        key = (func.__qualname__, normalize_arg(args),
+               tuple(sorted((k, normalize_arg(v)) for k, v in kwargs.items())))
+        return CACHE.get_or_compute(key, lambda: mark_lineage(func(*args, **kwargs), hash(key),
+                                                              frames[0].attrs['version'], frames))
+
+    return wrapper
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import data_cache
+import data_functions
+import geography
+import memo
+
+# -----------------------------------------------
+# Coalition of shelters
+#
+# With a shelters directory (data_functions.SHELTERS_DIR, one workbook per shelter) every shelter is a partition of
+# the data: its own table, cache directory and dataset version, so a batch ingested for one shelter only invalidates
+# that shelter's aggregates. A page showing one shelter uses its table like the single-table dashboard does.
+#
+# The coalition-wide view never concatenates the tables. A Coalition stands in for the table in the data functions
+# that have a coalition version (see data_functions.coalition): each shelter's result (its monthly counts, cube
+# window, sketches...) is computed on a pool of worker processes and the results are merged - the monthly aggregates
+# are all counts, so merging is a sum per key. Per-shelter results are kept by shelter version, so after one shelter
+# changes only that shelter is run again.
+#
+# Each shelter always runs on the same worker, so its table is loaded in that one process only and two workers never
+# build the same shelter's caches at once. Animals are assumed to belong to a single shelter (distinct animal counts
+# are added up), and a shelter's open stays run through its own latest intake month.
+
+PARTITION_WORKERS = int(os.environ.get('SHELTER_DASH_PARTITION_WORKERS', os.cpu_count() or 4))
+
+# budget for per-shelter and merged results, in the same units as the memo cache
+RESULTS_BUDGET_BYTES = int(float(os.environ.get('SHELTER_DASH_PARTITION_CACHE_MB', 256)) * 1024 * 1024)
+
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xls')
+
+_RESULTS = memo.MemoCache(RESULTS_BUDGET_BYTES)
+
+_POOLS = []
+_POOLS_LOCK = threading.Lock()
+
+
+def shelter_sources(shelters_dir=data_functions.SHELTERS_DIR):
+    # {shelter: workbook} for the workbooks in the shelters directory, empty without one
+    if not os.path.isdir(shelters_dir):
+        return {}
+    return {os.path.splitext(f)[0]:os.path.join(shelters_dir, f) for f in sorted(os.listdir(shelters_dir))
+            if f.lower().endswith(WORKBOOK_EXTENSIONS) and not f.startswith('~$')}
+
+
+def shelter_version(path):
+    # the version a shelter's table has (or will have once loaded), read from its cache without loading it
+    meta = data_cache.read_meta('ins_outs', data_functions.partition_cache_dir(data_functions.source_partition(path)))
+    if meta is not None and meta['key'] == data_cache.source_key(path) and meta.get('version'):
+        return meta['version']
+    return data_functions.base_version(path)
+
+
+# -----------------------------------------------
+# Per-shelter work, run on the worker processes
+def general_age_counts(d, start_month, end_month, end_date):
+    # the General page's age breakdowns (animals by type x age group as of end_date) for the animals present in
+    # end_month and over the chosen months
+    (_, lastmo_age), (_, hist_age) = data_functions.general_age_data_prep(d, start_month, end_month, end_date)
+    return lastmo_age, hist_age
+
+
+def partition_function(name):
+    if name == 'region_counts':
+        return geography.region_counts
+    if name == 'general_age_counts':
+        return general_age_counts
+    return getattr(data_functions, name)
+
+
+def partition_call(path, name, args):
+    # the shelter's table is loaded once per worker (memory-mapped from its cache) and shared by its calls
+    return partition_function(name)(data_functions.shared_ins_outs(path), *args)
+
+
+def shelter_pool(shelters, shelter):
+    # single-process executors, each shelter always going to the same one
+    with _POOLS_LOCK:
+        if len(_POOLS) == 0:
+            # spawned rather than forked, the server has threads running that a fork would copy mid-flight
+            context = multiprocessing.get_context('spawn')
+            _POOLS.extend(ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(PARTITION_WORKERS))
+    return _POOLS[sorted(shelters).index(shelter) % len(_POOLS)]
+
+
+# -----------------------------------------------
+# Merging per-shelter results
+def merge_sum(results, by, values):
+    merged = pd.concat(results, ignore_index=True)
+    return merged.groupby(by, dropna=False, observed=True)[values].sum().reset_index()
+
+
+def merge_bounds(results):
+    firsts = [first for first, _ in results if pd.notnull(first)]
+    lasts = [last for _, last in results if pd.notnull(last)]
+    return (min(firsts), max(lasts)) if len(firsts) > 0 else (pd.NaT, pd.NaT)
+
+
+def merge_cube(results):
+    # stable, so each month keeps the order of CUBE_DIMS like a single shelter's window
+    cube = merge_sum(results, data_functions.CUBE_DIMS, 'id')
+    return cube.sort_values(by='months', kind='stable').reset_index(drop=True)
+
+
+def merge_counts(results):
+    return tuple(sum(r[i] for r in results) for i in range(len(results[0])))
+
+
+MERGES = {'date_bounds':merge_bounds,
+          'occupancy_counts':lambda rs: merge_sum(rs, ['month_idx'], ['present','ins','outs','same']),
+          'inout_cube_window':merge_cube,
+          'save_rate_counts':merge_counts,
+          'distinct_ids':sum,
+          'stay_sketches':lambda rs: merge_sum(rs, ['month_idx','open','type','agegroup','bin'], 'count'),
+          'region_counts':lambda rs: merge_sum(rs, ['month_idx','region','type'], 'id'),
+          'general_age_counts':lambda rs: tuple(merge_sum([r[i] for r in rs], ['type','agecat'], 'id')
+                                                for i in range(2))}
+
+
+class Coalition:
+    # every shelter at once, for the coalition-wide views - its version changes whenever any shelter's does
+    def __init__(self, sources):
+        self.sources = dict(sources)
+        self.versions = {shelter:shelter_version(path) for shelter, path in self.sources.items()}
+        text = json.dumps(sorted(self.versions.items()))
+        self.attrs = {'version':f"coalition:{hashlib.sha1(text.encode()).hexdigest()[:16]}"}
+
+    def merged(self, name, *args):
+        # name's result for every shelter merged, running it only for the shelters without a result for their
+        # current version
+        version = self.attrs['version']
+        key = ('merged', version, name, memo.normalize_arg(args))
+        found, value = _RESULTS.get(key)
+        if found:
+            return value
+
+        results = {}
+        pending = {}
+        for shelter, path in self.sources.items():
+            shelter_key = ('shelter', shelter, self.versions[shelter], name, memo.normalize_arg(args))
+            found, result = _RESULTS.get(shelter_key)
+            if found:
+                results[shelter] = result
+            else:
+                pending[shelter] = (shelter_key,
+                                    shelter_pool(self.sources, shelter).submit(partition_call, path, name, args))
+
+        for shelter, (shelter_key, future) in pending.items():
+            results[shelter] = future.result()
+            _RESULTS.put(shelter_key, results[shelter])
+
+        # merged frames are versioned like memoized results, so the preps downstream of them are memoized too
+        value = memo.mark_lineage(MERGES[name]([results[s] for s in self.sources]), hash(key), version, [])
+        _RESULTS.put(key, value)
+        return value
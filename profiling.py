@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import fnmatch
+import inspect
+import threading
+import functools
+import contextvars
+from collections import deque
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# -----------------------------------------------
+# Timing spans for page renders
+#
+# instrument() wraps the page-level functions of the given modules in a span - the data preps, the builds of the
+# persisted aggregates and the plot builders, by name (PROFILED_NAMES), leaving the small helpers they call many
+# times per render (month_index, column_values, frozen...) unwrapped - and expander() opens an expander inside one, so a render breaks down into nested spans with their wall time, rows in and
+# out, and the change in the process's resident memory (process-wide, so only approximate when sections run side by
+# side). Spans are only recorded while a render has profiling switched on from the sidebar - otherwise a wrapped call
+# costs one context variable lookup.
+#
+# The latest render's spans are shown in the sidebar and can be downloaded as Chrome trace JSON (chrome://tracing or
+# https://ui.perfetto.dev). Every profiled render also goes into a rolling window of durations per span shared by all
+# sessions on the server (for p50/p95), and into a JSON lines log if SHELTER_DASH_PROFILE_LOG is set.
+
+ROLLING_WINDOW = 200
+
+PROFILED_NAMES = ('*_data_prep', 'build_*', '*_plot')
+
+PROFILE_LOG = os.environ.get('SHELTER_DASH_PROFILE_LOG')
+
+# with SHELTER_DASH_STARTUP_TIMING set, every script run logs how long it took to get through its imports, data and
+# page, and the first run in the process also how long it's been since the process started (time to first paint)
+STARTUP_TIMING = bool(os.environ.get('SHELTER_DASH_STARTUP_TIMING'))
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_RECORDER = contextvars.ContextVar('profile_recorder', default=None)
+_DEPTH = contextvars.ContextVar('profile_depth', default=0)
+
+_ROLLING = {}
+_ROLLING_LOCK = threading.Lock()
+
+_IMPORTED_AT = time.time()
+_RUN = threading.local()
+_FIRST_RUN_DONE = threading.Event()
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def frame_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    if isinstance(value, tuple) and len(value) > 0:
+        return frame_rows(value[0])
+    return None
+
+
+class Span:
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.recorder = _RECORDER.get()
+
+    def __enter__(self):
+        if self.recorder is not None:
+            self.depth_token = _DEPTH.set(_DEPTH.get() + 1)
+            self.depth = _DEPTH.get() - 1
+            self.rss = rss_bytes()
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        if self.recorder is not None:
+            end = time.perf_counter_ns()
+            rss = rss_bytes()
+            _DEPTH.reset(self.depth_token)
+            self.recorder.append({'name':self.name, 'start_ns':self.start, 'dur_ns':end - self.start,
+                                  'depth':self.depth, 'tid':threading.get_ident(), 'rows_in':self.rows_in,
+                                  'rows_out':self.rows_out,
+                                  'mem_delta':rss - self.rss if rss is not None and self.rss is not None else None})
+        return False
+
+
+def span(name, rows_in=None):
+    return Span(name, rows_in)
+
+
+def profiled(func, prefix):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _RECORDER.get() is None:
+            return func(*args, **kwargs)
+
+        frames = [a for a in args if isinstance(a, pd.DataFrame)]
+        with Span(f'{prefix}.{func.__name__}', len(frames[0]) if len(frames) > 0 else None) as s:
+            value = func(*args, **kwargs)
+            s.rows_out = frame_rows(value)
+        return value
+
+    wrapper.__profiled__ = True
+    return wrapper
+
+
+def instrument(*modules):
+    # safe to call on every script rerun, functions are only wrapped once
+    for module in modules:
+        for name, obj in list(vars(module).items()):
+            if (name.startswith('_') or not any(fnmatch.fnmatchcase(name, pattern) for pattern in PROFILED_NAMES)
+                    or not inspect.isfunction(obj) or obj.__module__ != module.__name__
+                    or getattr(obj, '__profiled__', False)):
+                continue
+            setattr(module, name, profiled(obj, module.__name__))
+
+
+class expander:
+    # st.beta_expander, timed as one span whenever the expander's contents run
+    def __init__(self, label, expanded=False):
+        self.label = label
+        self.container = st.beta_expander(label, expanded=expanded)
+
+    def __enter__(self):
+        self.span = Span(f'expander: {self.label}')
+        self.container.__enter__()
+        self.span.__enter__()
+        return self.container
+
+    def __exit__(self, *exc):
+        self.span.__exit__(*exc)
+        return self.container.__exit__(*exc)
+
+
+# -----------------------------------------------
+# Rolling stats and exports
+def record_render(page, spans):
+    with _ROLLING_LOCK:
+        for s in spans:
+            _ROLLING.setdefault(s['name'], deque(maxlen=ROLLING_WINDOW)).append(s['dur_ns'] / 1e6)
+
+    if PROFILE_LOG:
+        with open(PROFILE_LOG, 'a') as f:
+            f.write(json.dumps({'time':time.time(), 'page':page,
+                                'spans':[{'name':s['name'], 'ms':s['dur_ns'] / 1e6} for s in spans]}) + '\n')
+
+
+def rolling_stats():
+    with _ROLLING_LOCK:
+        rolling = {name:np.array(d) for name, d in _ROLLING.items()}
+
+    stats = pd.DataFrame({'span':list(rolling.keys()),
+                          'renders':[len(d) for d in rolling.values()],
+                          'p50_ms':[np.percentile(d, 50) for d in rolling.values()],
+                          'p95_ms':[np.percentile(d, 95) for d in rolling.values()]})
+    return stats.sort_values(by='p95_ms', ascending=False).reset_index(drop=True)
+
+
+def chrome_trace(spans):
+    # Trace Event Format, complete ('X') events in microseconds
+    start = min([s['start_ns'] for s in spans], default=0)
+    events = [{'name':s['name'], 'ph':'X', 'ts':(s['start_ns'] - start) / 1000, 'dur':s['dur_ns'] / 1000,
+               'pid':os.getpid(), 'tid':s['tid'],
+               'args':{k:s[k] for k in ['rows_in','rows_out','mem_delta'] if s[k] is not None}} for s in spans]
+    return json.dumps({'traceEvents':events, 'displayTimeUnit':'ms'})
+
+
+def spans_table(spans):
+    spans = sorted(spans, key=lambda s: s['start_ns'])
+    return pd.DataFrame({'span':['  ' * s['depth'] + s['name'] for s in spans],
+                         'ms':[round(s['dur_ns'] / 1e6, 1) for s in spans],
+                         'rows in':pd.array([s['rows_in'] for s in spans], dtype='Int64'),
+                         'rows out':pd.array([s['rows_out'] for s in spans], dtype='Int64'),
+                         'mem MB':[round(s['mem_delta'] / 1024**2, 1) if s['mem_delta'] is not None else None
+                                   for s in spans]})
+
+
+# -----------------------------------------------
+# Pages
+def profiled_page(page, name):
+    # runs the page, recording its spans when 'Profile this page' is ticked in the sidebar
+    @functools.wraps(page)
+    def wrapper(*args, **kwargs):
+        if not st.sidebar.checkbox('Profile this page', value=False, key='profile_enabled'):
+            return page(*args, **kwargs)
+
+        spans = []
+        token = _RECORDER.set(spans)
+        try:
+            with Span(f'page: {name}'):
+                page(*args, **kwargs)
+        finally:
+            _RECORDER.reset(token)
+
+        record_render(name, spans)
+        profile_panel(name, spans)
+
+    return wrapper
+
+
+def profile_panel(name, spans):
+    with st.sidebar.beta_expander('Profile of the latest render', expanded=True):
+        st.dataframe(spans_table(spans))
+        st.download_button('Download Chrome trace', chrome_trace(spans), file_name=f'profile_{name}.json',
+                           mime='application/json')
+        st.write('<b>Across sessions</b>', unsafe_allow_html=True)
+        st.dataframe(rolling_stats())
+
+
+# -----------------------------------------------
+# Startup timing
+def process_start_time():
+    # wall clock time the process started (Linux), or when this module was first imported
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return _IMPORTED_AT
+
+
+def startup_begin():
+    if STARTUP_TIMING:
+        _RUN.marks = [('start', time.perf_counter())]
+
+
+def startup_mark(name):
+    if STARTUP_TIMING and hasattr(_RUN, 'marks'):
+        _RUN.marks.append((name, time.perf_counter()))
+
+
+def startup_report():
+    if not STARTUP_TIMING or not hasattr(_RUN, 'marks'):
+        return
+
+    marks = _RUN.marks + [('page', time.perf_counter())]
+    steps = {name:round(t - prev, 3) for (_, prev), (name, t) in zip(marks[:-1], marks[1:])}
+    report = {'time':time.time(), 'script_s':round(marks[-1][1] - marks[0][1], 3), 'steps':steps}
+    if not _FIRST_RUN_DONE.is_set():
+        _FIRST_RUN_DONE.set()
+        report['since_process_start_s'] = round(time.time() - process_start_time(), 3)
+
+    print(f"startup timing: {json.dumps(report)}", flush=True)
+    if PROFILE_LOG:
+        with open(PROFILE_LOG, 'a') as f:
+            f.write(json.dumps({'startup':report}) + '\n')
+    st.sidebar.caption(f"Rendered in {report['script_s']:.2f}s "
+                       f"({', '.join(f'{k} {v:.2f}s' for k, v in steps.items())})")
+    del _RUN.marks
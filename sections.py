@@ -0,0 +1,103 @@
+import os
+import threading
+import contextvars
+import streamlit as st
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# -----------------------------------------------
+# Deferred expander sections
+#
+# Streamlit doesn't tell the script whether an expander is open, so a collapsed section shows a button instead of
+# its contents and only runs its data prep/figures once that button has been pressed. After that the section stays
+# open for the rest of the session. Results are kept per (section, date range, widget state) so reopening a section
+# or going back to a previous date range doesn't recompute it.
+#
+# The data prep of every open section can be started up front with prefetch_section, so the sections run side by side
+# on a worker pool shared by every session on the server, instead of one after another in the script thread. The pool
+# size caps how much of the server's CPU the dashboard uses however many people are on it (SHELTER_DASH_WORKERS,
+# default one per core). It is a thread pool, since most of the work is pandas/NumPy; SHELTER_DASH_POOL=process
+# switches to a process pool for Python-heavy preps. Preps are then pickled by reference, so they have to be module
+# level functions (not closures in the page), and their arguments and results are pickled too.
+
+MAX_SECTION_RESULTS = 64
+
+MAX_WORKERS = int(os.environ.get('SHELTER_DASH_WORKERS', os.cpu_count() or 4))
+
+POOL_KIND = os.environ.get('SHELTER_DASH_POOL', 'thread')
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def section_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            if POOL_KIND == 'process':
+                _POOL = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+            else:
+                _POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='section')
+    return _POOL
+
+
+def section_opened(key):
+    # whether the section has been opened in this session, without drawing its button
+    return key in st.session_state.get('opened_sections', set())
+
+
+def section_is_open(key, expanded=False):
+    opened = st.session_state.setdefault('opened_sections', set())
+    if expanded or key in opened:
+        return True
+
+    if st.button('Show this section', key=f'open_{key}'):
+        opened.add(key)
+        return True
+
+    return False
+
+
+def section_result(key, params, func, *args, **kwargs):
+    # returns func(*args, **kwargs), only calling it the first time this section is run with these params
+    results = st.session_state.setdefault('section_results', OrderedDict())
+    result_key = (key,) + tuple(params)
+
+    if result_key in results:
+        results.move_to_end(result_key)
+        return results[result_key]
+
+    # started by prefetch_section, so just wait for it
+    pending = st.session_state.get('section_pending', {})
+    if result_key in pending:
+        value = pending.pop(result_key).result()
+    else:
+        value = func(*args, **kwargs)
+    results[result_key] = value
+    if len(results) > MAX_SECTION_RESULTS:
+        results.popitem(last=False)
+
+    return value
+
+
+def prefetch_section(section, key, params, func, *args, **kwargs):
+    # if the section is open, starts func(*args, **kwargs) on the worker pool - the section's own section_result call
+    # with the same key and params then picks up the result
+    if not section_opened(section):
+        return
+
+    results = st.session_state.setdefault('section_results', OrderedDict())
+    pending = st.session_state.setdefault('section_pending', {})
+    result_key = (key,) + tuple(params)
+    if result_key in results or result_key in pending:
+        return
+
+    # anything still pending for this key is from inputs that have since changed
+    for k in [k for k in pending if k[0] == key]:
+        pending.pop(k).cancel()
+
+    if POOL_KIND == 'process':
+        pending[result_key] = section_pool().submit(func, *args, **kwargs)
+    else:
+        # run in a copy of the script thread's context, so e.g. profiling spans land in the current render
+        pending[result_key] = section_pool().submit(contextvars.copy_context().run, func, *args, **kwargs)
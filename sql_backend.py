@@ -0,0 +1,340 @@
+import os
+import re
+import sys
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import data_cache
+import data_functions
+
+# -----------------------------------------------
+# DuckDB backend for the aggregate queries
+#
+# Selected per deployment with SHELTER_DASH_BACKEND=duckdb (see data_functions.BACKEND). The base table is copied
+# once per dataset version from its columnar cache to Parquet, sorted by intake date and one chunk at a time (see
+# below), and the monthly totals, the in/out cube (types, agencies, breeds and age groups by month) and the save rate
+# counts are then queried from those files rather than computed with pandas:
+#   - only the columns a query uses are read, and date ranges skip whole row groups using their min/max statistics
+#   - queries run on all cores (SHELTER_DASH_DUCKDB_THREADS to limit them)
+#   - with a memory limit (SHELTER_DASH_DUCKDB_MEMORY, e.g. '4GB') large group-bys spill to a temporary directory
+#     next to the columnar cache instead of failing
+#
+# Results are returned with the same columns, dtypes and row order as the pandas functions. tests/test_sql_backend.py
+# checks them against each other, and larger tables can be checked with
+#
+#   python sql_backend.py --sizes 10k 100k
+#
+# duckdb is only needed (and imported) when this backend is selected.
+
+PARQUET_DIR = os.path.join(data_cache.CACHE_DIR, 'sql')
+
+THREADS = os.environ.get('SHELTER_DASH_DUCKDB_THREADS')
+MEMORY_LIMIT = os.environ.get('SHELTER_DASH_DUCKDB_MEMORY')
+
+# columns of the enriched table the queries read
+TABLE_COLUMNS = ['id','type','breed','intake_date','out_date','intake_month_idx','out_month_idx','agecat_intake',
+                 'agecat_out','intake_flag','out_flag','intake_agency_name','out_agency_name','out_adopt']
+
+ROW_GROUP_SIZE = 122_880
+
+_DB = {}
+_DB_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def cursor():
+    # one database per process, and a cursor per thread (sections run on a thread pool)
+    with _DB_LOCK:
+        if 'con' not in _DB:
+            import duckdb
+
+            config = {'preserve_insertion_order':False,
+                      'temp_directory':os.path.join(PARQUET_DIR, 'spill')}
+            if THREADS:
+                config['threads'] = int(THREADS)
+            if MEMORY_LIMIT:
+                config['memory_limit'] = MEMORY_LIMIT
+            _DB['con'] = duckdb.connect(database=':memory:', config=config)
+
+    if getattr(_LOCAL, 'con', None) is not _DB['con']:
+        _LOCAL.con = _DB['con']
+        _LOCAL.cursor = _DB['con'].cursor()
+    return _LOCAL.cursor
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# -----------------------------------------------
+# Parquet copy of the table
+#
+# A directory of Parquet files per dataset version, each holding ROW_GROUP_SIZE rows in intake date order, so a date
+# range skips whole files using their min/max statistics. The rows are read from the table's columnar cache (memory
+# mapped, see data_cache) a file's worth at a time, with the age groups at intake and out computed for just those
+# rows, so the copy is written without the table being loaded - only its intake dates and their sort order are held
+# in memory. Frames without a cache for their version (e.g. built in memory) are copied from the frame, in the same
+# chunks.
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+# columns of the compact table the copy is made from
+SOURCE_COLUMNS = ['id','type','breed','birthday','intake_date','out_date','intake_month_idx','out_month_idx',
+                  'intake_flag','out_flag','intake_agency_name','out_agency_name','out_adopt']
+
+
+def partition_dir(d, parquet_dir=None):
+    # each shelter's copies are kept apart (see partitions.py), so replacing one shelter's never touches another's.
+    # parquet_dir is where the copies go, PARQUET_DIR unless given
+    parquet_dir = parquet_dir or PARQUET_DIR
+    partition = data_functions.dataset_partition(d)
+    return parquet_dir if partition is None else os.path.join(parquet_dir, 'shelters', partition)
+
+
+def table_path(d, parquet_dir=None):
+    # files of the Parquet copy of d for its dataset version, written the first time it's needed
+    version = data_functions.dataset_version(d)
+    path = os.path.join(partition_dir(d, parquet_dir), f"ins_outs-{re.sub(r'[^A-Za-z0-9._-]', '_', str(version))}")
+
+    with _TABLES_LOCK:
+        if _TABLES.get(path) != version:
+            if not os.path.exists(path):
+                write_table(d, path)
+            _TABLES[path] = version
+    return os.path.join(path, '*.parquet')
+
+
+def table_source(d):
+    # the columns the copy needs, memory mapped from d's columnar cache when it holds d's version, else d itself
+    cache_dir = data_functions.partition_cache_dir(data_functions.dataset_partition(d))
+    meta = data_cache.read_meta('ins_outs', cache_dir)
+    if meta is None or not os.path.exists(meta['key']['path']) or \
+            data_cache.source_key(meta['key']['path']) != meta['key']:
+        return d
+
+    version = meta.get('version') or data_functions.base_version(meta['key']['path'])
+    if version != data_functions.dataset_version(d):
+        return d
+    return data_cache.read_cache('ins_outs', cache_dir=cache_dir, columns=SOURCE_COLUMNS)
+
+
+def write_table(d, path):
+    source = table_source(d)
+    columns = [c for c in SOURCE_COLUMNS if c in source]
+
+    tmp = data_cache.temp_path(path)
+    os.makedirs(tmp)
+
+    # DuckDB scans each chunk's columns as they are (categoricals as ENUMs), the dtypes of query results are restored
+    # from d (see restore_column). Rows without an intake date sort last.
+    order = np.argsort(source['intake_date'].to_numpy(), kind='stable')
+    con = cursor()
+    for i, start in enumerate(range(0, max(len(order), 1), ROW_GROUP_SIZE)):
+        chunk = data_functions.select_columns(source, columns, order[start:start + ROW_GROUP_SIZE])
+        for date_for_comp in ['intake','out']:
+            chunk = data_functions.add_age_columns(chunk, chunk[f'{date_for_comp}_date'], suffix=f'_{date_for_comp}')
+
+        con.register('ins_outs_chunk', chunk[[c for c in TABLE_COLUMNS if c in chunk]])
+        try:
+            con.execute(f"COPY ins_outs_chunk TO {sql_string(os.path.join(tmp, f'part-{i:05d}.parquet'))} "
+                        f"(FORMAT PARQUET)")
+        finally:
+            con.unregister('ins_outs_chunk')
+    data_cache.replace_dir(tmp, path)
+
+    # copies for older versions of the same table are no longer read
+    for fname in os.listdir(os.path.dirname(path)):
+        old = os.path.join(os.path.dirname(path), fname)
+        if fname.startswith('ins_outs-') and '.tmp-' not in fname and old != path:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def restore_column(values, like):
+    # a query result column with the dtype of the matching column of the table
+    if isinstance(like.dtype, pd.CategoricalDtype):
+        return pd.Categorical(values, categories=like.cat.categories, ordered=like.cat.ordered)
+    return pd.array(values, dtype=like.dtype)
+
+
+def date_filter(column, start_date, end_date):
+    # WHERE clause (and parameters) for rows with a date in [start_date, end_date] (any date when they're left out)
+    where, params = [f'{column} IS NOT NULL'], []
+    if start_date is not None:
+        where.append(f'{column} >= ?')
+        params.append(pd.Timestamp(start_date).to_pydatetime())
+    if end_date is not None:
+        where.append(f'{column} <= ?')
+        params.append(pd.Timestamp(end_date).to_pydatetime())
+    return ' AND '.join(where), params
+
+
+# -----------------------------------------------
+# Queries
+def build_occupancy_counts(d, parquet_dir=None):
+    # same as data_functions.build_occupancy_counts: animals present, intakes, outcomes and in/out same month for
+    # every month from the first intake to the last stay's end (open stays run through the month of the latest intake)
+    res = cursor().execute(f"""
+        WITH stays AS (
+            SELECT intake_month_idx AS in_m,
+                   CASE WHEN out_date IS NULL THEN max(intake_month_idx) OVER () ELSE out_month_idx END AS out_m,
+                   out_date IS NOT NULL AS real_out
+            FROM read_parquet({sql_string(table_path(d, parquet_dir))})),
+        valid AS (SELECT * FROM stays WHERE in_m >= 0 AND in_m <= out_m),
+        months AS (SELECT unnest(range(first_m, last_m + 1)) AS month_idx
+                   FROM (SELECT min(in_m) AS first_m, max(out_m) AS last_m FROM valid)),
+        starts AS (SELECT in_m AS month_idx, count(*) AS ins,
+                          count(*) FILTER (WHERE real_out AND out_m = in_m) AS same
+                   FROM valid GROUP BY in_m),
+        ends AS (SELECT out_m AS month_idx, count(*) AS leaving, count(*) FILTER (WHERE real_out) AS outs
+                 FROM valid GROUP BY out_m)
+        SELECT months.month_idx,
+               sum(coalesce(ins, 0)) OVER w - sum(coalesce(leaving, 0)) OVER w + coalesce(leaving, 0) AS present,
+               coalesce(ins, 0) AS ins,
+               coalesce(outs, 0) AS outs,
+               coalesce(same, 0) AS same
+        FROM months LEFT JOIN starts USING (month_idx) LEFT JOIN ends USING (month_idx)
+        WINDOW w AS (ORDER BY months.month_idx)
+        ORDER BY months.month_idx""").df()
+
+    return res.astype('int64').reset_index(drop=True)
+
+
+def build_inout_cube(d, flags, date_for_comp='intake', start_date=None, end_date=None, parquet_dir=None):
+    # same as data_functions.build_inout_cube (or inout_cube_window, with dates), distinct animals per month x type x
+    # breed x age group x flag x agency
+    where, params = date_filter(f'{date_for_comp}_date', start_date, end_date)
+    res = cursor().execute(f"""
+        SELECT {date_for_comp}_month_idx AS month_idx,
+               type,
+               breed,
+               agecat_{date_for_comp} AS agecat,
+               CASE WHEN list_contains(?, {date_for_comp}_flag) THEN {date_for_comp}_flag END AS flag,
+               {date_for_comp}_agency_name AS agency,
+               count(DISTINCT id) AS id
+        FROM read_parquet({sql_string(table_path(d, parquet_dir))})
+        WHERE {where}
+        GROUP BY ALL""", [list(flags)] + params).df()
+
+    flag = res['flag'].astype(object)
+    cube = pd.DataFrame({'months':data_functions.month_first(res['month_idx'].to_numpy()),
+                         'type':restore_column(res['type'], d['type']),
+                         'breed':restore_column(res['breed'], d['breed']),
+                         'agecat':restore_column(res['agecat'], d[f'agecat_{date_for_comp}']),
+                         'flag':flag.where(flag.notnull(), np.nan).to_numpy(),
+                         'agency':restore_column(res['agency'], d[f'{date_for_comp}_agency_name']),
+                         'id':res['id'].astype('int64').to_numpy()})
+
+    # in the order pandas' groupby gives (categories in their own order, missing values last)
+    return cube.sort_values(by=data_functions.CUBE_DIMS, kind='stable', na_position='last').reset_index(drop=True)
+
+
+def save_rate_counts(d, start_date=None, end_date=None, parquet_dir=None):
+    where, params = date_filter('out_date', start_date, end_date)
+    outcomes, adopted = cursor().execute(f"""
+        SELECT count(DISTINCT id), count(DISTINCT id) FILTER (WHERE out_adopt = 1)
+        FROM read_parquet({sql_string(table_path(d, parquet_dir))})
+        WHERE {where}""", params).fetchone()
+
+    return int(outcomes), int(adopted)
+
+
+# -----------------------------------------------
+# Parity with the pandas functions
+def parity_windows(d, count, seed=0):
+    # random date windows, plus the full history and a single day
+    rng = np.random.default_rng(seed)
+    first, last = data_functions.date_bounds(d, 'intake')
+    days = max((last - first).days, 1)
+    windows = [(first.to_pydatetime(), last.to_pydatetime()), (last.to_pydatetime(), last.to_pydatetime())]
+    for a, b in np.sort(rng.integers(0, days + 1, size=(count, 2)), axis=1):
+        windows.append(((first + pd.Timedelta(days=int(a))).to_pydatetime(),
+                        (first + pd.Timedelta(days=int(b))).to_pydatetime()))
+    return windows
+
+
+def parity_checks(d, version, windows, parquet_dir=None):
+    # (name, pandas result, DuckDB result) for every query and window. The pandas side runs on a frame without a
+    # version (so nothing is cached or read from the columnar cache), the DuckDB side on the same rows with one, its
+    # Parquet copy written to parquet_dir.
+    versioned = d.copy(deep=False)
+    versioned.attrs = {'version':version}
+
+    checks = [('occupancy_counts', data_functions.build_occupancy_counts(d),
+               build_occupancy_counts(versioned, parquet_dir))]
+    for date_for_comp, mapping in [('intake', data_functions.INTAKE_MAPPING), ('out', data_functions.OUTCOME_MAPPING)]:
+        flags = list(mapping.keys())
+        checks.append((f'inout_cube ({date_for_comp})', data_functions.build_inout_cube(d, flags, date_for_comp),
+                       build_inout_cube(versioned, flags, date_for_comp, parquet_dir=parquet_dir)))
+
+        for start_date, end_date in windows:
+            label = f"{date_for_comp} {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}"
+            start_month = datetime.datetime(start_date.year, start_date.month, 1)
+            end_month = datetime.datetime(end_date.year, end_date.month, 1)
+            cubes = [data_functions.inout_cube_window(d, mapping, start_date, end_date, date_for_comp),
+                     build_inout_cube(versioned, flags, date_for_comp, start_date, end_date, parquet_dir)]
+            checks.append((f'inout_cube_window ({label})', *cubes))
+
+            # and the page preps run on each backend's cube
+            for name, prep in [('inout_heatmap_data_prep',
+                                lambda c: data_functions.inout_heatmap_data_prep(c, date_for_comp)),
+                               ('inout_types_month_data_prep',
+                                lambda c: data_functions.inout_types_month_data_prep(c, mapping, date_for_comp)),
+                               ('inout_agencies_data_prep',
+                                lambda c: data_functions.inout_agencies_data_prep(c, date_for_comp)),
+                               ('inout_breed_data_prep',
+                                lambda c: data_functions.inout_breed_data_prep(c, start_month, end_month,
+                                                                                date_for_comp)),
+                               ('inout_age_data_prep',
+                                lambda c: data_functions.inout_age_data_prep(c, start_month, end_month,
+                                                                              data_functions.AGE_GROUPS,
+                                                                              date_for_comp))]:
+                checks.append((f'{name} ({label})', prep(cubes[0]), prep(cubes[1])))
+
+            if date_for_comp == 'out':
+                checks.append((f'save_rate_counts ({label})',
+                               data_functions.save_rate_counts(d, start_date, end_date),
+                               save_rate_counts(versioned, start_date, end_date, parquet_dir)))
+
+    return checks
+
+
+def mismatch(expected, actual):
+    # None when the results are identical, else what differs
+    try:
+        if isinstance(expected, tuple) and len(expected) > 0 and isinstance(expected[0], pd.DataFrame):
+            for e, a in zip(expected, actual):
+                pd.testing.assert_frame_equal(e, a)
+        elif isinstance(expected, pd.DataFrame):
+            pd.testing.assert_frame_equal(expected, actual)
+        elif expected != actual:
+            return f'{expected} != {actual}'
+    except AssertionError as e:
+        return str(e).strip().splitlines()[0]
+    return None
+
+
+if __name__ == '__main__':
+    import benchmark
+
+    parser = argparse.ArgumentParser(description='Check the DuckDB backend against the pandas functions')
+    parser.add_argument('--sizes', nargs='+', default=['10k'], choices=list(benchmark.SIZES.keys()))
+    parser.add_argument('--windows', type=int, default=20, help='random date windows checked per size')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in args.sizes:
+            d = data_functions.enrich_ins_outs(benchmark.synthetic_ins_outs(benchmark.SIZES[label]))
+            checks = parity_checks(d, f'parity-{label}', parity_windows(d, args.windows), tmp)
+            problems = [(name, mismatch(expected, actual)) for name, expected, actual in checks]
+            problems = [(name, p) for name, p in problems if p is not None]
+            print(f"{label}: {len(checks) - len(problems)} of {len(checks)} identical")
+            for name, problem in problems:
+                print(f"  {name}: {problem}")
+            failed = failed or len(problems) > 0
+
+    sys.exit(1 if failed else 0)
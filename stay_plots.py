@@ -0,0 +1,93 @@
+import numpy as np
+import plotly.graph_objects as go
+import plot_settings
+
+# -----------------------------------------------
+# Length of stay plots for the General page
+#
+# Drawn from the merged length of stay histograms (see data_functions.stay_distribution) instead of go.Violin traces
+# over every animal, so the figure holds a fixed number of points per age group whatever the size of the date window.
+# Each species is one filled trace of half violins, Canine to the left of each age group and Feline to the right like
+# the notebook's violins, plus a marker at each median carrying the number of stays and quartiles as hover text.
+
+SPECIES_SIDES = {'Canine':(-1, 1), 'Feline':(1, 0)}
+
+PERIOD_TITLES = {'lastmonth':'Last month', 'history':'Full history'}
+
+HALF_WIDTH = 0.45
+
+
+def half_violin_outline(density, positions, side):
+    # one closed outline per age group, separated by gaps so a single 'toself' trace fills each of them
+    xs, ys = [], []
+    for agegroup, g in density.groupby('agegroup', observed=True, sort=False):
+        share = g['share'].to_numpy()
+        if share.sum() <= 0:
+            continue
+        years = g['years'].to_numpy()
+        step = years[1] - years[0] if len(years) > 1 else 1.0
+        width = side * HALF_WIDTH * share / share.max()
+        pos = positions[agegroup]
+
+        xs.append(np.concatenate([[pos], pos + width, [pos], [None]]))
+        ys.append(np.concatenate([[years[0]], years + step / 2, [years[-1] + step], [None]]))
+
+    if len(xs) == 0:
+        return [], []
+    return np.concatenate(xs).tolist(), np.concatenate(ys).tolist()
+
+
+def length_stay_sketch_plot(summary, density, period='history'):
+    colors = plot_settings.color_list
+    categories = density['agegroup'].cat.categories.tolist()
+    positions = {c:i for i, c in enumerate(categories)}
+
+    fig = go.Figure()
+    for species, (side, color) in SPECIES_SIDES.items():
+        x, y = half_violin_outline(density[density.type == species], positions, side)
+        fig.add_trace(go.Scatter(x=x, y=y, mode='lines', fill='toself', name=species, legendgroup=species,
+                                 line=dict(color=colors[color], width=1), hoverinfo='skip'))
+
+        stats = summary[summary.type == species]
+        pos = stats['agegroup'].map(positions).to_numpy(dtype='float64')
+
+        # mean lines across each half violin, like meanline_visible on the notebook's violins
+        mean_x = np.column_stack([pos, pos + side * HALF_WIDTH, np.full(len(pos), np.nan)]).ravel()
+        mean_y = np.repeat(stats['mean'].to_numpy(), 3)
+        mean_y[2::3] = np.nan
+        fig.add_trace(go.Scatter(x=mean_x, y=mean_y, mode='lines', legendgroup=species, showlegend=False,
+                                 line=dict(color=colors[color], width=1), hoverinfo='skip'))
+
+        hover = [f"{species}, {a}<br>{n:,} stays<br>median {m:.2f} yrs<br>quartiles {q1:.2f} - {q3:.2f} yrs"
+                 for a, n, m, q1, q3 in zip(stats.agegroup, stats.n, stats['median'], stats.q25, stats.q75)]
+        fig.add_trace(go.Scatter(x=pos + side * HALF_WIDTH / 4, y=stats['median'], mode='markers',
+                                 legendgroup=species, showlegend=False, hovertext=hover, hoverinfo='text',
+                                 marker=dict(color='white', size=6, line=dict(color=colors[color], width=1))))
+
+    fig.update_xaxes(tickvals=list(range(len(categories))),
+                     ticktext=categories,
+                     title='Age',
+                     range=[-.5, len(categories) - .5],
+                     zeroline=False)
+
+    fig.update_yaxes(title='Years in Shelter',
+                     ticksuffix=" ",
+                     rangemode='tozero')
+
+    fig.update_layout(template=plot_settings.dash_template,
+                      height=400,
+                      width=750,
+                      margin=dict(l=70, r=40),
+                      title=dict(font_size=22,
+                                 x=0.05,
+                                 y=.94,
+                                 yref='container',
+                                 text=f"<b>Length of stay (yrs) in shelter - {PERIOD_TITLES.get(period, period)}</b>"),
+                      legend=dict(orientation='h',
+                                  y=1.17,
+                                  x=.0,
+                                  xanchor='left'))
+
+    fig.add_vline(x=.5, line_width=1, line_dash="dash", line_color='gray')
+
+    return fig
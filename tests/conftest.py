@@ -0,0 +1,48 @@
+import os
+import sys
+import uuid
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# nothing the tests write goes to the working copy's cache
+os.environ['SHELTER_DASH_CACHE'] = tempfile.mkdtemp(prefix='shelter-dash-tests-')
+
+import benchmark
+import data_cache
+import data_functions
+import memo
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    # an empty columnar cache, and nothing left in memory from other tests
+    monkeypatch.setattr(data_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(data_functions, '_AGGREGATES', {})
+    memo.CACHE.clear()
+    return data_cache.CACHE_DIR
+
+
+@pytest.fixture
+def iodf(cache_dir):
+    # a small enriched table with a version of its own, like the one the pages read
+    d = benchmark.synthetic_ins_outs(3000, years=3)
+    d.attrs['version'] = f"test-{uuid.uuid4().hex[:8]}"
+    return data_functions.enrich_ins_outs(d)
+
+
+@pytest.fixture
+def seeded_source(cache_dir, tmp_path):
+    # workbook stand-ins whose columnar cache is already in place (so they're never parsed), each with its own animals
+    def seed(path=None, n=3000, seed=0):
+        path = path or tmp_path / 'ins_outs.xlsx'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f'placeholder {seed}')
+        d = benchmark.synthetic_ins_outs(n, years=3, seed=seed)
+        d['id'] = d['id'] + seed * 10**6
+        data_cache.write_cache(d, 'ins_outs', data_cache.source_key(str(path)),
+                               data_functions.partition_cache_dir(data_functions.source_partition(str(path))))
+        return str(path)
+
+    return seed
@@ -0,0 +1,72 @@
+import json
+import asyncio
+import functools
+from collections import OrderedDict
+import pandas as pd
+import pytest
+import api
+import data_functions
+import ingest
+
+
+@pytest.fixture
+def source(seeded_source, monkeypatch):
+    # the API's shared table and response cache start empty
+    monkeypatch.setattr(data_functions, '_SHARED', {})
+    monkeypatch.setattr(api, '_RESPONSES', OrderedDict())
+    return seeded_source()
+
+
+async def get(port, target, headers=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = ''.join(f'{k}: {v}\r\n' for k, v in (headers or {}).items())
+    writer.write(f'GET {target} HTTP/1.1\r\nHost: localhost\r\n{head}\r\n'.encode('latin-1'))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    status_line, _, rest = response.partition(b'\r\n')
+    head, _, body = rest.partition(b'\r\n\r\n')
+    headers = dict(line.split(': ', 1) for line in head.decode('latin-1').split('\r\n'))
+    return int(status_line.split()[1]), headers, body
+
+
+def test_etag_round_trip(source, tmp_path, monkeypatch):
+    calls = []
+    func, parsers = api.ENDPOINTS['/api/save_rate']
+    monkeypatch.setitem(api.ENDPOINTS, '/api/save_rate',
+                        (lambda iodf, **args: calls.append(args) or func(iodf, **args), parsers))
+    target = '/api/save_rate?start=2012-03-01&end=2013-06-30'
+
+    async def run():
+        server = await asyncio.start_server(functools.partial(api.handle, source), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            first = await get(port, target)
+            again = await get(port, target, {'If-None-Match':first[1]['ETag']})
+            # the same arguments spelled differently are the same request
+            other = await get(port, '/api/save_rate?end=2013-06-30&start=2012-03-01&unused=1',
+                              {'If-None-Match':f'"stale", {first[1]["ETag"]}'})
+
+            # a new batch changes the version, so the old ETag no longer matches
+            pd.DataFrame({'id':[10**7], 'type':['Canine'], 'breed':['Dog Breed 0'], 'birthday':['2010-01-01'],
+                          'location':['Town 0'], 'intake_date':['2013-01-05'], 'out_date':['2013-02-01'],
+                          'intake_stray':[1], 'out_adopt':[1]}).to_csv(tmp_path / 'delta.csv', index=False)
+            ingest.ingest_delta(str(tmp_path / 'delta.csv'), source)
+            changed = await get(port, target, {'If-None-Match':first[1]['ETag']})
+        return first, again, other, changed
+
+    first, again, other, changed = asyncio.run(run())
+
+    assert first[0] == 200 and first[1]['Cache-Control'] == 'no-cache'
+    assert again[0] == 304 and again[2] == b'' and again[1]['ETag'] == first[1]['ETag']
+    assert other[0] == 304
+    assert len(calls) == 2
+
+    assert changed[0] == 200 and changed[1]['ETag'] != first[1]['ETag']
+    body = json.loads(changed[2])
+    iodf = data_functions.shared_ins_outs(source)
+    outs = iodf[(iodf.out_date >= '2012-03-01') & (iodf.out_date <= '2013-06-30')]
+    assert body['outcome_animals'] == outs['id'].nunique()
+    assert body['adopted_animals'] == outs.loc[outs.out_adopt == 1, 'id'].nunique()
+    assert json.loads(first[2])['adopted_animals'] == body['adopted_animals'] - 1
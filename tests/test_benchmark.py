@@ -0,0 +1,25 @@
+import os
+import tempfile
+import benchmark
+import data_cache
+
+
+def test_runs_leave_no_files_behind(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmark, 'SIZES', {'tiny':2000})
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path / 'tmp'))
+    os.makedirs(tmp_path / 'tmp')
+    try:
+        import duckdb
+        import sql_backend
+    except ImportError:
+        sql_backend = None
+    else:
+        monkeypatch.setattr(sql_backend, 'PARQUET_DIR', str(tmp_path / 'sql'))
+
+    results = benchmark.run(['tiny'])
+
+    assert 'build_region_counts' in results['tiny']
+    assert ('sql: write_table' in results['tiny']) == (sql_backend is not None)
+    assert os.listdir(tmp_path / 'tmp') == []
+    assert not os.path.exists(tmp_path / 'sql')
+    assert not os.path.exists(data_cache.CACHE_DIR)
@@ -0,0 +1,68 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import data_cache
+import data_functions
+
+
+def run_threads(target, n=8):
+    errors = []
+    results = [None] * n
+    start = threading.Barrier(n)
+
+    def run(i):
+        start.wait()
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_concurrent_writes_leave_one_complete_copy(cache_dir):
+    frames = [pd.DataFrame({'a':np.arange(1000) + i, 'b':np.full(1000, f'v{i}')}) for i in range(8)]
+    writers = iter(range(8))
+    lock = threading.Lock()
+
+    def write():
+        with lock:
+            i = next(writers)
+        data_cache.write_cache(frames[i], 'frame', {'v':1}, cache_dir)
+
+    _, errors = run_threads(write)
+    assert errors == []
+
+    d = data_cache.read_cache('frame', {'v':1}, cache_dir)
+    assert any(d['a'].to_numpy().tolist() == f['a'].tolist() for f in frames)
+    assert sorted(os.listdir(cache_dir)) == ['frame']
+
+
+def test_cold_aggregate_is_built_once(iodf, monkeypatch):
+    builds = []
+    build = data_functions.build_inout_cube
+
+    def counted(*args, **kwargs):
+        builds.append(1)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(data_functions, 'build_inout_cube', counted)
+    results, errors = run_threads(lambda: data_functions.inout_cube(iodf, data_functions.INTAKE_MAPPING))
+
+    assert errors == []
+    assert len(builds) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_replacing_a_cache_keeps_it_readable(cache_dir):
+    data_cache.write_cache(pd.DataFrame({'a':[1, 2]}), 'frame', {'v':1}, cache_dir)
+    data_cache.write_cache(pd.DataFrame({'a':[3, 4, 5]}), 'frame', {'v':2}, cache_dir)
+
+    assert data_cache.read_cache('frame', {'v':2}, cache_dir)['a'].tolist() == [3, 4, 5]
+    assert os.listdir(cache_dir) == ['frame']
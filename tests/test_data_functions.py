@@ -0,0 +1,162 @@
+import datetime
+import functools
+import numpy as np
+import pandas as pd
+import benchmark
+import data_functions
+import memo
+
+
+def test_enriching_keeps_the_table_out_of_the_memo_cache(cache_dir, monkeypatch):
+    # as after profiling.instrument, which wraps the module's functions again
+    wrapped = data_functions.add_columns_ins_outs
+    monkeypatch.setattr(data_functions, 'add_columns_ins_outs', functools.wraps(wrapped)(lambda d: wrapped(d)))
+
+    d = benchmark.synthetic_ins_outs(500, years=2)
+    d.attrs['version'] = 'enrich-test'
+    enriched = data_functions.enrich_ins_outs(d)
+
+    assert 'agecat_intake' in enriched and 'age_out' in enriched
+    assert enriched.attrs == {'version':'enrich-test'}
+    assert memo.cache_stats()['entries'] == 0
+
+
+def test_breed_breakdown_counts_the_selected_animals(iodf):
+    start_month, end_month = datetime.datetime(2013, 1, 1), datetime.datetime(2013, 6, 1)
+    stays = data_functions.date_filter_month_firsts(iodf, start_month, end_month)
+    lastmonth = data_functions.month_snapshot_rows(stays, end_month)
+
+    for rows in [lastmonth, data_functions.stay_rows(stays), None]:
+        selected = iodf if rows is None else iodf.iloc[rows]
+        expected = selected.groupby(['type','breed'], observed=True)['id'].nunique()
+        breeddf = data_functions.breed_breakdown_data_prep(iodf, rows=rows)
+
+        assert breeddf.set_index(['type','breed'])['id'].sort_index().equals(expected.sort_index())
+        assert list(breeddf.columns) == ['type','breed','id']
+        # types in reverse order, most common breeds last within each
+        assert breeddf['type'].astype(str).tolist() == sorted(breeddf['type'].astype(str), reverse=True)
+        for _, g in breeddf.groupby('type', observed=True):
+            assert g['id'].is_monotonic_increasing
+
+
+def test_length_stay_matches_the_notebook_calc(iodf):
+    outs = data_functions.date_rows(iodf, 'out', datetime.datetime(2012, 6, 1), datetime.datetime(2013, 6, 30))
+    staydf = data_functions.length_stay_calc(iodf, rows=outs)
+
+    # the notebook's length_stay_calc
+    d = iodf.iloc[outs]
+    months = (d.out_date - d.intake_date) / np.timedelta64(1, 'D') / data_functions.DAYS_PER_MONTH
+    years = ((d.out_date - d.intake_date) / np.timedelta64(1, 'D') / data_functions.DAYS_PER_YEAR).astype(int)
+    cat = np.where(months < 0.5, '0-1 Wk', np.where(months < 2.0, '2-7 Wks', np.where(months < 6.0, '2-5 Mos',
+                   np.where(years < 1.0, '6-11 Mos', years.astype(str) + ' Yrs'))))
+    cat = pd.Series(cat, index=d.index).replace('1 Yrs', '1 Yr')
+
+    assert len(staydf) == len(outs) > 0
+    np.testing.assert_allclose(staydf['months_stay'], months)
+    assert staydf['years_stay'].tolist() == years.tolist()
+    assert staydf['cat_stay'].astype(str).tolist() == cat.tolist()
+
+    counts = data_functions.length_stay_outcome_data_prep(staydf)
+    assert counts['id'].sum() == d.groupby(['type', cat], observed=True)['id'].nunique().sum()
+
+
+def notebook_bymonth(iodf):
+    # the notebook's Shelter Totals cells: one row per animal per month it's in the shelter, open stays running to the
+    # last intake
+    maxdate = iodf.intake_date.max()
+    outdate_rev = iodf.out_date.fillna(maxdate)
+    months = [pd.date_range(i.replace(day=1), o, freq='MS') for i, o in zip(iodf.intake_date, outdate_rev)]
+    bymonth = pd.DataFrame({'months':np.concatenate(months),
+                            'id':np.repeat(iodf['id'].to_numpy(), [len(m) for m in months]),
+                            'intake_date':np.repeat(iodf.intake_date.to_numpy(), [len(m) for m in months]),
+                            'out_date':np.repeat(iodf.out_date.to_numpy(), [len(m) for m in months])})
+
+    in_match = bymonth.intake_date.dt.to_period('M').dt.start_time == bymonth.months
+    out_match = bymonth.out_date.notnull() & (bymonth.out_date.dt.to_period('M').dt.start_time == bymonth.months)
+    bymonth['category'] = np.where(in_match & ~out_match, 'Intake',
+                                   np.where(~in_match & out_match, 'Outcome',
+                                            np.where(in_match & out_match, 'In/Out Same Month', 'Continued Stay')))
+    return bymonth
+
+
+def test_monthly_counts_match_the_notebook_snapshots(iodf):
+    start_month, end_month = datetime.datetime(2012, 3, 1), datetime.datetime(2014, 6, 1)
+    monthtot, bymonth_types = data_functions.monthly_in_out_data_prep(data_functions.occupancy_counts(iodf),
+                                                                      start_month, end_month)
+
+    bymonth = notebook_bymonth(iodf)
+    bymonth = bymonth[(bymonth.months >= start_month) & (bymonth.months <= end_month)]
+    expected_tot = bymonth.groupby('months')['id'].nunique()
+    expected_types = bymonth.groupby(['months','category'])['id'].nunique()
+
+    assert monthtot['months'].tolist() == expected_tot.index.tolist()
+    assert monthtot['id'].tolist() == expected_tot.tolist()
+    assert monthtot['label'].tolist()[1:] == np.diff(expected_tot.to_numpy()).tolist()
+    assert bymonth_types.set_index(['months','category'])['id'].to_dict() == expected_types.to_dict()
+
+
+def test_cube_window_counts_partial_months_from_the_raw_rows(iodf):
+    windows = [(datetime.datetime(2012, 3, 17), datetime.datetime(2013, 8, 9)),    # partial at both ends
+               (datetime.datetime(2012, 3, 1), datetime.datetime(2013, 8, 31)),    # whole months only
+               (datetime.datetime(2012, 3, 1), datetime.datetime(2013, 8, 9)),     # partial last month
+               (datetime.datetime(2013, 5, 4), datetime.datetime(2013, 5, 20)),    # inside a single month
+               (datetime.datetime(2013, 5, 20), datetime.datetime(2013, 6, 3))]    # two partial months
+    for date_for_comp, mapping in [('intake', data_functions.INTAKE_MAPPING), ('out', data_functions.OUTCOME_MAPPING)]:
+        for start_date, end_date in windows:
+            window = data_functions.inout_cube_window(iodf, mapping, start_date, end_date, date_for_comp)
+
+            dates = iodf[f'{date_for_comp}_date']
+            selected = iodf[(dates >= start_date) & (dates <= end_date)]
+            expected = data_functions.build_inout_cube(selected, list(mapping.keys()), date_for_comp)
+            by = data_functions.CUBE_DIMS
+            pd.testing.assert_frame_equal(window.sort_values(by).reset_index(drop=True),
+                                          expected.sort_values(by).reset_index(drop=True), check_dtype=False)
+
+            per_month = selected.groupby(selected[f'{date_for_comp}_date'].dt.to_period('M').dt.start_time)['id']
+            assert window.groupby('months')['id'].sum().tolist() == per_month.nunique().tolist()
+
+
+def test_stay_index_finds_the_overlapping_stays(cache_dir):
+    d = benchmark.synthetic_ins_outs(5000, years=10, seed=3)
+    d.attrs['version'] = 'stay-index-test'
+    index = data_functions.stay_index(d)
+    in_month, out_month, _ = data_functions.stay_intervals(d)
+    valid = (in_month >= 0) & (in_month <= out_month)
+
+    first, last = in_month.min(), out_month.max()
+    rng = np.random.default_rng(0)
+    windows = [(first, last), (first - 30, first - 1), (last + 1, last + 30), (0, data_functions.STAY_INDEX_MAX),
+               (first, first), (last, last)] + \
+              [tuple(sorted(rng.integers(first - 5, last + 5, 2))) for _ in range(200)]
+    for start_idx, end_idx in windows:
+        expected = np.flatnonzero(valid & (in_month <= end_idx) & (out_month >= start_idx))
+        rows = data_functions.stay_index_rows(index, start_idx, end_idx)
+        assert len(rows) == len(np.unique(rows))
+        assert np.array_equal(np.sort(rows), expected), (start_idx, end_idx)
+
+
+def test_sketch_quantiles_are_within_a_bin_of_the_exact_ones(iodf):
+    start_month, end_month = datetime.datetime(2012, 6, 1), datetime.datetime(2014, 3, 1)
+    dist = data_functions.stay_distribution(data_functions.stay_sketches(iodf), start_month, end_month)
+
+    lengths = data_functions.stay_lengths(iodf)
+    months = data_functions.month_index([start_month, end_month])
+    lengths = lengths[(lengths.month_idx >= months[0]) & (lengths.month_idx <= months[1])]
+    groups = [((species, 'All Ages'), g) for species, g in lengths.groupby('type', observed=True)] + \
+        list(lengths.groupby(['type','agegroup'], observed=True))
+
+    qs = [.01, .05, .25, .5, .75, .95, .99]
+    ratio = 2 ** (1 / data_functions.STAY_BINS_PER_DOUBLING)
+    assert len(groups) > 6
+    for (species, agegroup), g in groups:
+        sketch = dist[(dist.type == species) & (dist.agegroup == agegroup)]
+        assert sketch['count'].sum() == len(g)
+        estimate = data_functions.sketch_quantiles(sketch.lo.to_numpy(), sketch.hi.to_numpy(),
+                                                   sketch['count'].to_numpy(), qs)
+        exact = np.quantile(g['days'].to_numpy(), qs, method='inverted_cdf')
+
+        # same-day stays are all in the first bin, [0, 1) days
+        same_day = exact < 1
+        assert (estimate[same_day] <= 1).all()
+        assert ((estimate[~same_day] >= exact[~same_day] / ratio) &
+                (estimate[~same_day] <= exact[~same_day] * ratio)).all(), (species, agegroup)
@@ -0,0 +1,17 @@
+import pandas as pd
+import data_functions_soco
+
+
+def test_soco_data_is_loaded_once_per_file_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_functions_soco, '_SHARED', {})
+    path = tmp_path / 'soco.csv'
+    pd.DataFrame({'Type':['DOG*','cat'], 'Intake Date':['2020-01-02','2020-02-03'], 'Count':[1, 1]}).to_csv(path,
+                                                                                                       index=False)
+    loads = []
+    load = data_functions_soco.load_and_format_data
+    monkeypatch.setattr(data_functions_soco, 'load_and_format_data', lambda p: loads.append(p) or load(p))
+
+    first = data_functions_soco.shared_soco_data(str(path))
+    assert data_functions_soco.shared_soco_data(str(path)) is first
+    assert len(loads) == 1
+    assert first['type'].tolist() == ['Dog', 'Cat']
@@ -0,0 +1,44 @@
+import os
+import json
+import pandas as pd
+import pytest
+
+pytest.importorskip('line_plots')
+pytest.importorskip('plot_functions')
+import export
+import ingest
+
+
+def rendered(out_dir):
+    # when each window's directory was last written
+    return {wid:os.stat(os.path.join(out_dir, wid)).st_mtime_ns
+            for wid in json.load(open(os.path.join(out_dir, 'index.json')))['windows']}
+
+
+def test_export_only_renders_windows_that_changed(seeded_source, tmp_path):
+    source = seeded_source()
+    out_dir = str(tmp_path / 'snapshots')
+    windows = ['2013-05-01:2013-05-31', '2012-02-01:2012-03-15']
+
+    assert export.export(source, out_dir, periods=('year',), windows=windows, workers=2) == (5, 5)
+    first = rendered(out_dir)
+    assert sorted(first) == ['2012', '2012-02-01_2012-03-15', '2013', '2013-05-01_2013-05-31', '2014']
+
+    general = json.load(open(os.path.join(out_dir, '2013', 'general.json')))['sections']
+    assert {'breed_lastmonth', 'breed_history', 'length_lastmonth', 'length_history'} <= set(general)
+    assert os.path.exists(os.path.join(out_dir, '2013', 'general_length_history.html'))
+    assert 'length_stay' in json.load(open(os.path.join(out_dir, '2013', 'outcomes.json')))['sections']
+
+    # nothing changed
+    assert export.export(source, out_dir, periods=('year',), windows=windows, workers=2) == (0, 5)
+    assert rendered(out_dir) == first
+
+    # an animal that came and went in May 2013 only touches the windows that include it
+    pd.DataFrame({'id':[10**7], 'type':['Canine'], 'breed':['Dog Breed 0'], 'birthday':['2010-01-01'],
+                  'location':['Town 0'], 'intake_date':['2013-05-05'], 'out_date':['2013-05-20'],
+                  'intake_stray':[1], 'out_adopt':[1]}).to_csv(tmp_path / 'delta.csv', index=False)
+    ingest.ingest_delta(str(tmp_path / 'delta.csv'), source)
+
+    assert export.export(source, out_dir, periods=('year',), windows=windows, workers=2) == (2, 5)
+    again = rendered(out_dir)
+    assert {wid for wid in first if again[wid] != first[wid]} == {'2013', '2013-05-01_2013-05-31'}
@@ -0,0 +1,99 @@
+import json
+import numpy as np
+import pandas as pd
+import benchmark
+import geography
+
+
+def square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+REGIONS = {'Northtown':{'type':'Polygon', 'coordinates':[square(0, 0, 10, 10), square(4, 4, 6, 6)]},
+           'Southtown':{'type':'MultiPolygon', 'coordinates':[[square(20, 0, 30, 10)],
+                                                              [[[40, 0], [50, 0], [45, 10], [40, 0]]]]},
+           'Holeville':{'type':'Polygon', 'coordinates':[square(4.5, 4.5, 5.5, 5.5)]},
+           '95401':{'type':'Polygon', 'coordinates':[square(60, 0, 70, 10)]}}
+
+
+def expected_region(lon, lat):
+    # the regions above worked out by hand
+    inside = lambda x0, y0, x1, y1: (lon > x0) & (lon < x1) & (lat > y0) & (lat < y1)
+    triangle = (lat > 0) & (lat < 2 * (lon - 40)) & (lat < 2 * (50 - lon))
+    return np.select([inside(0, 0, 10, 10) & ~inside(4, 4, 6, 6), inside(20, 0, 30, 10) | triangle,
+                      inside(4.5, 4.5, 5.5, 5.5), inside(60, 0, 70, 10)],
+                     ['Northtown', 'Southtown', 'Holeville', '95401'], None)
+
+
+def write_regions(path):
+    features = [{'type':'Feature', 'properties':{'name':name}, 'geometry':geometry}
+                for name, geometry in REGIONS.items()]
+    path.write_text(json.dumps({'type':'FeatureCollection', 'features':features}))
+    return str(path)
+
+
+def test_simplified_rings_stay_within_the_tolerance():
+    rng = np.random.default_rng(0)
+    angle = np.linspace(0, 2 * np.pi, 400)
+    radius = 1 + 0.05 * rng.standard_normal(400)
+    ring = np.column_stack([radius * np.cos(angle), radius * np.sin(angle)])
+    ring[-1] = ring[0]
+
+    for tolerance in [0.001, 0.01, 0.05, 0.2]:
+        simplified = geography.simplify_ring(ring, tolerance)
+        kept = np.flatnonzero((ring[:, None, :] == simplified[None, :, :]).all(axis=2).any(axis=1))
+        assert kept[0] == 0 and kept[-1] == len(ring) - 1
+        assert np.array_equal(ring[kept], simplified)
+
+        # every dropped point is within the tolerance of the segment between the points kept either side of it
+        for a, b in zip(kept[:-1], kept[1:]):
+            seg, pts = ring[b] - ring[a], ring[a + 1:b] - ring[a]
+            dist = np.abs(seg[0] * pts[:, 1] - seg[1] * pts[:, 0]) / np.hypot(seg[0], seg[1])
+            assert (dist <= tolerance).all()
+
+    # points on a straight line add nothing
+    line = np.column_stack([np.arange(10.0), 2 * np.arange(10.0)])
+    assert np.array_equal(geography.simplify_ring(line, 1e-9), line[[0, -1]])
+
+
+def test_points_in_region_follow_the_outlines_and_holes():
+    rng = np.random.default_rng(1)
+    lon, lat = rng.uniform(-5, 75, 20000), rng.uniform(-5, 15, 20000)
+    expected = expected_region(lon, lat)
+
+    for name, geometry in REGIONS.items():
+        polygons = geography.feature_polygons({'geometry':geometry})
+        assert np.array_equal(geography.points_in_region(lon, lat, polygons), expected == name), name
+    assert not geography.points_in_region(lon, lat, []).any()
+
+
+def test_region_counts_match_a_per_animal_lookup(cache_dir, tmp_path):
+    path = write_regions(tmp_path / 'regions.geojson')
+    d = benchmark.synthetic_ins_outs(4000, years=2, seed=5)
+
+    # names in any case, a ZIP code read as a number, coordinates ('lat, lon') and places outside every region
+    rng = np.random.default_rng(2)
+    names = ['northtown', ' SOUTHTOWN ', 'Holeville', '95401.0', 'Nowhere', None]
+    points = [(rng.uniform(-5, 75), rng.uniform(-5, 15)) for _ in range(60)]
+    values = names + [f'({lat:.4f}, {lon:.4f})' for lon, lat in points]
+    by_value = dict(zip(values, ['Northtown', 'Southtown', 'Holeville', '95401', None, None] +
+                        list(expected_region(*[np.round(np.array(p), 4) for p in zip(*points)]))))
+    d['location'] = rng.choice(np.array(values, dtype=object), len(d))
+
+    counts = geography.build_region_counts(d, 'intake', path=path)
+    assert isinstance(counts.region.dtype, pd.CategoricalDtype)
+    assert list(counts.region.cat.categories) == list(REGIONS)
+
+    animals = pd.DataFrame({'month_idx':d.intake_date.dt.year * 12 + d.intake_date.dt.month - 1 - 1970 * 12,
+                            'region':d['location'].map(by_value), 'type':d['type'], 'id':d['id']})
+    expected = animals.groupby(['month_idx','region','type'], dropna=False)['id'].nunique()
+    got = counts.assign(region=counts.region.astype(object)).set_index(['month_idx','region','type'])['id']
+    assert got.sort_index().to_dict() == expected[expected > 0].sort_index().to_dict()
+
+    start_month, end_month = pd.Timestamp('2012-04-01'), pd.Timestamp('2013-02-01')
+    by_region, unmatched = geography.region_window_counts(counts, start_month, end_month, 'Canine')
+    window = animals[(d.intake_date >= start_month) & (d.intake_date < end_month + pd.offsets.MonthBegin()) &
+                     (d['type'] == 'Canine')]
+    assert unmatched == window.region.isnull().sum()
+    assert by_region.set_index('region')['id'].to_dict() == window.groupby('region')['id'].nunique().to_dict()
+    assert by_region['id'].is_monotonic_decreasing
@@ -0,0 +1,105 @@
+import datetime
+import numpy as np
+import pandas as pd
+import data_cache
+import data_functions
+import geography
+import ingest
+
+
+def write_delta(base, path):
+    # closes some open stays and adds new animals
+    closing = base[base.out_date.isnull()].head(40)
+    new = base.tail(60)
+    delta = pd.DataFrame({'id':np.concatenate([closing['id'], new['id'] + 10**6]),
+                          'type':np.concatenate([closing['type'], new['type']]),
+                          'breed':np.concatenate([closing['breed'], new['breed']]),
+                          'birthday':np.concatenate([closing['birthday'], new['birthday']]),
+                          'location':np.concatenate([closing['location'], new['location']]),
+                          'intake_date':np.concatenate([closing['intake_date'], new['intake_date']]),
+                          'out_date':np.concatenate([np.full(len(closing), np.datetime64('2014-12-20', 'ns')),
+                                                     new['out_date']]),
+                          'intake_stray':1,
+                          'out_adopt':np.concatenate([np.ones(len(closing)), new['out_adopt']])})
+    delta.to_csv(path, index=False)
+    return str(path)
+
+
+def test_patched_cube_matches_a_rebuild(cache_dir, seeded_source, tmp_path):
+    source = seeded_source()
+    base = data_functions.enrich_ins_outs(data_functions.data_ins_outs(source))
+    flags = list(data_functions.INTAKE_MAPPING.keys())
+    data_functions.inout_cube(base, data_functions.INTAKE_MAPPING)
+
+    table, _, _ = ingest.ingest_delta(write_delta(base, tmp_path / 'delta.csv'), source)
+
+    patched = data_cache.read_cache('cube_intake', cache_dir=cache_dir)
+    rebuilt = data_functions.build_inout_cube(data_functions.enrich_ins_outs(table), flags)
+    assert data_cache.read_meta('cube_intake', cache_dir)['key']['version'] == table.attrs['version']
+    assert patched.astype(object).equals(rebuilt.reset_index(drop=True).astype(object))
+
+
+def in_memory(name, cache_dir):
+    # the cached frame with its columns read into memory, to compare with a frame built in memory
+    d = data_cache.read_cache(name, cache_dir=cache_dir)
+    return pd.DataFrame({c:d[c] if isinstance(d[c].dtype, pd.CategoricalDtype) else np.array(d[c]) for c in d})
+
+
+def ingested(seeded_source, tmp_path, *aggregates):
+    # a seeded table with the given aggregates persisted, then one batch ingested into it
+    source = seeded_source()
+    base = data_functions.enrich_ins_outs(data_functions.data_ins_outs(source))
+    for build in aggregates:
+        build(base)
+    table, _, _ = ingest.ingest_delta(write_delta(base, tmp_path / 'delta.csv'), source)
+    return source, table
+
+
+def test_patched_occupancy_matches_a_rebuild(cache_dir, seeded_source, tmp_path):
+    _, table = ingested(seeded_source, tmp_path, data_functions.occupancy_counts)
+
+    patched = in_memory('occupancy', cache_dir)
+    rebuilt = data_functions.build_occupancy_counts(table)
+    assert data_cache.read_meta('occupancy', cache_dir)['key']['version'] == table.attrs['version']
+    pd.testing.assert_frame_equal(patched, rebuilt)
+
+
+def test_patched_stay_sketches_match_a_rebuild(cache_dir, seeded_source, tmp_path):
+    _, table = ingested(seeded_source, tmp_path, data_functions.stay_sketches)
+
+    patched = in_memory('stay_sketches', cache_dir)
+    rebuilt = data_functions.build_stay_sketches(table)
+    by = ['month_idx','open','type','agegroup','bin']
+    assert len(patched) == len(rebuilt)
+    pd.testing.assert_frame_equal(patched.sort_values(by).reset_index(drop=True),
+                                  rebuilt.sort_values(by).reset_index(drop=True))
+
+
+def test_patched_region_counts_match_a_rebuild(cache_dir, seeded_source, tmp_path):
+    _, table = ingested(seeded_source, tmp_path, geography.region_counts,
+                        lambda d: geography.region_counts(d, 'out'))
+
+    for date_for_comp in ['intake','out']:
+        patched = in_memory(f'regions_{date_for_comp}', cache_dir)
+        rebuilt = geography.build_region_counts(table, date_for_comp)
+        # region stays a categorical on the same regions as a fresh build
+        assert isinstance(patched.region.dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(patched, rebuilt)
+
+
+def test_batches_are_replayed_when_the_workbook_changes(cache_dir, seeded_source, tmp_path, monkeypatch):
+    source = seeded_source()
+    workbook = in_memory('ins_outs', cache_dir)
+    table, _, _ = ingest.ingest_delta(write_delta(data_functions.data_ins_outs(source), tmp_path / 'delta.csv'),
+                                      source)
+
+    # the workbook is exported again, still without the batch
+    monkeypatch.setattr(data_functions, 'read_ins_outs_excel', lambda path: workbook)
+    with open(source, 'a') as f:
+        f.write(' re-exported')
+
+    reloaded = data_functions.data_ins_outs(source)
+    assert reloaded.attrs['version'] == f"{data_functions.base_version(source)}+1"
+    assert sorted(reloaded['id']) == sorted(table['id'])
+    closed = table.set_index('id').out_date
+    assert reloaded.set_index('id').out_date.reindex(closed.index).equals(closed)
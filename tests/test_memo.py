@@ -0,0 +1,81 @@
+import threading
+import time
+import pandas as pd
+import pytest
+import memo
+
+
+def versioned_frame():
+    d = pd.DataFrame({'a':range(10)})
+    d.attrs['version'] = 'memo-test'
+    return d
+
+
+def test_concurrent_misses_compute_once(cache_dir):
+    calls = []
+
+    @memo.memoize
+    def slow_total(d):
+        calls.append(1)
+        time.sleep(0.2)
+        return d['a'].sum()
+
+    d = versioned_frame()
+    start = threading.Barrier(8)
+    results = []
+
+    def run():
+        start.wait()
+        results.append(slow_total(d))
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [45] * 8
+
+
+def test_failed_computation_is_not_cached(cache_dir):
+    calls = []
+
+    @memo.memoize
+    def failing(d):
+        calls.append(1)
+        raise ValueError('no')
+
+    d = versioned_frame()
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            failing(d)
+    assert len(calls) == 2
+    assert memo.CACHE.pending == {}
+
+
+def test_concurrent_figure_requests_build_once(cache_dir):
+    line_plots = pytest.importorskip('line_plots')
+    import plotly.graph_objects as go
+    calls = []
+
+    def slow_figure(n):
+        calls.append(1)
+        time.sleep(0.2)
+        return go.Figure(go.Bar(y=list(range(n))))
+
+    start = threading.Barrier(8)
+    results = []
+
+    def run():
+        start.wait()
+        results.append(line_plots.figure_json(('memo-test-fig', 3), slow_figure, 3))
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert len(set(results)) == 1 and '"y":[0,1,2]' in results[0]
@@ -0,0 +1,94 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import data_functions
+import ingest
+import memo
+import partitions
+
+
+@pytest.fixture
+def shelters(seeded_source, cache_dir, tmp_path, monkeypatch):
+    # two shelters with their own animals, and fresh worker processes that see the same cache and shelters directory
+    shelters_dir = tmp_path / 'shelters'
+    monkeypatch.setattr(data_functions, 'SHELTERS_DIR', str(shelters_dir))
+    sources = {name:seeded_source(shelters_dir / f'{name}.xlsx', n=2000, seed=seed)
+               for seed, name in enumerate(['north', 'south'])}
+
+    monkeypatch.setenv('SHELTER_DASH_CACHE', cache_dir)
+    monkeypatch.setenv('SHELTER_DASH_SHELTERS', str(shelters_dir))
+    monkeypatch.setattr(partitions, 'PARTITION_WORKERS', 2)
+    monkeypatch.setattr(partitions, '_POOLS', [])
+    monkeypatch.setattr(partitions, '_RESULTS', memo.MemoCache())
+    yield sources
+    for pool in partitions._POOLS:
+        pool.shutdown()
+
+
+def combined_table(sources):
+    # every shelter's rows in one table, for the single-table computation the merged results should match
+    tables = [data_functions.data_ins_outs(path) for path in sources.values()]
+    categoricals = [c for c in tables[0] if isinstance(tables[0][c].dtype, pd.CategoricalDtype)]
+    d = pd.concat([pd.DataFrame({c:t[c].astype(object) if c in categoricals else np.array(t[c]) for c in t})
+                   for t in tables], ignore_index=True)
+    d = d.astype({c:'category' for c in categoricals})
+    d.attrs['version'] = 'combined'
+    return data_functions.enrich_ins_outs(d)
+
+
+def canonical(frame, by):
+    # category order differs between the two, so compare values
+    frame = frame.astype({c:str for c in frame if isinstance(frame[c].dtype, pd.CategoricalDtype)})
+    return frame.sort_values(by).reset_index(drop=True)
+
+
+def test_merged_results_match_one_table_of_every_shelter(shelters):
+    coalition = partitions.Coalition(shelters)
+    d = combined_table(shelters)
+    start_date, end_date = datetime.datetime(2013, 2, 10), datetime.datetime(2014, 3, 20)
+    start_month, end_month = datetime.datetime(2013, 2, 1), datetime.datetime(2014, 3, 1)
+
+    pd.testing.assert_frame_equal(data_functions.occupancy_counts(coalition).reset_index(drop=True),
+                                  data_functions.build_occupancy_counts(d), check_dtype=False)
+    assert data_functions.distinct_ids(coalition) == data_functions.distinct_ids(d)
+    assert data_functions.save_rate_counts(coalition, start_date, end_date) == \
+        data_functions.save_rate_counts(d, start_date, end_date)
+    assert data_functions.date_bounds(coalition, 'intake') == data_functions.date_bounds(d, 'intake')
+
+    by = data_functions.CUBE_DIMS
+    merged = data_functions.inout_cube_window(coalition, data_functions.INTAKE_MAPPING, start_date, end_date)
+    single = data_functions.inout_cube_window(d, data_functions.INTAKE_MAPPING, start_date, end_date)
+    pd.testing.assert_frame_equal(canonical(merged, by), canonical(single, by), check_dtype=False)
+
+    by = ['month_idx','open','type','agegroup','bin']
+    pd.testing.assert_frame_equal(canonical(data_functions.stay_sketches(coalition), by),
+                                  canonical(data_functions.build_stay_sketches(d), by), check_dtype=False)
+
+    for merged, single in zip(coalition.merged('general_age_counts', start_month, end_month, end_date),
+                              partitions.general_age_counts(d, start_month, end_month, end_date)):
+        pd.testing.assert_frame_equal(canonical(merged, ['type','agecat']), canonical(single, ['type','agecat']),
+                                      check_dtype=False)
+
+
+def test_a_batch_for_one_shelter_only_changes_that_shelter(shelters, tmp_path):
+    before = partitions.Coalition(shelters)
+    data_functions.occupancy_counts(before)
+
+    north = data_functions.data_ins_outs(shelters['north'])
+    closing = north[north.out_date.isnull()].head(20)
+    pd.DataFrame({'id':closing['id'], 'type':closing['type'].astype(str), 'breed':closing['breed'].astype(str),
+                  'birthday':closing['birthday'], 'intake_date':closing['intake_date'],
+                  'out_date':pd.Timestamp('2014-12-20'), 'out_adopt':1}).to_csv(tmp_path / 'delta.csv', index=False)
+    ingest.ingest_delta(str(tmp_path / 'delta.csv'), shelters['north'])
+
+    after = partitions.Coalition(shelters)
+    assert after.versions['north'] == f"{before.versions['north']}+1"
+    assert after.versions['south'] == before.versions['south']
+    assert after.attrs['version'] != before.attrs['version']
+
+    # only north is run again, south's result is reused
+    hits = partitions._RESULTS.stats()['hits']
+    pd.testing.assert_frame_equal(data_functions.occupancy_counts(after).reset_index(drop=True),
+                                  data_functions.build_occupancy_counts(combined_table(shelters)), check_dtype=False)
+    assert partitions._RESULTS.stats()['hits'] - hits == 1
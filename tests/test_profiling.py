@@ -0,0 +1,25 @@
+import types
+import pytest
+
+pytest.importorskip('streamlit')
+import profiling
+
+
+def test_only_page_level_functions_are_wrapped():
+    module = types.ModuleType('profiling_test_module')
+    exec("def month_index(d): return d\n"
+         "def monthly_in_out_data_prep(d): return d\n"
+         "def build_occupancy_counts(d): return d\n"
+         "def region_bar_plot(d): return d\n"
+         "def _private_plot(d): return d\n", vars(module))
+    helpers = {name:vars(module)[name] for name in ['month_index', '_private_plot']}
+
+    profiling.instrument(module)
+    profiling.instrument(module)
+
+    assert {name for name, f in vars(module).items() if getattr(f, '__profiled__', False)} == \
+        {'monthly_in_out_data_prep', 'build_occupancy_counts', 'region_bar_plot'}
+    assert all(vars(module)[name] is f for name, f in helpers.items())
+    # wrapped once, however many reruns instrument it
+    assert module.region_bar_plot.__wrapped__.__name__ == 'region_bar_plot'
+    assert not hasattr(module.region_bar_plot.__wrapped__, '__wrapped__')
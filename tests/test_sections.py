@@ -0,0 +1,84 @@
+import types
+import datetime
+import pandas as pd
+import pytest
+import data_functions
+
+pytest.importorskip('streamlit')
+import sections
+
+
+@pytest.fixture(params=['thread', 'process'])
+def pool_kind(request, monkeypatch):
+    # a fresh pool of each kind, and an empty session with the sections opened
+    monkeypatch.setattr(sections, 'POOL_KIND', request.param)
+    monkeypatch.setattr(sections, '_POOL', None)
+    monkeypatch.setattr(sections, 'st', types.SimpleNamespace(session_state={'opened_sections':{'general_age',
+                                                                                                 'general_length'}}))
+    yield request.param
+    if sections._POOL is not None:
+        sections._POOL.shutdown()
+
+
+def test_prefetched_general_sections_run_on_either_pool(pool_kind, iodf):
+    start_month, end_month, end_date = datetime.datetime(2013, 1, 1), datetime.datetime(2013, 6, 1), \
+        datetime.datetime(2013, 6, 30)
+    params = (data_functions.dataset_version(iodf), start_month, end_date)
+    preps = [('general_age', 'general_age_prep', data_functions.general_age_data_prep,
+              (iodf, start_month, end_month, end_date)),
+             ('general_length', 'general_length_prep', data_functions.general_length_data_prep,
+              (iodf, start_month, end_month))]
+
+    for section, key, func, args in preps:
+        sections.prefetch_section(section, key, params, func, *args)
+    assert len(sections.st.session_state['section_pending']) == 2
+
+    for section, key, func, args in preps:
+        result = sections.section_result(key, params, func, *args)
+        for got, expected in zip(result, func(*args)):
+            for g, e in zip(got, expected):
+                pd.testing.assert_frame_equal(g, e)
+    assert sections.st.session_state['section_pending'] == {}
+
+
+
+def test_section_results_are_kept_per_params(monkeypatch):
+    monkeypatch.setattr(sections, 'st', types.SimpleNamespace(session_state={}))
+    monkeypatch.setattr(sections, 'MAX_SECTION_RESULTS', 3)
+    calls = []
+
+    def prep(x):
+        calls.append(x)
+        return x * 2
+
+    assert sections.section_result('prep', (1,), prep, 1) == 2
+    assert sections.section_result('prep', (1,), prep, 1) == 2
+    assert sections.section_result('prep', (2,), prep, 2) == 4
+    assert sections.section_result('other', (1,), prep, 1) == 2
+    assert calls == [1, 2, 1]
+
+    # the least recently used result goes first
+    sections.section_result('prep', (1,), prep, 1)
+    sections.section_result('prep', (3,), prep, 3)
+    sections.section_result('prep', (1,), prep, 1)
+    sections.section_result('prep', (2,), prep, 2)
+    assert calls == [1, 2, 1, 3, 2]
+
+
+def test_closed_sections_run_nothing_until_opened(monkeypatch):
+    pressed = []
+    monkeypatch.setattr(sections, 'st', types.SimpleNamespace(session_state={},
+                                                              button=lambda label, key: key in pressed))
+    calls = []
+
+    assert not sections.section_is_open('general_age')
+    sections.prefetch_section('general_age', 'general_age_prep', (1,), calls.append, 1)
+    assert calls == [] and sections.st.session_state.get('section_pending', {}) == {}
+
+    pressed.append('open_general_age')
+    assert sections.section_is_open('general_age')
+    pressed.clear()
+    # stays open on later reruns, without the button being pressed again
+    assert sections.section_is_open('general_age') and sections.section_opened('general_age')
+    assert sections.section_is_open('general_breed', expanded=True)
+    assert not sections.section_opened('general_breed')
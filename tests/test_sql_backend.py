@@ -0,0 +1,75 @@
+import os
+import datetime
+import pandas as pd
+import pytest
+import benchmark
+import data_functions
+
+pytest.importorskip('duckdb')
+import sql_backend
+
+
+@pytest.fixture
+def parquet_dir(cache_dir, monkeypatch):
+    monkeypatch.setattr(sql_backend, 'PARQUET_DIR', f'{cache_dir}/sql')
+    monkeypatch.setattr(sql_backend, '_TABLES', {})
+    return sql_backend.PARQUET_DIR
+
+
+def test_copy_is_made_from_the_columnar_cache(parquet_dir, seeded_source, monkeypatch):
+    monkeypatch.setattr(sql_backend, 'ROW_GROUP_SIZE', 1000)
+    iodf = data_functions.enrich_ins_outs(data_functions.data_ins_outs(seeded_source()))
+
+    assert sql_backend.table_source(iodf) is not iodf
+    flags = list(data_functions.OUTCOME_MAPPING.keys())
+    pd.testing.assert_frame_equal(sql_backend.build_inout_cube(iodf, flags, 'out'),
+                                  data_functions.build_inout_cube(iodf, flags, 'out'))
+    pd.testing.assert_frame_equal(sql_backend.build_occupancy_counts(iodf),
+                                  data_functions.build_occupancy_counts(iodf))
+
+    start_date, end_date = datetime.datetime(2013, 2, 10), datetime.datetime(2013, 9, 3)
+    assert sql_backend.save_rate_counts(iodf, start_date, end_date) == \
+        data_functions.save_rate_counts(iodf, start_date, end_date)
+
+
+def test_copy_is_written_in_date_ordered_chunks(parquet_dir, seeded_source, monkeypatch):
+    import duckdb
+
+    monkeypatch.setattr(sql_backend, 'ROW_GROUP_SIZE', 1000)
+    iodf = data_functions.enrich_ins_outs(data_functions.data_ins_outs(seeded_source()))
+    files = sql_backend.table_path(iodf)
+
+    bounds = duckdb.sql(f"SELECT filename, min(intake_date), max(intake_date), count(*) "
+                        f"FROM read_parquet('{files}', filename=true) GROUP BY filename ORDER BY filename").fetchall()
+    assert [n for _, _, _, n in bounds] == [1000, 1000, 1000]
+    assert all(bounds[i][2] <= bounds[i + 1][1] for i in range(len(bounds) - 1))
+
+
+def test_shelters_keep_their_own_copies(parquet_dir, seeded_source, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_functions, 'BACKEND', 'duckdb')
+    monkeypatch.setattr(data_functions, 'SHELTERS_DIR', str(tmp_path / 'shelters'))
+    north, south = [data_functions.enrich_ins_outs(data_functions.data_ins_outs(
+                        seeded_source(tmp_path / 'shelters' / f'{name}.xlsx', n=2000, seed=seed)))
+                    for seed, name in enumerate(['north', 'south'])]
+
+    # both copies are written before either is queried again
+    expected = {}
+    for shelter in (north, south):
+        sql_backend.table_path(shelter)
+        expected[shelter.attrs['partition']] = data_functions.build_occupancy_counts(shelter)
+
+    for shelter in (north, south):
+        pd.testing.assert_frame_equal(sql_backend.build_occupancy_counts(shelter), expected[shelter.attrs['partition']])
+        assert data_functions.save_rate_counts(shelter) == \
+            (data_functions.distinct_ids(shelter, rows=data_functions.date_rows(shelter, 'out')),
+             data_functions.distinct_ids(shelter, rows=data_functions.date_rows(shelter, 'out'), flag='out_adopt'))
+
+
+def test_queries_match_the_pandas_functions(cache_dir, tmp_path):
+    d = data_functions.enrich_ins_outs(benchmark.synthetic_ins_outs(benchmark.SIZES['10k']))
+    checks = sql_backend.parity_checks(d, 'parity-test', sql_backend.parity_windows(d, 10), str(tmp_path / 'sql'))
+
+    problems = [(name, sql_backend.mismatch(expected, actual)) for name, expected, actual in checks]
+    assert [(name, p) for name, p in problems if p is not None] == []
+    # written where it was asked to, nothing in the shared directory
+    assert os.listdir(tmp_path / 'sql') != [] and not os.path.exists(sql_backend.PARQUET_DIR)